@@ -3,102 +3,435 @@
 
 """
 .env 文件转换为青龙JSON格式工具
-使用方法: python3 env-to-json.py input.env output.json
+使用方法: python3 env-to-json.py input.env output.json (或 output.ndjson)
+推送模式: python3 env-to-json.py --push input.env [--prune] [--dry-run] [--update-mode recreate]
 """
 
+import argparse
+import collections
+import http.client
 import sys
 import json
 import re
 import os
+import urllib.parse
 
-def parse_env_file(file_path):
-    """解析 .env 文件"""
-    envs = []
+# 青龙 OpenAPI 地址与应用凭据（系统设置 -> 应用设置中创建，需要“环境变量”权限）
+DEFAULT_QL_URL = "http://127.0.0.1:5700"
+# 每个新增 / 删除请求携带的变量数
+DEFAULT_BATCH_SIZE = 500
+# 有变化的变量的更新方式：put 逐个原地更新（保留 id 与位置，但每个变量一个请求），
+# recreate 批量删除旧变量后批量新增（请求数只取决于批次数，但 id 与排序位置会变化）
+UPDATE_MODES = ("put", "recreate")
+DEFAULT_UPDATE_MODE = "put"
+HTTP_TIMEOUT = 30
+
+# KEY= 前缀，允许缩进、export 前缀与等号两侧的空白
+ASSIGNMENT = re.compile(r'[ \t]*(?:export[ \t]+)?([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*')
+ESCAPE = re.compile(r'\\(.)', re.S)
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False)
+DOUBLE_QUOTED_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '"': '"', '\\': '\\', '$': '$'}
+# 单引号值只有 \' 与 \\ 两种转义
+SINGLE_QUOTED_ESCAPES = {"'": "'", '\\': '\\'}
+
+
+def _unescape(value, escapes):
+    """一次替换所有转义序列，未知的转义原样保留"""
+    if '\\' not in value:
+        return value
+    return ESCAPE.sub(lambda m: escapes.get(m.group(1), m.group(0)), value)
+
+
+def _closing_quote(text, quote, start):
+    """返回 start 之后第一个未转义的引号位置，没有时返回 -1"""
+    end = text.find(quote, start)
+    while end != -1:
+        backslashes = 0
+        while end - backslashes > start and text[end - backslashes - 1] == '\\':
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end
+        end = text.find(quote, end + 1)
+    return end
+
+
+def iter_env_file(f):
+    """逐行解析 .env 内容，依次产出 {"name", "value", "remarks"}
     
+    支持 export 前缀、行尾 # 注释（未加引号的值中需以空白分隔）以及跨行的引号值。
+    只保留当前条目与已出现的变量名（用于报告重复），内存占用与文件大小无关；
+    重复的变量名会给出警告，但仍然产出（青龙允许同名变量）。引号直到文件末尾
+    都未闭合时只跳过该变量，为寻找闭合引号读入的后续行按普通行重新解析。
+    """
+    seen = {}
+    lines = enumerate(f, 1)
+    # 引号未闭合时退回的行，优先于文件中的后续行读取
+    pending = collections.deque()
+    while True:
+        if pending:
+            line_num, line = pending.popleft()
+        else:
+            item = next(lines, None)
+            if item is None:
+                break
+            line_num, line = item
+        # 解析 KEY=VALUE 格式，值按位置切片，避免逐段复制整行
+        match = ASSIGNMENT.match(line)
+        if match is None:
+            stripped = line.strip()
+            # 跳过空行和注释
+            if stripped and not stripped.startswith('#'):
+                print(f"警告: 第{line_num}行格式不正确，已跳过: {stripped}")
+            continue
+        key = match.group(1)
+        pos = match.end()
+        
+        quote = line[pos:pos + 1]
+        if quote == '"' or quote == "'":
+            escapes = DOUBLE_QUOTED_ESCAPES if quote == '"' else SINGLE_QUOTED_ESCAPES
+            buffer = line
+            continued = []
+            end = _closing_quote(buffer, quote, pos + 1)
+            while end == -1:
+                # 引号未闭合，值延续到下一行
+                next_line = pending.popleft() if pending else next(lines, None)
+                if next_line is None:
+                    break
+                continued.append(next_line)
+                scanned = len(buffer)
+                buffer += next_line[1]
+                end = _closing_quote(buffer, quote, scanned)
+            if end == -1:
+                print(f"警告: 第{line_num}行的 {key} 引号未闭合，已跳过")
+                pending.extendleft(reversed(continued))
+                continue
+            value = _unescape(buffer[pos + 1:end], escapes)
+        else:
+            # 未加引号的值按原样保留，空白后的 # 开始行尾注释
+            if line.startswith('#', pos) and line[pos - 1] in ' \t':
+                comment = pos
+            else:
+                comment = line.find(' #', pos)
+                tab_comment = line.find('\t#', pos)
+                if tab_comment != -1 and (comment == -1 or tab_comment < comment):
+                    comment = tab_comment
+            value = line[pos:comment if comment != -1 else len(line)].strip()
+        
+        if key in seen:
+            print(f"警告: 第{line_num}行的 {key} 与第{seen[key]}行重复")
+        else:
+            seen[key] = line_num
+        
+        yield {
+            "name": key,
+            "value": value,
+            "remarks": f"从.env文件第{line_num}行导入"
+        }
+
+
+def parse_env_file(file_path):
+    """解析 .env 文件，返回全部条目的列表"""
     if not os.path.exists(file_path):
         print(f"错误: 文件 {file_path} 不存在")
         return None
     
     with open(file_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.strip()
-            
-            # 跳过空行和注释
-            if not line or line.startswith('#'):
-                continue
-            
-            # 解析 KEY=VALUE 格式
-            match = re.match(r'^([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.*)$', line)
-            if match:
-                key = match.group(1)
-                value = match.group(2)
-                
-                # 处理引号
-                if value.startswith('"') and value.endswith('"'):
-                    value = value[1:-1]
-                elif value.startswith("'") and value.endswith("'"):
-                    value = value[1:-1]
-                
-                # 处理转义字符
-                value = value.replace('\\n', '\n').replace('\\t', '\t').replace('\\"', '"').replace("\\'", "'")
-                
-                envs.append({
-                    "name": key,
-                    "value": value,
-                    "remarks": f"从.env文件第{line_num}行导入"
-                })
-            else:
-                print(f"警告: 第{line_num}行格式不正确，已跳过: {line}")
+        return list(iter_env_file(f))
+
+
+def write_json_array(envs, f):
+    """逐条写出 JSON 数组，返回写出的条目数"""
+    count = 0
+    f.write('[')
+    for env in envs:
+        f.write(',\n  ' if count else '\n  ')
+        f.write(JSON_ENCODER.encode(env))
+        count += 1
+    f.write('\n]\n' if count else ']\n')
+    return count
+
+
+def write_ndjson(envs, f):
+    """每行一个 JSON 对象，返回写出的条目数"""
+    count = 0
+    for env in envs:
+        f.write(JSON_ENCODER.encode(env))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def preview(envs, limit=10):
+    """透传条目，同时打印前 limit 个变量的预览"""
+    for index, env in enumerate(envs):
+        if index < limit:
+            value_preview = env['value'][:30] + '...' if len(env['value']) > 30 else env['value']
+            print(f"  - {env['name']}: {value_preview}")
+        yield env
+
+class Client:
+    """青龙 OpenAPI 客户端，所有请求复用同一个 keep-alive 连接"""
+    
+    def __init__(self, url, client_id, client_secret, timeout=HTTP_TIMEOUT):
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(f"无效的青龙地址: {url}")
+        connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(parsed.hostname, parsed.port, timeout=timeout)
+        self.prefix = parsed.path.rstrip('/')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token = None
+        self.requests = 0
+    
+    def close(self):
+        self.connection.close()
+    
+    def _request(self, method, path, params=None, body=None):
+        """发送请求并返回响应中的 data，连接被服务端关闭时重连一次"""
+        url = f"{self.prefix}{path}"
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        headers = {"Accept": "application/json"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            headers["Content-Type"] = "application/json"
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        
+        for attempt in range(2):
+            try:
+                self.connection.request(method, url, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                raw = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # keep-alive 连接空闲超时被关闭，重新建立后重试
+                self.connection.close()
+                if attempt:
+                    raise
+        self.requests += 1
+        
+        try:
+            result = json.loads(raw.decode('utf-8'))
+        except ValueError:
+            raise RuntimeError(f"{method} {path} 返回了无法解析的响应 (HTTP {response.status})")
+        if response.status != 200 or result.get("code") != 200:
+            raise RuntimeError(f"{method} {path} 失败 (HTTP {response.status}): "
+                               f"{result.get('message') or result.get('msg') or raw[:200]}")
+        return result.get("data")
     
-    return envs
+    def login(self):
+        data = self._request("GET", "/open/auth/token",
+                             {"client_id": self.client_id, "client_secret": self.client_secret})
+        self.token = data["token"]
+    
+    def get_envs(self):
+        return self._request("GET", "/open/envs", {"searchValue": ""}) or []
+    
+    def create_envs(self, envs):
+        return self._request("POST", "/open/envs", body=envs)
+    
+    def update_env(self, env):
+        return self._request("PUT", "/open/envs", body=env)
+    
+    def delete_envs(self, ids):
+        return self._request("DELETE", "/open/envs", body=ids)
+
+
+def env_id(env):
+    """新版青龙使用 id，旧版使用 _id"""
+    return env["id"] if "id" in env else env.get("_id")
+
+
+def diff_envs(existing, envs):
+    """按变量名对比，返回 (新增, 更新, 未变化, 删除)
+    
+    青龙允许同名变量（如多个账号的 Cookie），同名变量按出现顺序一一对应，
+    多出的 .env 变量新增，多出的青龙变量标记为删除。
+    """
+    current = {}
+    for env in existing:
+        current.setdefault(env["name"], []).append(env)
+    
+    added, updated, unchanged = [], [], []
+    for env in envs:
+        matches = current.get(env["name"])
+        if not matches:
+            added.append(env)
+            continue
+        old = matches.pop(0)
+        if old.get("value") == env["value"]:
+            unchanged.append(old)
+        else:
+            # 保留青龙中的备注，只更新值
+            updated.append({"id": env_id(old), "name": env["name"], "value": env["value"],
+                            "remarks": old.get("remarks") or env["remarks"]})
+    
+    removed = [env for matches in current.values() for env in matches]
+    return added, updated, unchanged, removed
+
+
+def push_envs(client, envs, prune=False, dry_run=False, batch_size=DEFAULT_BATCH_SIZE,
+              update_mode=DEFAULT_UPDATE_MODE):
+    """读取一次青龙中的全部变量，对比后分批应用变化
+    
+    update_mode 为 recreate 时，有变化的变量并入新增批次重新创建，旧 id 并入删除批次，
+    请求数只取决于批次数。以下变量仍逐个原地更新：被禁用的变量（重建后会变为启用），
+    以及青龙中有同名变量的变量（多账号按位置拼接，重建会改变账号顺序，
+    下次推送时按位置对应又会产生新的更新）。
+    """
+    client.login()
+    existing = client.get_envs()
+    added, updated, unchanged, removed = diff_envs(existing, envs)
+    
+    print(f"青龙现有 {len(existing)} 个变量，.env 中 {len(envs)} 个")
+    print(f"  新增: {len(added)}  更新: {len(updated)}  未变化: {len(unchanged)}  "
+          f"青龙独有: {len(removed)}{'（将删除）' if prune else '（保留，--prune 删除）'}")
+    for label, items in (("新增", added), ("更新", updated), ("删除", removed if prune else [])):
+        for env in items[:10]:
+            print(f"  {label}: {env['name']}")
+        if len(items) > 10:
+            print(f"  ... 另有 {len(items) - 10} 个{label}")
+    
+    if dry_run:
+        print("--dry-run: 未做任何修改")
+        return True
+    
+    # OpenAPI 的新增与删除接受数组，按批发送；更新只接受单个变量，只能在同一连接上逐个发送
+    creates = list(added)
+    deletes = [env_id(env) for env in removed] if prune else []
+    puts = updated
+    if update_mode == "recreate":
+        names = {}
+        for env in existing:
+            names[env["name"]] = names.get(env["name"], 0) + 1
+        in_place = {env_id(env) for env in existing if env.get("status") == 1 or names[env["name"]] > 1}
+        puts = [env for env in updated if env["id"] in in_place]
+        recreated = [env for env in updated if env["id"] not in in_place]
+        creates += [{"name": env["name"], "value": env["value"], "remarks": env["remarks"]}
+                    for env in recreated]
+        deletes += [env["id"] for env in recreated]
+    
+    # 先新增再删除，中途失败时最多留下重复的变量，而不会丢失变量
+    for start in range(0, len(creates), batch_size):
+        client.create_envs(creates[start:start + batch_size])
+    for env in puts:
+        client.update_env(env)
+    for start in range(0, len(deletes), batch_size):
+        client.delete_envs(deletes[start:start + batch_size])
+    
+    print(f"✅ 推送完成，共发送 {client.requests} 个请求")
+    return True
+
 
 def main():
-    if len(sys.argv) != 3:
-        print("使用方法: python3 env-to-json.py <输入.env文件> <输出JSON文件>")
-        print("")
-        print(".env文件格式示例:")
-        print('ALI_NAME_LIST="幸卓账户,荣泰主账户,艾荣达账户,SAP账户,稍息账户,一诺康品"')
-        print("API_KEY=your_api_key_here")
-        print("SECRET_TOKEN='your_secret_token'")
-        print("# 注释会被忽略")
-        print("DEBUG=true")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description=".env 文件转换为青龙JSON格式，或直接对比推送到青龙",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+.env文件格式示例:
+  ALI_NAME_LIST="幸卓账户,荣泰主账户,艾荣达账户,SAP账户,稍息账户,一诺康品"
+  API_KEY=your_api_key_here
+  SECRET_TOKEN='your_secret_token'
+  # 注释会被忽略
+  export DEBUG=true  # 支持 export 前缀与行尾注释
+  PRIVATE_KEY="-----BEGIN KEY-----
+  ...
+  -----END KEY-----"
+
+输出为 .ndjson / .jsonl（或 --format ndjson）时每行一个变量，适合超大文件与流式处理
+
+推送到青龙（凭据可通过 QL_URL、QL_CLIENT_ID、QL_CLIENT_SECRET 环境变量提供）:
+  python3 env-to-json.py --push input.env --client-id xxx --client-secret yyy --dry-run
+        """
+    )
+    parser.add_argument('input_file', help='输入 .env 文件')
+    parser.add_argument('output_file', nargs='?', help='输出 JSON 文件（转换模式）')
+    parser.add_argument('--format', choices=['json', 'ndjson'],
+                        help='输出格式，默认按扩展名判断（.ndjson / .jsonl 为每行一个变量，其余为 JSON 数组）')
+    parser.add_argument('--push', action='store_true', help='对比青龙现有变量，只新增和更新有变化的变量')
+    parser.add_argument('--url', default=os.getenv("QL_URL") or DEFAULT_QL_URL,
+                        help=f'青龙地址，默认读取 QL_URL 环境变量或 {DEFAULT_QL_URL}')
+    parser.add_argument('--client-id', default=os.getenv("QL_CLIENT_ID"), help='应用 Client ID')
+    parser.add_argument('--client-secret', default=os.getenv("QL_CLIENT_SECRET"), help='应用 Client Secret')
+    parser.add_argument('--prune', action='store_true', help='同时删除青龙中有而 .env 中没有的变量')
+    parser.add_argument('--dry-run', action='store_true', help='只显示变化，不做修改')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'每个新增 / 删除请求携带的变量数，默认 {DEFAULT_BATCH_SIZE}')
+    parser.add_argument('--update-mode', choices=UPDATE_MODES, default=DEFAULT_UPDATE_MODE,
+                        help='有变化的变量的更新方式：put 逐个原地更新（默认，保留 id 与位置，每个变量一个请求），'
+                             'recreate 批量删除后重新创建（请求更少，但变量 id 与排序位置会变化，同名变量仍原地更新）')
+    args = parser.parse_args()
+    
+    if args.push:
+        if not args.client_id or not args.client_secret:
+            parser.error("--push 需要 --client-id 与 --client-secret")
+        envs = parse_env_file(args.input_file)
+        if envs is None:
+            sys.exit(1)
+        if not envs:
+            print("警告: 没有找到有效的环境变量")
+            sys.exit(1)
+        try:
+            client = Client(args.url, args.client_id, args.client_secret)
+        except ValueError as e:
+            parser.error(str(e))
+        try:
+            push_envs(client, envs, args.prune, args.dry_run, max(1, args.batch_size), args.update_mode)
+        except (OSError, RuntimeError, http.client.HTTPException) as e:
+            print(f"❌ 推送失败: {e}")
+            sys.exit(1)
+        finally:
+            client.close()
+        return
+    
+    if not args.output_file:
+        parser.error("转换模式需要指定输出 JSON 文件")
+    input_file = args.input_file
+    output_file = args.output_file
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    output_format = args.format
+    if output_format is None:
+        output_format = "ndjson" if output_file.endswith((".ndjson", ".jsonl")) else "json"
     
     print("=== .env 文件转换工具 (Python版) ===")
     print(f"输入文件: {input_file}")
-    print(f"输出文件: {output_file}")
+    print(f"输出文件: {output_file} ({output_format})")
     
-    # 解析 .env 文件
-    envs = parse_env_file(input_file)
-    if envs is None:
+    if not os.path.exists(input_file):
+        print(f"错误: 文件 {input_file} 不存在")
         sys.exit(1)
     
-    if not envs:
-        print("警告: 没有找到有效的环境变量")
-        sys.exit(1)
-    
-    # 生成JSON文件
+    # 边解析边写出，先写临时文件再替换，失败时不留下写了一半的输出
+    writer = write_ndjson if output_format == "ndjson" else write_json_array
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(envs, f, ensure_ascii=False, indent=2)
+        print("转换的环境变量:")
+        with open(input_file, 'r', encoding='utf-8') as src, \
+                open(tmp_file, 'w', encoding='utf-8', buffering=1024 * 1024) as dst:
+            count = writer(preview(iter_env_file(src)), dst)
+        
+        if not count:
+            os.unlink(tmp_file)
+            print("警告: 没有找到有效的环境变量")
+            sys.exit(1)
+        os.replace(tmp_file, output_file)
         
+        if count > 10:
+            print(f"  ... 另有 {count - 10} 个变量")
         print(f"✅ 转换完成！")
-        print(f"   共转换 {len(envs)} 个环境变量")
+        print(f"   共转换 {count} 个环境变量")
         print(f"   输出文件: {output_file}")
         print("")
-        print("转换的环境变量:")
-        for env in envs:
-            value_preview = env['value'][:30] + '...' if len(env['value']) > 30 else env['value']
-            print(f"  - {env['name']}: {value_preview}")
-        print("")
-        print("现在可以使用以下命令批量添加到青龙:")
-        print(f"   bash batch-add-envs.sh {output_file}")
+        print("也可以直接对比推送到青龙（只新增和更新有变化的变量）:")
+        print(f"   python3 env-to-json.py --push {input_file} --client-id <ID> --client-secret <SECRET>")
         
-    except Exception as e:
-        print(f"❌ 写入文件失败: {e}")
+    except (OSError, UnicodeDecodeError) as e:
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+        print(f"❌ 转换失败: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+青龙虚拟环境管理器性能基准
+功能：在临时目录中生成模拟的 /ql/data 目录树和本地 wheel 索引，
+     测量 create / check / list / 激活 的耗时、子进程数与写入字节数
+使用方法: python3 qinglong_venv_bench.py --projects 20
+"""
+
+import os
+import sys
+import json
+import re
+import time
+import random
+import hashlib
+import base64
+import zipfile
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import signal
+import contextlib
+import io
+from datetime import datetime
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPT_DIR))
+
+import qinglong_venv_manager  # noqa: E402
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _SlowHandler(_QuietHandler):
+    """模拟很慢的镜像：每个请求先等待 delay 秒"""
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        super().do_GET()
+
+
+class CountingPopen(subprocess.Popen):
+    """统计管理器启动的子进程数量"""
+    count = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.count += 1
+        super().__init__(*args, **kwargs)
+
+
+def read_bytes_written() -> Optional[int]:
+    """当前进程（含已回收的子进程）累计写入的字节数"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _record_hash(data: bytes) -> str:
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=")
+    return "sha256=" + digest.decode("ascii")
+
+
+def build_wheel(wheelhouse: Path, name: str, version: str, requires: List[str]) -> Path:
+    """生成一个纯 Python 的假 wheel（包含正确的 RECORD）"""
+    dist_info = f"{name}-{version}.dist-info"
+    metadata = [
+        "Metadata-Version: 2.1",
+        f"Name: {name}",
+        f"Version: {version}",
+    ] + [f"Requires-Dist: {req}" for req in requires]
+    files = {
+        f"{name}/__init__.py": f'__version__ = "{version}"\n',
+        f"{name}/core.py": "def value():\n    return %r\n" % (name * 8),
+        f"{dist_info}/METADATA": "\n".join(metadata) + "\n",
+        f"{dist_info}/WHEEL": "Wheel-Version: 1.0\nGenerator: qinglong-venv-bench\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+        f"{dist_info}/top_level.txt": name + "\n",
+    }
+    record_lines = []
+    wheel_path = wheelhouse / f"{name}-{version}-py3-none-any.whl"
+    with zipfile.ZipFile(wheel_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for arcname, content in files.items():
+            data = content.encode("utf-8")
+            zf.writestr(arcname, data)
+            record_lines.append(f"{arcname},{_record_hash(data)},{len(data)}")
+        record_lines.append(f"{dist_info}/RECORD,,")
+        zf.writestr(f"{dist_info}/RECORD", "\n".join(record_lines) + "\n")
+    return wheel_path
+
+
+def build_index(root: Path, packages: int, rng: random.Random) -> Dict[str, List[str]]:
+    """生成 wheel 仓库与 PEP 503 简单索引，返回 {包名: [版本...]}"""
+    files_dir = root / "files"
+    simple_dir = root / "simple"
+    files_dir.mkdir(parents=True)
+    catalog = {}
+    for i in range(packages):
+        name = f"qlbench_pkg{i:03d}"
+        versions = ["1.0.0", "1.1.0"] if rng.random() < 0.5 else ["1.0.0"]
+        # 只依赖编号更小的包，保证依赖图无环
+        requires = [f"qlbench_pkg{j:03d}>=1.0" for j in rng.sample(range(i), min(i, rng.randint(0, 2)))]
+        links = []
+        for version in versions:
+            wheel = build_wheel(files_dir, name, version, requires)
+            digest = hashlib.sha256(wheel.read_bytes()).hexdigest()
+            links.append(f'<a href="../../files/{wheel.name}#sha256={digest}">{wheel.name}</a>')
+        project_dir = simple_dir / name.replace("_", "-")
+        project_dir.mkdir(parents=True)
+        (project_dir / "index.html").write_text(
+            "<!DOCTYPE html><html><body>\n" + "<br/>\n".join(links) + "\n</body></html>\n",
+            encoding="utf-8"
+        )
+        catalog[name] = versions
+    (simple_dir / "index.html").write_text(
+        "<!DOCTYPE html><html><body>\n"
+        + "\n".join(f'<a href="{n.replace("_", "-")}/">{n}</a>' for n in catalog)
+        + "\n</body></html>\n",
+        encoding="utf-8"
+    )
+    return catalog
+
+
+def _requirement_line(name: str, versions: List[str], rng: random.Random) -> str:
+    style = rng.choice(["pin", "range", "bare", "comment"])
+    if style == "pin":
+        return f"{name}=={rng.choice(versions)}"
+    if style == "range":
+        return f"{name}>=1.0,<2"
+    if style == "comment":
+        return f"{name}  # 内联注释"
+    return name
+
+
+def build_projects(data_dir: Path, count: int, catalog: Dict[str, List[str]],
+                   rng: random.Random) -> List[str]:
+    """生成 N 个带 requirements.txt 的模拟项目（含注释、版本约束和 -r 引用）"""
+    names = sorted(catalog)
+    projects = []
+    for i in range(count):
+        project = f"bench_project_{i:03d}"
+        (data_dir / "scripts" / project).mkdir(parents=True)
+        repo_project = data_dir / "repo" / project
+        repo_project.mkdir(parents=True)
+        (data_dir / "scripts" / project / "main.py").write_text("print('hello')\n", encoding="utf-8")
+
+        chosen = rng.sample(names, rng.randint(3, min(8, len(names))))
+        lines = [f"# {project} 的依赖", ""]
+        if i % 3 == 0:
+            common = chosen[:2]
+            chosen = chosen[2:]
+            (repo_project / "requirements-common.txt").write_text(
+                "\n".join(_requirement_line(n, catalog[n], rng) for n in common) + "\n",
+                encoding="utf-8"
+            )
+            lines.append("-r requirements-common.txt")
+        lines.extend(_requirement_line(n, catalog[n], rng) for n in chosen)
+        (repo_project / "requirements.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        projects.append(project)
+    return projects
+
+
+def load_activation_function(data_dir: Path):
+    """从安装器中提取 sitecustomize 的激活函数"""
+    installer = (SCRIPT_DIR / "qinglong_venv_installer.sh").read_text(encoding="utf-8")
+    match = re.search(r"^VENV_ACTIVATION_MAP = .*?(?=^def run\(\):)", installer, re.M | re.S)
+    if not match:
+        raise RuntimeError("安装器中未找到 auto_activate_venv_after_env_loaded")
+    namespace = {"os": os, "sys": sys, "json": json, "subprocess": subprocess, "signal": signal}
+    exec(match.group(0), namespace)
+    return namespace["auto_activate_venv_after_env_loaded"]
+
+
+class Bench:
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        self.results = {}
+
+    @contextlib.contextmanager
+    def measure(self, operation: str, items: int = 1):
+        sink = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        CountingPopen.count = 0
+        bytes_before = read_bytes_written()
+        start = time.perf_counter()
+        with sink:
+            yield
+        wall = time.perf_counter() - start
+        bytes_after = read_bytes_written()
+        self.results[operation] = {
+            "wall_seconds": round(wall, 6),
+            "per_item_seconds": round(wall / max(items, 1), 6),
+            "items": items,
+            "subprocesses": CountingPopen.count,
+            "bytes_written": None if bytes_before is None else bytes_after - bytes_before,
+        }
+        print(f"  {operation:<20} {wall:9.3f}s  子进程 {CountingPopen.count:4d}  "
+              f"写入 {_format_bytes(self.results[operation]['bytes_written'])}")
+
+
+def _format_bytes(value: Optional[int]) -> str:
+    if value is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024 or unit == "GB":
+            return f"{value:.1f}{unit}" if unit != "B" else f"{value}B"
+        value /= 1024.0
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "-C", str(SCRIPT_DIR), "describe", "--always", "--dirty"],
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def summarize_phases(events_file: Path) -> Dict[str, Dict]:
+    """汇总管理器记录的阶段事件（次数与总耗时），不同安装后端的解析、安装阶段同名，可直接对比"""
+    phases = {}
+    if not events_file.exists():
+        return phases
+    with open(events_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            entry = phases.setdefault(event["phase"], {"runs": 0, "seconds": 0.0})
+            entry["runs"] += 1
+            entry["seconds"] = round(entry["seconds"] + event.get("duration_seconds", 0.0), 3)
+    return phases
+
+
+def print_phases(phases: Dict[str, Dict]):
+    print("\n  阶段耗时:")
+    for name, entry in sorted(phases.items(), key=lambda item: -item[1]["seconds"]):
+        print(f"    {name:<18} {entry['runs']:5d} 次 {entry['seconds']:9.3f}s")
+
+
+def compare_with_previous(results_file: Path, record: Dict):
+    """与上一次相同参数的运行结果对比"""
+    previous = None
+    if results_file.exists():
+        with open(results_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("params") == record["params"]:
+                    previous = entry
+    if previous is None:
+        print("\n没有可对比的历史结果")
+        return
+    print(f"\n与 {previous['revision']} ({previous['timestamp']}) 对比:")
+    for operation, current in record["results"].items():
+        old = previous["results"].get(operation)
+        if not old or not old["wall_seconds"]:
+            continue
+        change = (current["wall_seconds"] - old["wall_seconds"]) / old["wall_seconds"] * 100
+        print(f"  {operation:<20} {old['wall_seconds']:9.3f}s -> {current['wall_seconds']:9.3f}s  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="青龙虚拟环境管理器性能基准")
+    parser.add_argument("--projects", type=int, default=10, help="模拟项目数量")
+    parser.add_argument("--packages", type=int, default=30, help="本地索引中的包数量")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，保证生成的目录树可复现")
+    parser.add_argument("--activations", type=int, default=1000, help="激活路径的重复次数")
+    parser.add_argument("--results", default=str(SCRIPT_DIR / "bench_results.jsonl"), help="结果文件 (JSON Lines)")
+    parser.add_argument("--slow-mirror", type=float, default=0.0,
+                        help="额外启动一个每次请求延迟指定秒数的镜像并排在索引列表首位，验证按延迟选择镜像")
+    parser.add_argument("--installer", choices=sorted(qinglong_venv_manager.INSTALLER_BACKENDS), default="pip",
+                        help="安装后端，用同一组场景对比 pip 与 uv 的耗时")
+    parser.add_argument("--keep", action="store_true", help="保留生成的临时目录")
+    parser.add_argument("--verbose", action="store_true", help="显示管理器输出")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    root = Path(tempfile.mkdtemp(prefix="qlbench-"))
+    data_dir = root / "data"
+    server = None
+    slow_server = None
+    saved_env = dict(os.environ)
+    saved_popen = subprocess.Popen
+    try:
+        catalog = build_index(root / "index", args.packages, rng)
+        projects = build_projects(data_dir, args.projects, catalog, rng)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=str(root / "index")))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        index_url = f"http://127.0.0.1:{server.server_address[1]}/simple"
+        if args.slow_mirror > 0:
+            handler = type("SlowHandler", (_SlowHandler,), {"delay": args.slow_mirror})
+            slow_server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(root / "index")))
+            threading.Thread(target=slow_server.serve_forever, daemon=True).start()
+            index_url = f"http://127.0.0.1:{slow_server.server_address[1]}/simple {index_url}"
+
+        # 隔离 pip 配置，只使用本地索引
+        for key in ("PIP_INDEX_URL", "PIP_EXTRA_INDEX_URL", "PIP_FIND_LINKS"):
+            os.environ.pop(key, None)
+        os.environ.update({
+            "PIP_CONFIG_FILE": os.devnull,
+            "PIP_CACHE_DIR": str(root / "pip-cache"),
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+            "QL_DATA_DIR": str(data_dir),
+            "QL_VENV_INDEX_URL": index_url,
+            "QL_VENV_INSTALLER": args.installer,
+        })
+        subprocess.Popen = CountingPopen
+
+        manager = qinglong_venv_manager.QingLongVenvManager(data_dir=str(data_dir))
+        bench = Bench(verbose=args.verbose)
+        print(f"基准目录: {root}")
+        print(f"项目数: {len(projects)}  包数: {len(catalog)}  安装后端: {args.installer}  索引: {index_url}\n")
+
+        with bench.measure("template"):
+            manager.build_template()
+        with bench.measure("create_cold", len(projects)):
+            for project in projects:
+                manager.create_python_venv(project)
+        with bench.measure("create_warm", len(projects)):
+            for project in projects:
+                manager.create_python_venv(project)
+
+        # 每个项目追加一个依赖，测量增量更新
+        names = sorted(catalog)
+        for project in projects:
+            with open(data_dir / "repo" / project / "requirements.txt", "a", encoding="utf-8") as f:
+                f.write(rng.choice(names) + "\n")
+        with bench.measure("create_incremental", len(projects)):
+            for project in projects:
+                manager.create_python_venv(project)
+
+        with bench.measure("check", len(projects)):
+            for project in projects:
+                manager.check_dependencies_changed(project)
+        with bench.measure("list"):
+            manager.list_venvs()
+
+        activate = load_activation_function(data_dir)
+        saved_cwd = os.getcwd()
+        saved_path = list(sys.path)
+        saved_env_inner = dict(os.environ)
+        with bench.measure("activation", args.activations):
+            for i in range(args.activations):
+                os.chdir(data_dir / "scripts" / projects[i % len(projects)])
+                activate()
+                sys.path[:] = saved_path
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env_inner)
+        phases = summarize_phases(Path(manager.events_file))
+        print_phases(phases)
+
+        record = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "params": {
+                "projects": args.projects,
+                "packages": args.packages,
+                "seed": args.seed,
+                "activations": args.activations,
+                "slow_mirror": args.slow_mirror,
+                "installer": args.installer,
+            },
+            "results": bench.results,
+            "phases": phases,
+        }
+        results_file = Path(args.results)
+        compare_with_previous(results_file, record)
+        with open(results_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"\n结果已追加到 {results_file}")
+    finally:
+        subprocess.Popen = saved_popen
+        os.environ.clear()
+        os.environ.update(saved_env)
+        for running in (server, slow_server):
+            if running is not None:
+                running.shutdown()
+        if args.keep:
+            print(f"已保留临时目录: {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -137,7 +137,6 @@ import builtins
 import sys
 import env
 import signal
-from client import Client
 
 
 def try_parse_int(value):
@@ -167,99 +166,142 @@ def expand_range(range_str, max_value):
     return result
 
 
+VENV_ACTIVATION_MAP = os.path.join(os.getenv("QL_DATA_DIR", "/ql/data"), "venv_cache", "activation.json")
+VENV_SCRIPTS_DIR = os.path.join(os.getenv("QL_DATA_DIR", "/ql/data"), "scripts")
+
+
 def auto_activate_venv_after_env_loaded():
     """
     在环境变量加载完成后自动激活虚拟环境
     
+    激活信息由 qinglong_venv_manager.py 在构建虚拟环境时预先写入
+    VENV_ACTIVATION_MAP，这里只读取一次映射文件。映射中没有登记的项目
+    （如升级前构建、尚未 reindex 的环境）只检查一次当前解释器版本的
+    site-packages 目录。
+    
     检测逻辑:
     1. 从当前工作目录检测项目名称
-    2. 从脚本路径检测项目名称  
-    3. 向上查找包含 .venv 的目录
+    2. 从脚本路径检测项目名称
+    3. 当前目录位于某个已登记项目目录之内
+    4. 未登记但 scripts 目录下带有 .venv 的项目
     
     激活逻辑:
-    1. 查找项目的 .venv 目录
-    2. 将 site-packages 添加到 sys.path
-    3. 设置相关环境变量
+    1. 更新 usage 标记文件的 mtime，供 gc 判断最近使用时间
+    2. 环境已被 gc 回收时，调用映射中的 rehydrate 命令按锁定结果重建；
+       超过 rehydrate_timeout 秒时终止重建并加入后台构建队列，本次不激活
+    3. 将 site-packages 及 .pth 中的路径添加到 sys.path
+    4. 执行 .pth 中的 import 行（可编辑安装、命名空间包）
+    5. 设置相关环境变量
     """
     try:
-        # 获取当前工作目录和脚本路径
+        try:
+            with open(VENV_ACTIVATION_MAP, 'r', encoding='utf-8') as f:
+                activation_map = json.load(f)
+        except (OSError, ValueError):
+            activation_map = {}
+        
+        projects = activation_map.get("projects", {})
+        scripts_path = activation_map.get("scripts_dir", VENV_SCRIPTS_DIR).rstrip('/') + '/'
         current_dir = os.getcwd()
         script_file = sys.argv[0] if sys.argv else ""
         
-        project_dir = None
         project_name = None
         
-        # 方法1: 从当前工作目录检测项目
-        if '/ql/data/scripts/' in current_dir:
-            scripts_path = '/ql/data/scripts/'
-            if current_dir.startswith(scripts_path):
-                relative_path = current_dir[len(scripts_path):]
-                if relative_path:
-                    project_name = relative_path.split('/')[0]
-                    project_dir = os.path.join(scripts_path, project_name)
-        
-        # 方法2: 从脚本路径检测项目
-        if not project_dir and script_file and '/ql/data/scripts/' in script_file:
-            scripts_path = '/ql/data/scripts/'
-            if script_file.startswith(scripts_path):
-                relative_path = script_file[len(scripts_path):]
-                if relative_path:
-                    project_name = relative_path.split('/')[0]
-                    project_dir = os.path.join(scripts_path, project_name)
+        # 方法1、2: 从当前工作目录或脚本路径检测项目
+        for path in (current_dir, script_file):
+            if path.startswith(scripts_path):
+                name = path[len(scripts_path):].split('/')[0]
+                if name in projects:
+                    project_name = name
+                    break
         
-        # 方法3: 向上查找包含 .venv 的目录
-        if not project_dir:
-            check_dir = current_dir
-            max_depth = 5  # 最多向上查找5级目录
-            depth = 0
-            
-            while check_dir and check_dir != '/' and check_dir != '/ql' and depth < max_depth:
-                if os.path.isdir(os.path.join(check_dir, '.venv')):
-                    project_dir = check_dir
-                    project_name = os.path.basename(check_dir)
+        # 方法3: 当前目录位于已登记的项目目录之内
+        if not project_name:
+            for name, entry in projects.items():
+                project_dir = entry["project_dir"]
+                if current_dir == project_dir or current_dir.startswith(project_dir + '/'):
+                    project_name = name
                     break
-                parent_dir = os.path.dirname(check_dir)
-                if parent_dir == check_dir:  # 到达根目录
+        
+        # 方法4: 映射中没有登记，回退到检查项目的 .venv
+        if not project_name:
+            for path in (current_dir, script_file):
+                if not path.startswith(scripts_path):
+                    continue
+                name = path[len(scripts_path):].split('/')[0]
+                venv_dir = os.path.join(scripts_path, name, '.venv')
+                site_packages = os.path.join(venv_dir, 'lib', f'python{sys.version_info[0]}.{sys.version_info[1]}',
+                                             'site-packages')
+                if name and os.path.isdir(site_packages):
+                    project_name = name
+                    projects = {name: {
+                        "site_packages": site_packages,
+                        "env": {"VIRTUAL_ENV": venv_dir, "VIRTUAL_ENV_PROJECT": name},
+                    }}
                     break
-                check_dir = parent_dir
-                depth += 1
         
-        # 如果找到了项目目录，激活虚拟环境
-        if project_dir and project_name:
-            venv_dir = os.path.join(project_dir, '.venv')
-            
-            if os.path.isdir(venv_dir):
-                # 检查多个可能的 Python 版本路径
-                possible_site_packages = [
-                    os.path.join(venv_dir, 'lib', 'python3.11', 'site-packages'),
-                    os.path.join(venv_dir, 'lib', 'python3.10', 'site-packages'),
-                    os.path.join(venv_dir, 'lib', 'python3.9', 'site-packages'),
-                    os.path.join(venv_dir, 'lib', 'python3.12', 'site-packages'),
-                    os.path.join(venv_dir, 'lib', 'python3.8', 'site-packages'),
-                ]
-                
-                for site_packages in possible_site_packages:
-                    if os.path.isdir(site_packages):
-                        # 检查是否已经添加过
-                        if site_packages not in sys.path:
-                            # 将虚拟环境路径添加到 sys.path 的第二位（第一位是当前目录）
-                            sys.path.insert(1, site_packages)
-                            print(f"[VENV_AUTO] ✅ 已激活虚拟环境: {project_name}")
-                            print(f"[VENV_AUTO] 虚拟环境路径: {site_packages}")
-                            
-                            # 设置环境变量
-                            os.environ['VIRTUAL_ENV'] = venv_dir
-                            os.environ['VIRTUAL_ENV_PROJECT'] = project_name
-                            
-                            return True
-                        else:
-                            # 已经激活过，静默返回
-                            return True
-                
-                # 如果找到 .venv 目录但没有找到 site-packages
-                # print(f"[VENV_AUTO] ⚠️  项目 {project_name} 的虚拟环境可能损坏")
+        if not project_name:
+            return False
         
-        return False
+        # 记录最近使用时间：只更新 mtime，不写内容
+        usage_file = os.path.join(activation_map.get("usage_dir", ""), project_name)
+        try:
+            os.utime(usage_file)
+        except OSError:
+            try:
+                os.makedirs(os.path.dirname(usage_file), exist_ok=True)
+                open(usage_file, 'a').close()
+            except OSError:
+                pass
+        
+        entry = projects[project_name]
+        if entry.get("evicted"):
+            rehydrate = activation_map.get("rehydrate")
+            # 重建过程本身也会启动 Python，避免递归
+            if not rehydrate or os.getenv("QL_VENV_REHYDRATING"):
+                return False
+            print(f"[VENV_AUTO] 虚拟环境已被回收，正在重建: {project_name}")
+            rehydrate_env = dict(os.environ, QL_VENV_REHYDRATING="1")
+            # 独立的进程组，超时时连同 pip 等子进程一起终止
+            process = subprocess.Popen(rehydrate + [project_name], env=rehydrate_env, start_new_session=True)
+            try:
+                returncode = process.wait(timeout=activation_map.get("rehydrate_timeout", 120))
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                enqueue = activation_map.get("enqueue")
+                if enqueue:
+                    subprocess.run(enqueue + [project_name], env=rehydrate_env, timeout=30,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                print(f"[VENV_AUTO] 重建超时，已加入后台构建队列: {project_name}")
+                return False
+            if returncode != 0:
+                return False
+            with open(VENV_ACTIVATION_MAP, 'r', encoding='utf-8') as f:
+                entry = json.load(f).get("projects", {}).get(project_name)
+            if not entry or entry.get("evicted"):
+                return False
+        
+        site_packages = entry["site_packages"]
+        
+        # 已经激活过，静默返回
+        if site_packages in sys.path:
+            return True
+        
+        # 将虚拟环境路径添加到 sys.path 的第二位（第一位是当前目录）
+        sys.path[1:1] = [site_packages] + entry.get("paths", [])
+        for line in entry.get("imports", []):
+            try:
+                exec(line, {})
+            except Exception:
+                pass
+        
+        # 设置环境变量
+        os.environ.update(entry.get("env", {}))
+        
+        print(f"[VENV_AUTO] ✅ 已激活虚拟环境: {project_name}")
+        print(f"[VENV_AUTO] 虚拟环境路径: {site_packages}")
+        return True
         
     except Exception as e:
         # 静默处理异常，不影响正常的Python执行
@@ -275,9 +317,6 @@ def run():
         split_str = "__sitecustomize__"
         file_name = sys.argv[0].replace(f"{os.getenv('dir_scripts')}/", "")
         
-        # 创建临时文件路径
-        temp_file = f"/tmp/env_{os.getpid()}.json"
-        
         # 构建命令数组
         commands = [
             f'source {os.getenv("file_task_before")} {file_name}'
@@ -285,41 +324,33 @@ def run():
         
         task_before = os.getenv("task_before")
         if task_before:
-            escaped_task_before = task_before.replace('"', '\\"').replace("$", "\\$")
-            commands.append(f"eval '{escaped_task_before}'")
+            # task_before 已在环境变量中，直接 eval 无需转义
+            commands.append('eval "$task_before"')
             print("执行前置命令\n")
             
         commands.append(f"echo -e '{split_str}'")
         
-        # 修改 Python 命令，使用单行并正确处理引号
-        python_cmd = f"python3 -c 'import os,json; f=open(\\\"{temp_file}\\\",\\\"w\\\"); json.dump(dict(os.environ),f); f.close()'"
-        commands.append(python_cmd)
+        # 环境变量以 NUL 分隔通过管道返回，无需临时文件和第二个 Python 进程
+        commands.append("env -0")
         
         command = " && ".join(cmd for cmd in commands if cmd)
-        command = f'bash -c "{command}"'
 
-        res = subprocess.check_output(command, shell=True, encoding="utf-8")
-        output = res.split(split_str)[0]
+        res = subprocess.check_output(["bash", "-c", command])
+        output, _, env_block = res.partition(split_str.encode())
+        output = output.decode("utf-8", errors="replace")
 
         try:
-            with open(temp_file, 'r') as f:
-                env_json = json.loads(f.read())
-
-            for key, value in env_json.items():
-                os.environ[key] = value
-
-            os.unlink(temp_file)
+            for item in env_block.lstrip(b"\n").split(b"\0"):
+                key, sep, value = item.partition(b"=")
+                if sep and key and key != b"_":
+                    os.environ[os.fsdecode(key)] = os.fsdecode(value)
             
             # 🎯 关键：在环境变量加载完成后激活虚拟环境
             # 这确保了青龙的环境变量已经加载，虚拟环境可以正常访问
             auto_activate_venv_after_env_loaded()
             
-        except Exception as json_error:
-            print(f"⚠ Failed to parse environment variables: {json_error}")
-            try:
-                os.unlink(temp_file)
-            except:
-                pass
+        except Exception as env_error:
+            print(f"⚠ Failed to parse environment variables: {env_error}")
 
         if len(output) > 0:
             print(output)
@@ -363,13 +394,24 @@ try:
 
     run()
 
-    from __ql_notify__ import send
+    class LazyQLAPI:
+        """首次使用 QLAPI 时才导入 client 与 __ql_notify__"""
 
-    class BaseApi(Client):
-        def notify(self, *args, **kwargs):
-            return send(*args, **kwargs)
+        _instance = None
 
-    QLAPI = BaseApi()
+        def __getattr__(self, name):
+            if LazyQLAPI._instance is None:
+                from client import Client
+                from __ql_notify__ import send
+
+                class BaseApi(Client):
+                    def notify(self, *args, **kwargs):
+                        return send(*args, **kwargs)
+
+                LazyQLAPI._instance = BaseApi()
+            return getattr(LazyQLAPI._instance, name)
+
+    QLAPI = LazyQLAPI()
     builtins.QLAPI = QLAPI
 except Exception as error:
     print(f"run builtin code error: {error}\n")
@@ -589,7 +631,13 @@ install_shell_patch() {
     
     # 检查是否已经安装
     if grep -q "auto_create_venv_in_shell" "$UPDATE_SCRIPT"; then
-        log_warning "Shell 补丁已存在，跳过安装"
+        # 旧版补丁同步执行 create，升级为只入队
+        if grep -q 'qinglong_venv_manager.py create "${uniq_path}"' "$UPDATE_SCRIPT"; then
+            sed -i 's|qinglong_venv_manager.py create "${uniq_path}" 2>&1 \|\| echo "虚拟环境创建失败，但不影响订阅执行"|qinglong_venv_manager.py enqueue "${uniq_path}" 2>\&1 \|\| echo "虚拟环境任务入队失败，但不影响订阅执行"|; s|echo -e "虚拟环境自动创建完成\\n"|echo -e "已加入后台构建队列，可通过 qinglong_venv_manager.py status 查看进度\\n"|' "$UPDATE_SCRIPT"
+            log_success "Shell 补丁已升级为后台构建队列"
+        else
+            log_warning "Shell 补丁已存在，跳过安装"
+        fi
         return
     fi
     
@@ -602,8 +650,8 @@ install_shell_patch() {
     # 🎯 自动创建虚拟环境 (auto_create_venv_in_shell)\
     if [[ -f "/ql/scripts/qinglong_venv_manager.py" ]]; then\
       echo -e "\\n## 自动创建虚拟环境...\\n"\
-      python3 /ql/scripts/qinglong_venv_manager.py create "${uniq_path}" 2>&1 || echo "虚拟环境创建失败，但不影响订阅执行"\
-      echo -e "虚拟环境自动创建完成\\n"\
+      python3 /ql/scripts/qinglong_venv_manager.py enqueue "${uniq_path}" 2>&1 || echo "虚拟环境任务入队失败，但不影响订阅执行"\
+      echo -e "已加入后台构建队列，可通过 qinglong_venv_manager.py status 查看进度\\n"\
     fi' "$UPDATE_SCRIPT"
     
     # 删除备份文件
@@ -742,6 +790,17 @@ check_install_status() {
     fi
 }
 
+# 按磁盘上已有的虚拟环境重建状态索引与激活映射，升级前构建的环境无需重建即可激活
+reindex_venvs() {
+    log_info "重建虚拟环境状态索引..."
+    
+    if python3 "$MANAGER_SCRIPT" reindex; then
+        log_success "状态索引与激活映射已更新"
+    else
+        log_warning "状态索引重建失败，可稍后手动执行: python3 $MANAGER_SCRIPT reindex"
+    fi
+}
+
 # 安装系统
 install_system() {
     show_banner
@@ -757,6 +816,7 @@ install_system() {
     create_auto_venv_script
     install_shell_patch
     install_manager_tool
+    reindex_venvs
     
     echo
     log_success "🎉 青龙虚拟环境管理系统安装完成！"
@@ -829,6 +889,7 @@ repair_system() {
     create_auto_venv_script
     install_shell_patch
     install_manager_tool
+    reindex_venvs
     
     log_success "🎉 系统修复完成"
     
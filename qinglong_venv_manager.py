@@ -14,10 +14,41 @@ import json
 import argparse
 import shutil
 import hashlib
+import importlib.util
+import re
+import zipfile
+import tempfile
+import csv
+import io
+import sqlite3
+import threading
+import time
+import fcntl
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+import logging
+import queue
+import platform
+import sysconfig
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
 class Colors:
     """终端颜色定义"""
     RED = '\033[0;31m'
@@ -29,14 +60,448 @@ class Colors:
     WHITE = '\033[1;37m'
     NC = '\033[0m'  # No Color
 
+def canonical_name(name: str) -> str:
+    """按 PEP 503 规范化包名"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def normalize_requirement(line: str) -> str:
+    """将一条 PEP 508 依赖规范化：包名小写、extras 与版本约束排序、去除多余空白"""
+    requirement, _, marker = line.partition(";")
+    marker = " ".join(marker.replace("'", '"').split())
+    requirement = requirement.strip()
+
+    match = re.match(r"^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?\s*(.*)$", requirement)
+    if "://" in requirement.split("@")[0] or requirement.startswith((".", "/")) or not match:
+        # URL、本地路径等无法解析的形式只规范空白
+        normalized = " ".join(requirement.split())
+    else:
+        name, extras, spec = match.groups()
+        normalized = canonical_name(name)
+        if extras:
+            extras = sorted(canonical_name(e.strip()) for e in extras.strip("[]").split(",") if e.strip())
+            normalized += f"[{','.join(extras)}]"
+        spec = spec.strip()
+        if spec.startswith("@"):
+            normalized += " @ " + spec[1:].strip()
+        elif spec:
+            spec = spec.strip("()")
+            normalized += ",".join(sorted(part.replace(" ", "") for part in spec.split(",") if part.strip()))
+
+    return f"{normalized}; {marker}" if marker else normalized
+
+# 状态索引表结构，JSON 字段以文本形式保存
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS venvs (
+    project_name TEXT PRIMARY KEY,
+    project_dir TEXT NOT NULL,
+    venv_dir TEXT,
+    python_version TEXT,
+    dependency_hashes TEXT NOT NULL DEFAULT '{}',
+    packages TEXT NOT NULL DEFAULT '[]',
+    package_count INTEGER NOT NULL DEFAULT 0,
+    build_seconds REAL,
+    created_at TEXT,
+    last_updated TEXT,
+    last_activated TEXT
+)
+"""
+
+# dedupe 的文件哈希缓存，size / mtime / inode 未变化时不再重新计算
+FILE_HASH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT NOT NULL
+)
+"""
+
+# 每个项目、每个阶段最近一次运行的指标，用于导出 Prometheus textfile
+PHASE_METRICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS phase_metrics (
+    project_name TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    last_duration REAL NOT NULL,
+    last_success INTEGER NOT NULL,
+    last_run REAL NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    duration_sum REAL NOT NULL DEFAULT 0,
+    bytes_downloaded INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (project_name, phase)
+)
+"""
+
+# 构建任务队列；同一项目最多一个排队中的任务，重复入队时合并
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_name TEXT NOT NULL,
+    force INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    requests INTEGER NOT NULL DEFAULT 1,
+    enqueued_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    duration REAL,
+    worker_pid INTEGER
+)
+"""
+JOBS_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS jobs_queued_project ON jobs (project_name) WHERE status = 'queued'"
+
+# 共享虚拟环境的引用：项目的当前代或保留的代指向该环境时各记一行，最后一个引用释放时删除环境
+SHARED_VENV_REFS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_venv_refs (
+    lock_hash TEXT NOT NULL,
+    project_name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (lock_hash, project_name)
+)
+"""
+
+# 状态索引自身的元数据；reindex 完成后写入 indexed_at，没有该行说明索引还未包含磁盘上已有的环境
+STATE_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+"""
+
+# 后续版本新增的列，打开数据库时自动补齐
+STATE_MIGRATIONS = [
+    ("resolved", "TEXT NOT NULL DEFAULT '{}'"),
+    ("activation", "TEXT NOT NULL DEFAULT '{}'"),
+    ("evicted_at", "TEXT"),
+]
+
+# 默认的 PyPI 镜像
+DEFAULT_INDEX_URL = "https://pypi.tuna.tsinghua.edu.cn/simple"
+
+# 探测索引延迟时请求的项目页与超时（秒）；pip 单次网络读取的超时
+INDEX_PROBE_PROJECT = "pip"
+INDEX_PROBE_TIMEOUT = 5
+INDEX_SOCKET_TIMEOUT = 60
+
+# pip / uv 输出中出现这些内容时视为索引故障（而不是依赖本身无法解析），该索引进入退避期
+INDEX_FAILURE_MARKERS = ("Could not fetch URL", "Max retries exceeded", "Read timed out", "NewConnectionError",
+                         "ConnectTimeoutError", "ProtocolError", "Connection reset", "HTTP error 5",
+                         "Network is unreachable", "Temporary failure in name resolution",
+                         "error sending request", "operation timed out", "dns error")
+
+# 本地 wheelhouse 中可被 --find-links 直接使用的文件
+DISTRIBUTION_SUFFIXES = (".whl", ".tar.gz", ".zip")
+
+# 虚拟环境自带的引导包，增量安装时不会被卸载
+BOOTSTRAP_PACKAGES = {"pip", "setuptools", "wheel"}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+# 阶段事件日志超过该大小时轮转为 events.jsonl.1
+EVENTS_MAX_BYTES = 10 * 1024 * 1024
+
+# 安装命令失败时保留在内存中、用于报告原因的输出行数
+INSTALLER_TAIL_LINES = 40
+
+# Node.js 锁文件及对应的包管理器，按优先级排列
+NODE_LOCKFILES = [
+    ("pnpm-lock.yaml", "pnpm"),
+    ("yarn.lock", "yarn"),
+    ("package-lock.json", "npm"),
+    ("npm-shrinkwrap.json", "npm"),
+]
+
+# 各环境负责的依赖类型：Python 构建只检查和记录 Python 依赖的指纹，Node.js 构建只处理 package.json
+PYTHON_DEPENDENCY_TYPES = ("requirements.txt", "pyproject.toml", "Pipfile")
+NODE_DEPENDENCY_TYPES = ("package.json",)
+
+# 蓝绿重建：.venv 与 node_modules 是指向当前"代"的符号链接，每次重建在新的代目录中完成后原子切换
+VENV_GENERATIONS_DIR = ".venv-generations"
+NODE_GENERATIONS_DIR = ".node-generations"
+# 代目录中的元数据：解析结果（回滚时恢复到状态索引）
+GENERATION_META_FILE = ".generation.json"
+# 已预编译字节码的 site-packages 源文件清单（相对路径 -> [大小, mtime_ns]），随代目录克隆
+BYTECODE_MANIFEST_FILE = ".bytecode.json"
+# 预编译时每个 compileall 进程至少分到的文件数，文件很少时不必启动多个进程
+BYTECODE_MIN_CHUNK = 200
+# 退役标记放在代目录旁边（.<代>.retired，mtime 即退役时间），代目录可能是指向共享环境的符号链接
+GENERATION_RETIRED_SUFFIX = ".retired"
+
+# renameat2(2) 参数，用于将旧版本的实体目录原子地换成符号链接
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+# watch 模式关注的依赖文件名（-r / -c 引入的文件按指纹中记录的路径匹配）
+WATCHED_DEPENDENCY_FILES = {"requirements.txt", "pyproject.toml", "Pipfile", "package.json"} | \
+    {filename for filename, _ in NODE_LOCKFILES}
+
+
+class Inotify:
+    """通过 ctypes 调用 Linux inotify，只监听目录（编辑器常以重命名方式保存文件）"""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+                  IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.watches = {}  # wd -> 目录
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch 失败: {path}")
+        self.watches[wd] = path
+        return wd
+
+    def read_events(self) -> List[Tuple[str, str, int]]:
+        """读取已就绪的事件，返回 (目录, 文件名, mask) 列表"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + self._EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = self._EVENT_HEADER.unpack_from(data, offset)
+            offset += self._EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            directory = self.watches.get(wd, "")
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+            events.append((directory, name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PipInstaller:
+    """pip 安装后端（默认）：requirements.txt 通过共享 wheel 仓库增量安装，失败时 pip install 完整重装"""
+
+    name = "pip"
+
+    def __init__(self, manager: "QingLongVenvManager"):
+        self.manager = manager
+
+    def available(self) -> bool:
+        return True
+
+    def install_requirements(self, project_name: str, venv_dir: Path, requirements_file: Path,
+                             force: bool = False) -> Tuple[bool, Optional[Dict[str, str]]]:
+        """安装 requirements.txt，返回 (是否成功, 解析出的包集合)，包集合无法确定时为 None"""
+        manager = self.manager
+        pip_path = venv_dir / "bin" / "pip"
+        # 优先从共享 wheel 仓库增量安装，只处理有差异的包
+        try:
+            resolved = manager._install_from_wheel_store(project_name, pip_path, venv_dir,
+                                                         requirements_file, force)
+        except Exception as e:
+            manager.log(f"增量安装异常: {e}", "WARNING")
+            resolved = None
+        if resolved is not None:
+            return True, resolved
+
+        # 增量安装失败时才完整重装
+        manager.log("增量安装失败，回退到完整重装", "WARNING")
+        manager.log("强制重新安装 requirements.txt 依赖...")
+        result = manager._run_pip_with_failover([
+            str(pip_path), "install", "-r", str(requirements_file), "--force-reinstall"
+        ], project_name, timeout=600, phase="pip_install")
+        if result.returncode != 0:
+            manager.log(f"依赖安装失败: {result.stderr}", "WARNING")
+        return result.returncode == 0, None
+
+    def install_project(self, project_name: str, venv_dir: Path, project_dir: Path) -> bool:
+        """以可编辑模式安装 pyproject.toml 项目"""
+        result = self.manager._run_pip_with_failover([
+            str(venv_dir / "bin" / "pip"), "install", "-e", str(project_dir)
+        ], project_name, timeout=600, phase="pip_install")
+        if result.returncode != 0:
+            self.manager.log(f"依赖安装失败: {result.stderr}", "WARNING")
+        return result.returncode == 0
+
+
+class UvInstaller(PipInstaller):
+    """uv 安装后端：并行下载与解析，先 uv pip compile 得到完整的包集合，再安装到虚拟环境
+
+    可执行文件取自 QL_VENV_UV 或 PATH；uv 的缓存放在 venv_cache/uv，与虚拟环境在同一卷上以便硬链接。
+    """
+
+    name = "uv"
+
+    def executable(self) -> Optional[str]:
+        configured = os.getenv("QL_VENV_UV")
+        if configured:
+            return configured if os.access(configured, os.X_OK) else None
+        return shutil.which("uv")
+
+    def available(self) -> bool:
+        return self.executable() is not None
+
+    def _command(self, *args: str) -> List[str]:
+        return [self.executable(), "pip"] + list(args) + \
+            ["--cache-dir", os.path.join(self.manager.cache_dir, "uv")]
+
+    @staticmethod
+    def _environment() -> Dict[str, str]:
+        """uv 不支持 --timeout，网络读取超时通过子进程的环境变量设置，不修改本进程的环境"""
+        env = dict(os.environ)
+        env.setdefault("UV_HTTP_TIMEOUT", str(INDEX_SOCKET_TIMEOUT))
+        return env
+
+    def install_requirements(self, project_name: str, venv_dir: Path, requirements_file: Path,
+                             force: bool = False) -> Tuple[bool, Optional[Dict[str, str]]]:
+        manager = self.manager
+        python_path = str(venv_dir / "bin" / "python")
+        env = self._environment()
+
+        with tempfile.TemporaryDirectory(prefix="uv-") as work_dir:
+            compiled = os.path.join(work_dir, "requirements.lock")
+            result = manager._run_pip_with_failover(
+                self._command("compile", str(requirements_file), "--python", python_path, "--quiet",
+                              "--output-file", compiled),
+                project_name, timeout=600, phase="resolve", socket_timeout=False, env=env,
+                installer=self.name)
+            if result.returncode != 0:
+                manager.log(f"uv 解析依赖失败: {result.stderr}", "WARNING")
+                return False, None
+
+            resolved = {}
+            with open(compiled, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.split("#", 1)[0].strip()
+                    if not line:
+                        continue
+                    match = re.match(r"^([A-Za-z0-9][A-Za-z0-9._-]*)==([^\s;]+)", line)
+                    if match is None:
+                        # 可编辑安装或 URL 依赖，无法给出确定的包集合
+                        resolved = None
+                        break
+                    resolved[canonical_name(match.group(1))] = match.group(2)
+
+            install_args = ["install", "--python", python_path, "-r", compiled]
+            if force:
+                install_args.append("--reinstall")
+            result = manager._run_pip_with_failover(self._command(*install_args), project_name, timeout=600,
+                                                    phase="install", socket_timeout=False, env=env,
+                                                    installer=self.name)
+            if result.returncode != 0:
+                manager.log(f"uv 安装失败: {result.stderr}", "WARNING")
+                return False, None
+
+        # 与 pip 后端一致：只卸载上次解析结果中有、本次没有的包，不动手动安装的包
+        if resolved is not None:
+            state = manager.load_state(project_name)
+            previous = state["resolved"] if state is not None else {}
+            site_packages = manager._get_site_packages(venv_dir)
+            installed = manager._get_installed_dist_infos(site_packages) if site_packages is not None else {}
+            removed = sorted(key for key in set(previous) - set(resolved) - BOOTSTRAP_PACKAGES if key in installed)
+            if removed:
+                manager._run_installer(self._command("uninstall", "--python", python_path, *removed),
+                                       project_name, timeout=300, phase="uninstall", env=env,
+                                       installer=self.name)
+                for key in removed:
+                    manager.log(f"  卸载: {key}=={installed[key][1]}", "INFO")
+        return True, resolved
+
+    def install_project(self, project_name: str, venv_dir: Path, project_dir: Path) -> bool:
+        result = self.manager._run_pip_with_failover(
+            self._command("install", "--python", str(venv_dir / "bin" / "python"), "-e", str(project_dir)),
+            project_name, timeout=600, phase="pip_install", socket_timeout=False,
+            env=self._environment(), installer=self.name)
+        if result.returncode != 0:
+            self.manager.log(f"uv 安装失败: {result.stderr}", "WARNING")
+        return result.returncode == 0
+
+
+# 可选的安装后端，通过 QL_VENV_INSTALLER / --installer 全局指定，或在项目目录的 .venv_installer 中指定
+INSTALLER_BACKENDS = {backend.name: backend for backend in (PipInstaller, UvInstaller)}
+
+
 class QingLongVenvManager:
     """青龙虚拟环境管理器"""
     
-    def __init__(self, debug: bool = False):
-        self.scripts_dir = "/ql/data/scripts"
-        self.repo_dir = "/ql/data/repo"
-        self.log_dir = "/ql/data/log"
+    def __init__(self, debug: bool = False, data_dir: Optional[str] = None):
+        # 数据根目录可通过参数或 QL_DATA_DIR 环境变量指定，便于指向测试目录
+        self.data_dir = data_dir or os.getenv("QL_DATA_DIR") or "/ql/data"
+        self.scripts_dir = os.path.join(self.data_dir, "scripts")
+        self.repo_dir = os.path.join(self.data_dir, "repo")
+        self.log_dir = os.path.join(self.data_dir, "log")
+        self.cache_dir = os.path.join(self.data_dir, "venv_cache")
+        # 依赖来源池：QL_VENV_INDEX_URL 可用空白或逗号分隔多个来源，按探测的延迟排序并在失败时切换
+        self.indexes, self.find_links = self._parse_index_sources(os.getenv("QL_VENV_INDEX_URL") or DEFAULT_INDEX_URL)
+        self.index_ranking_file = os.path.join(self.cache_dir, "index_ranking.json")
+        self.index_ranking_ttl = 3600
+        # 安装命令超过该时长没有输出视为镜像卡住，终止后换下一个索引
+        self.index_stall_seconds = 180
+        # 故障索引的退避时间从 index_backoff_base 开始按连续失败次数翻倍
+        self.index_backoff_base = 60
+        self.index_backoff_max = 3600
+        # 离线模式：只从本地 wheelhouse 与共享 wheel 仓库安装
+        self.offline = os.getenv("QL_VENV_OFFLINE") == "1"
+        # 安装后端（pip / uv），项目目录中的 .venv_installer 可单独指定
+        self.installer = (os.getenv("QL_VENV_INSTALLER") or "pip").lower()
+        # 共享 wheel 仓库：按 sha256 内容寻址，所有项目的虚拟环境共用
+        self.wheel_store_dir = os.path.join(self.cache_dir, "wheels")
+        # 按依赖集合、解释器与平台缓存的锁定解析结果，超过有效期后重新解析以获取新版本
+        self.resolution_dir = os.path.join(self.cache_dir, "resolutions")
+        self.resolution_max_age = 7 * 24 * 3600
+        # 锁定结果相同的项目共用一个虚拟环境（按锁定哈希寻址），QL_VENV_SHARED=0 时每个项目独立构建
+        self.shared_venv_dir = os.path.join(self.cache_dir, "shared")
+        self.share_venvs = os.getenv("QL_VENV_SHARED", "1") != "0"
+        # gc 的默认策略：环境总大小上限（如 20G）与最长闲置天数，未设置时不限制
+        self.gc_max_size = os.getenv("QL_VENV_GC_MAX_SIZE")
+        self.gc_max_idle_days = os.getenv("QL_VENV_GC_MAX_IDLE_DAYS")
+        # 所有项目虚拟环境状态的 SQLite 索引
+        self.state_db = os.path.join(self.cache_dir, "state.db")
+        # sitecustomize 读取的激活映射（项目 -> site-packages、.pth 条目、环境变量）
+        self.activation_map_file = os.path.join(self.cache_dir, "activation.json")
+        # sitecustomize 每次激活时更新 usage/<项目> 的 mtime，作为 gc 的最近使用时间
+        self.usage_dir = os.path.join(self.cache_dir, "usage")
+        # 激活被回收的环境时同步重建的最长等待时间（秒），超时后转入后台构建队列，任务本次不激活环境
+        self.rehydrate_timeout = int(os.getenv("QL_VENV_REHYDRATE_TIMEOUT") or 120)
+        # 每个解释器版本一个已升级 pip 的模板虚拟环境，新项目直接克隆
+        self.template_dir = os.path.join(self.cache_dir, "templates")
+        self.template_max_age = 7 * 24 * 3600
+        # Node.js 包管理器共享的缓存（npm cacache / yarn cache / pnpm store），均按内容寻址
+        self.node_store_dir = os.path.join(self.cache_dir, "node_store")
+        # pip / npm 输出写入 log_dir 下按项目轮转的日志
+        self.install_log_max_bytes = 1024 * 1024
+        self.install_log_backups = 3
+        self.install_stall_seconds = 60
+        # 被替换下来的旧代至少保留这么久（秒），仍在运行的任务可以继续使用；最近一代始终保留用于回滚
+        self.generation_grace = 3600
+        # 已完成的任务只保留最近的这些条
+        self.job_history = 200
+        # 每个构建阶段一行 JSON 事件；设置 QL_VENV_PROMETHEUS=1 或 --prometheus 时同时导出 textfile
+        self.events_file = os.path.join(self.log_dir, "venv_manager", "events.jsonl")
+        self.prometheus_file = None
+        if os.getenv("QL_VENV_PROMETHEUS") == "1":
+            self.prometheus_file = os.path.join(self.log_dir, "venv_manager.prom")
         self.debug = debug
+        # 并发构建时每个线程的日志写入各自的缓冲区
+        self._local = threading.local()
         
     def log(self, message: str, level: str = "INFO"):
         """带颜色的日志输出"""
@@ -55,8 +520,389 @@ class QingLongVenvManager:
         }
         
         color = color_map.get(level, Colors.NC)
-        print(f"{color}[{timestamp}] [{level}]{Colors.NC} {message}")
+        stream = getattr(self._local, "stream", None)
+        print(f"{color}[{timestamp}] [{level}]{Colors.NC} {message}", file=stream or sys.stdout)
     
+    @contextmanager
+    def _phase(self, project_name: str, phase: str, **fields):
+        """记录一个构建阶段的耗时与结果
+
+        调用方可以在 yield 的事件字典中补充 exit_code、bytes_downloaded、
+        package_count 等字段；未显式设置 success 时按异常与退出码判断。
+        """
+        event = {"project": project_name, "phase": phase}
+        event.update(fields)
+        # 阶段可以嵌套（python_build 包含 install、bytecode 等），只在最外层结束时导出一次指标
+        depth = getattr(self._local, "phase_depth", 0)
+        self._local.phase_depth = depth + 1
+        start = time.monotonic()
+        try:
+            yield event
+        except BaseException:
+            event["success"] = False
+            raise
+        finally:
+            self._local.phase_depth = depth
+            event["duration_seconds"] = round(time.monotonic() - start, 3)
+            event.setdefault("success", event.get("exit_code") in (None, 0))
+            self._record_phase(event, export=depth == 0)
+
+    def _record_phase(self, event: Dict[str, any], export: bool = True):
+        """追加 JSON 事件并更新阶段指标，失败不影响构建；export 为 True 时同时导出 Prometheus 指标"""
+        event["timestamp"] = datetime.now().isoformat(timespec="seconds")
+        try:
+            os.makedirs(os.path.dirname(self.events_file), exist_ok=True)
+            if os.path.exists(self.events_file) and os.path.getsize(self.events_file) > EVENTS_MAX_BYTES:
+                os.replace(self.events_file, self.events_file + ".1")
+            # 单次 O_APPEND 写入整行，多个进程同时写入时不会交错
+            fd = os.open(self.events_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            self.log(f"写入阶段事件失败: {e}", "DEBUG")
+
+        try:
+            with self._state_transaction() as conn:
+                if conn is None:
+                    return
+                failed = 0 if event["success"] else 1
+                conn.execute(
+                    "INSERT INTO phase_metrics (project_name, phase, last_duration, last_success, last_run, "
+                    "runs, failures, duration_sum, bytes_downloaded) VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?) "
+                    "ON CONFLICT(project_name, phase) DO UPDATE SET last_duration = excluded.last_duration, "
+                    "last_success = excluded.last_success, last_run = excluded.last_run, runs = runs + 1, "
+                    "failures = failures + excluded.failures, "
+                    "duration_sum = duration_sum + excluded.duration_sum, "
+                    "bytes_downloaded = bytes_downloaded + excluded.bytes_downloaded",
+                    (event["project"], event["phase"], event["duration_seconds"], 1 - failed, time.time(),
+                     failed, event["duration_seconds"], event.get("bytes_downloaded") or 0)
+                )
+                if export and self.prometheus_file:
+                    self._write_prometheus_textfile(conn)
+        except (sqlite3.Error, OSError) as e:
+            self.log(f"更新阶段指标失败: {e}", "DEBUG")
+
+    def _write_prometheus_textfile(self, conn: sqlite3.Connection):
+        """按 node_exporter textfile collector 的格式导出阶段指标（原子替换）"""
+        def labels(row) -> str:
+            escape = lambda value: value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return f'{{project="{escape(row["project_name"])}",phase="{escape(row["phase"])}"}}'
+
+        metrics = [
+            ("qinglong_venv_phase_last_duration_seconds", "gauge", "最近一次运行的耗时", "last_duration"),
+            ("qinglong_venv_phase_last_success", "gauge", "最近一次运行是否成功", "last_success"),
+            ("qinglong_venv_phase_last_run_timestamp_seconds", "gauge", "最近一次运行的时间", "last_run"),
+            ("qinglong_venv_phase_runs_total", "counter", "运行次数", "runs"),
+            ("qinglong_venv_phase_failures_total", "counter", "失败次数", "failures"),
+            ("qinglong_venv_phase_duration_seconds_total", "counter", "累计耗时", "duration_sum"),
+            ("qinglong_venv_phase_downloaded_bytes_total", "counter", "累计下载字节数", "bytes_downloaded"),
+        ]
+        rows = conn.execute("SELECT * FROM phase_metrics ORDER BY project_name, phase").fetchall()
+        lines = []
+        for name, metric_type, help_text, column in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{name}{labels(row)} {row[column]}" for row in rows)
+        try:
+            os.makedirs(os.path.dirname(self.prometheus_file), exist_ok=True)
+            tmp_file = f"{self.prometheus_file}.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_file, self.prometheus_file)
+        except OSError as e:
+            self.log(f"写入 Prometheus 指标失败: {e}", "DEBUG")
+
+    def _install_log_path(self, project_name: str) -> Path:
+        return Path(self.log_dir) / "venv_manager" / f"{project_name}.log"
+
+    def _run_installer(self, cmd: List[str], project_name: str, timeout: int,
+                       cwd: Optional[str] = None, phase: Optional[str] = None,
+                       stall_timeout: Optional[int] = None, env: Optional[Dict[str, str]] = None,
+                       **fields) -> subprocess.CompletedProcess:
+        """执行 pip / npm 等安装命令，输出逐行写入项目日志并在终端显示实时进度
+
+        内存中只保留最后 INSTALLER_TAIL_LINES 行（stdout 与 stderr 合并），
+        作为返回值的 stdout / stderr 供调用方报告失败原因。长时间没有输出时
+        输出警告，超时（或指定 stall_timeout 且连续无输出超过该时长）后终止
+        进程并抛出 TimeoutExpired。指定 phase 时记录该阶段的耗时与退出码，
+        fields 一并写入阶段事件。env 为子进程的完整环境，为空时继承本进程的环境。
+        """
+        if phase is not None:
+            subcommand = next((arg for arg in cmd[1:] if not arg.startswith("-")), "")
+            with self._phase(project_name, phase, command=f"{Path(cmd[0]).name} {subcommand}".strip(),
+                             **fields) as event:
+                result = self._run_installer(cmd, project_name, timeout, cwd, stall_timeout=stall_timeout,
+                                             env=env)
+                event["exit_code"] = result.returncode
+            return result
+
+        log_path = self._install_log_path(project_name)
+        handler = None
+        try:
+            log_path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(str(log_path), maxBytes=self.install_log_max_bytes,
+                                          backupCount=self.install_log_backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        except OSError as e:
+            self.log(f"无法写入安装日志 {log_path}: {e}", "DEBUG")
+
+        def write_log(message: str):
+            if handler is not None:
+                handler.emit(logging.makeLogRecord({"msg": message}))
+
+        # 并发构建时日志写入缓冲区，只有直接在终端运行时才显示进度行
+        live = getattr(self._local, "stream", None) is None and sys.stdout.isatty()
+        width = max(shutil.get_terminal_size().columns - 1, 40)
+
+        write_log(f"$ {' '.join(cmd)}")
+        process = subprocess.Popen(cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, text=True, errors="replace", bufsize=1)
+        # 有界队列：终端或日志写入跟不上时阻塞读取线程，而不是在内存中堆积输出
+        lines = queue.Queue(maxsize=1000)
+
+        def reader():
+            for line in process.stdout:
+                lines.put(line.rstrip("\n"))
+            lines.put(None)
+
+        threading.Thread(target=reader, daemon=True).start()
+        tail = deque(maxlen=INSTALLER_TAIL_LINES)
+        start = last_output = time.monotonic()
+        last_line = ""
+        stall_warnings = 0
+        try:
+            while True:
+                try:
+                    line = lines.get(timeout=1)
+                except queue.Empty:
+                    line = ""
+                else:
+                    if line is None:
+                        break
+                    write_log(line)
+                    tail.append(line)
+                    last_output = time.monotonic()
+                    if line.strip():
+                        last_line = line.strip()
+
+                now = time.monotonic()
+                if now - start > timeout:
+                    process.kill()
+                    process.wait()
+                    write_log(f"[超时 {timeout}s，已终止]")
+                    raise subprocess.TimeoutExpired(cmd, timeout, output="\n".join(tail))
+
+                idle = now - last_output
+                if stall_timeout is not None and idle >= stall_timeout:
+                    process.kill()
+                    process.wait()
+                    write_log(f"[已 {idle:.0f}s 无输出，已终止]")
+                    raise subprocess.TimeoutExpired(cmd, stall_timeout, output="\n".join(tail))
+                if idle >= self.install_stall_seconds * (stall_warnings + 1):
+                    stall_warnings += 1
+                    write_log(f"[已 {idle:.0f}s 无输出]")
+                    if live:
+                        sys.stdout.write("\r\033[K")
+                    # 直接写到 stderr，并发构建时同样能及时看到卡住的安装
+                    print(f"{Colors.YELLOW}[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [WARNING]{Colors.NC} "
+                          f"{project_name}: {cmd[0]} 已 {idle:.0f}s 无输出，日志: {log_path}",
+                          file=sys.stderr, flush=True)
+                if live:
+                    status = f"[{project_name} {now - start:.0f}s] {last_line}"
+                    sys.stdout.write("\r\033[K" + status[:width])
+                    sys.stdout.flush()
+
+            returncode = process.wait()
+            write_log(f"[退出码 {returncode}，耗时 {time.monotonic() - start:.1f}s]")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            if live:
+                sys.stdout.write("\r\033[K")
+                sys.stdout.flush()
+            if handler is not None:
+                handler.close()
+
+        if returncode != 0:
+            self.log(f"完整输出见: {log_path}", "DEBUG")
+        output = "\n".join(tail)
+        return subprocess.CompletedProcess(cmd, returncode, stdout=output, stderr=output)
+
+    def _parse_index_sources(self, value: str) -> Tuple[List[str], List[str]]:
+        """拆分依赖来源，返回 (索引 URL 列表, --find-links 目录列表)
+
+        http(s):// 与 file:// 地址按 PEP 503 简单索引使用；本地目录（或指向
+        目录的 file:// 地址）中直接存放 wheel / sdist 时按平铺的 wheelhouse 使用。
+        """
+        indexes = []
+        find_links = []
+        for item in re.split(r"[\s,]+", value.strip()):
+            if not item:
+                continue
+            if item.startswith("file://"):
+                path = urllib.parse.unquote(urllib.parse.urlparse(item).path)
+            elif "://" not in item:
+                path = os.path.abspath(os.path.expanduser(item))
+            else:
+                indexes.append(item.rstrip("/"))
+                continue
+            try:
+                flat = any(name.endswith(DISTRIBUTION_SUFFIXES) for name in os.listdir(path))
+            except OSError:
+                flat = False
+            if flat:
+                find_links.append(path)
+            else:
+                indexes.append(Path(path).as_uri())
+        return indexes, find_links
+
+    def _find_links_args(self) -> List[str]:
+        args = []
+        for path in self.find_links:
+            args += ["--find-links", path]
+        return args
+
+    def _probe_index(self, url: str) -> Optional[float]:
+        """请求索引中的一个项目页，返回延迟（秒），不可用时返回 None"""
+        if url.startswith("file://"):
+            path = urllib.parse.unquote(urllib.parse.urlparse(url).path)
+            return 0.0 if os.path.isdir(path) else None
+        start = time.monotonic()
+        try:
+            with urllib.request.urlopen(f"{url}/{INDEX_PROBE_PROJECT}/", timeout=INDEX_PROBE_TIMEOUT) as response:
+                response.read(1024)
+        except urllib.error.HTTPError as e:
+            # 项目页不存在（404）说明索引本身可以访问，服务端错误视为不可用
+            if e.code >= 500:
+                return None
+        except (OSError, ValueError):
+            return None
+        return time.monotonic() - start
+
+    def _load_index_ranking(self) -> Dict[str, any]:
+        try:
+            with open(self.index_ranking_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"probed_at": 0, "indexes": {}}
+
+    def _save_index_ranking(self, ranking: Dict[str, any]):
+        try:
+            os.makedirs(os.path.dirname(self.index_ranking_file), exist_ok=True)
+            tmp_file = f"{self.index_ranking_file}.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(ranking, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.index_ranking_file)
+        except OSError as e:
+            self.log(f"保存索引排名失败: {e}", "DEBUG")
+
+    def rank_indexes(self, refresh: bool = False) -> List[str]:
+        """按延迟排序的索引列表
+
+        探测结果缓存 index_ranking_ttl 秒；不可用的索引排在后面，处于退避期的排在最后，
+        但仍会作为最后的选择。
+        """
+        ranking = self._load_index_ranking()
+        entries = ranking.setdefault("indexes", {})
+        now = time.time()
+        if refresh or now - ranking.get("probed_at", 0) > self.index_ranking_ttl or \
+                any(url not in entries for url in self.indexes):
+            with ThreadPoolExecutor(max_workers=max(len(self.indexes), 1)) as executor:
+                latencies = dict(zip(self.indexes, executor.map(self._probe_index, self.indexes)))
+            # 只保留当前配置中的索引
+            entries = ranking["indexes"] = {url: entries.get(url, {}) for url in self.indexes}
+            for url, latency in latencies.items():
+                entries[url]["latency"] = None if latency is None else round(latency, 4)
+            ranking["probed_at"] = now
+            self._save_index_ranking(ranking)
+
+        def sort_key(url: str):
+            entry = entries.get(url, {})
+            latency = entry.get("latency")
+            return (entry.get("backoff_until", 0) > now, latency is None, latency or 0, self.indexes.index(url))
+
+        return sorted(self.indexes, key=sort_key)
+
+    def _record_index_result(self, url: str, success: bool):
+        """记录索引的成功或故障，连续故障时退避时间翻倍"""
+        ranking = self._load_index_ranking()
+        entry = ranking.setdefault("indexes", {}).setdefault(url, {})
+        if success:
+            if not entry.get("failures"):
+                return
+            entry["failures"] = 0
+            entry.pop("backoff_until", None)
+        else:
+            entry["failures"] = entry.get("failures", 0) + 1
+            backoff = min(self.index_backoff_base * 2 ** (entry["failures"] - 1), self.index_backoff_max)
+            entry["backoff_until"] = time.time() + backoff
+            self.log(f"索引 {url} 故障，{backoff}s 内排到最后", "WARNING")
+        self._save_index_ranking(ranking)
+
+    def _run_pip_with_failover(self, cmd: List[str], project_name: str, timeout: int,
+                               phase: str, socket_timeout: bool = True, env: Optional[Dict[str, str]] = None,
+                               **fields) -> subprocess.CompletedProcess:
+        """依次使用排名靠前的索引执行 pip 命令，索引故障或卡住时切换到下一个
+
+        cmd 中不含索引参数，本地 wheelhouse 总是以 --find-links 附加；离线模式下
+        只使用本地来源。所有索引都卡住时抛出最后一次的 TimeoutExpired。uv 等不支持
+        --timeout 的安装工具传入 socket_timeout=False；env 原样传给子进程，
+        fields 一并写入阶段事件。
+        """
+        local_args = self._find_links_args()
+        if self.offline or not self.indexes:
+            return self._run_installer(cmd + local_args + ["--no-index"], project_name, timeout, phase=phase,
+                                       env=env, **fields)
+
+        result = None
+        timed_out = None
+        for url in self.rank_indexes():
+            full_cmd = cmd + local_args + ["-i", url]
+            if socket_timeout:
+                full_cmd += ["--timeout", str(INDEX_SOCKET_TIMEOUT)]
+            self.log(f"执行: {' '.join(full_cmd)}", "DEBUG")
+            try:
+                result = self._run_installer(full_cmd, project_name, timeout, phase=phase,
+                                             stall_timeout=self.index_stall_seconds, env=env,
+                                             index=urllib.parse.urlparse(url).netloc or url, **fields)
+            except subprocess.TimeoutExpired as e:
+                self.log(f"索引 {url} 无响应，切换到下一个索引", "WARNING")
+                self._record_index_result(url, False)
+                timed_out = e
+                continue
+            if result.returncode == 0:
+                self._record_index_result(url, True)
+                return result
+            # 依赖本身无法解析时同样尝试其他索引（镜像可能未同步），但只有网络故障才退避
+            if any(marker in result.stdout for marker in INDEX_FAILURE_MARKERS):
+                self._record_index_result(url, False)
+            self.log(f"索引 {url} 安装失败，尝试下一个索引", "DEBUG")
+
+        if result is None and timed_out is not None:
+            raise timed_out
+        return result
+
+    def show_indexes(self, refresh: bool = False):
+        """显示依赖来源及探测得到的排名"""
+        ranked = self.rank_indexes(refresh)
+        entries = self._load_index_ranking().get("indexes", {})
+        now = time.time()
+        print(f"{Colors.WHITE}依赖来源{Colors.NC}{'（离线模式）' if self.offline else ''}")
+        print("=" * 60)
+        for position, url in enumerate(ranked, 1):
+            entry = entries.get(url, {})
+            latency = entry.get("latency")
+            status = f"{latency * 1000:.0f}ms" if latency is not None else f"{Colors.RED}不可用{Colors.NC}"
+            if entry.get("backoff_until", 0) > now:
+                status += f"  {Colors.YELLOW}退避中 {entry['backoff_until'] - now:.0f}s{Colors.NC}"
+            print(f"  {position}. {url}  {status}")
+        for path in self.find_links:
+            print(f"  wheelhouse: {path}")
+        print(f"  wheel 仓库: {Path(self.wheel_store_dir) / 'links'}")
+
     def calculate_file_hash(self, file_path: Path) -> str:
         """计算文件的 MD5 哈希值"""
         try:
@@ -67,8 +913,15 @@ class QingLongVenvManager:
             self.log(f"计算文件哈希失败 {file_path}: {e}", "WARNING")
             return ""
     
-    def get_dependency_hashes(self, project_dir: Path, repo_project_dir: Path) -> Dict[str, str]:
-        """获取所有依赖文件的哈希值"""
+    def get_dependency_hashes(self, project_dir: Path, repo_project_dir: Path,
+                              previous: Optional[Dict[str, Dict]] = None,
+                              dep_types: Optional[Tuple[str, ...]] = None) -> Dict[str, Dict]:
+        """获取依赖文件的语义指纹（dep_types 为空时包含所有类型）
+
+        指纹基于解析并规范化后的依赖列表，调整顺序、注释或空白不会改变指纹；
+        -r/-c 引入的文件会一并解析。previous 为上次的结果，输入文件的
+        mtime 与大小都未变化时直接复用，不再读取文件。
+        """
         # 按照优先级顺序查找依赖文件，每种类型只取第一个找到的
         dependency_types = [
             ("requirements.txt", [project_dir / "requirements.txt", repo_project_dir / "requirements.txt"]),
@@ -77,41 +930,184 @@ class QingLongVenvManager:
             ("Pipfile", [project_dir / "Pipfile", repo_project_dir / "Pipfile"])
         ]
         
+        previous = previous or {}
         hashes = {}
         for dep_type, possible_files in dependency_types:
+            if dep_types is not None and dep_type not in dep_types:
+                continue
             for dep_file in possible_files:
                 if dep_file.exists():
-                    file_hash = self.calculate_file_hash(dep_file)
-                    if file_hash:
-                        # 使用文件类型作为键，而不是完整路径，避免重复跟踪
-                        hashes[dep_type] = {
-                            "path": str(dep_file),
-                            "hash": file_hash
-                        }
+                    old_info = previous.get(dep_type)
+                    if self._fingerprint_inputs_unchanged(old_info, dep_file):
+                        hashes[dep_type] = old_info
+                    else:
+                        fingerprint = self._fingerprint_dependency_file(dep_type, dep_file)
+                        if fingerprint:
+                            # 使用文件类型作为键，而不是完整路径，避免重复跟踪
+                            hashes[dep_type] = fingerprint
                     break  # 找到第一个存在的文件后就停止查找这种类型
         
         return hashes
+
+    @staticmethod
+    def _merge_dependency_hashes(stored: Dict[str, Dict], current: Dict[str, Dict],
+                                 dep_types: Tuple[str, ...]) -> Dict[str, Dict]:
+        """用 current 替换 stored 中 dep_types 类型的指纹，其他类型保持不变"""
+        merged = {dep_type: info for dep_type, info in stored.items() if dep_type not in dep_types}
+        merged.update(current)
+        return merged
+
+    def _stat_input(self, path: Path) -> Optional[List[int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_mtime_ns, st.st_size]
+
+    def _fingerprint_inputs_unchanged(self, old_info, dep_file: Path) -> bool:
+        """上次记录的所有输入文件 stat 信息均未变化"""
+        if not isinstance(old_info, dict) or "inputs" not in old_info:
+            return False
+        if old_info.get("path") != str(dep_file):
+            return False
+        return all(self._stat_input(Path(path)) == stat for path, stat in old_info["inputs"].items())
+
+    def _read_input(self, path: Path, inputs: Dict[str, Optional[List[int]]]) -> str:
+        """读取指纹输入文件，同时记录其 stat 信息"""
+        inputs[str(path)] = self._stat_input(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def _fingerprint_dependency_file(self, dep_type: str, dep_file: Path) -> Optional[Dict]:
+        """解析依赖文件并生成规范化的依赖列表与指纹"""
+        inputs = {}
+        try:
+            if dep_type == "requirements.txt":
+                requirements = self._parse_requirements_file(dep_file, inputs)
+            elif dep_type == "package.json":
+                requirements = self._parse_package_json(dep_file, inputs)
+            else:
+                requirements = self._parse_toml_dependencies(dep_type, dep_file, inputs)
+        except Exception as e:
+            self.log(f"解析依赖文件失败 {dep_file}: {e}", "WARNING")
+            return None
+
+        return {
+            "path": str(dep_file),
+            "hash": hashlib.sha256("\n".join(requirements).encode("utf-8")).hexdigest(),
+            "requirements": requirements,
+            "inputs": inputs
+        }
+
+    def _parse_requirements_file(self, path: Path, inputs: Dict, prefix: str = "",
+                                 seen: Optional[set] = None) -> List[str]:
+        """解析 requirements.txt，递归展开 -r / -c 引入的文件"""
+        seen = seen if seen is not None else set()
+        real_path = os.path.realpath(path)
+        if real_path in seen:
+            return []
+        seen.add(real_path)
+
+        # 合并续行
+        content = re.sub(r"\\\r?\n", " ", self._read_input(path, inputs))
+        requirements = set()
+        for raw_line in content.splitlines():
+            line = re.sub(r"(^|\s)#.*$", "", raw_line).strip()
+            if not line:
+                continue
+
+            include = re.match(r"^(-r|--requirement|-c|--constraint)(?:\s*=\s*|\s+)(\S+)$", line)
+            if include:
+                include_path = path.parent / include.group(2)
+                include_prefix = "constraint: " if include.group(1) in ("-c", "--constraint") else prefix
+                if include_path.exists():
+                    requirements.update(self._parse_requirements_file(include_path, inputs, include_prefix, seen))
+                else:
+                    inputs[str(include_path)] = None
+                    requirements.add(f"{include_prefix}missing: {include.group(2)}")
+            elif line.startswith("-"):
+                # 其他 pip 选项（-i、--find-links、-e 等）只规范空白
+                requirements.add(prefix + " ".join(line.split()))
+            else:
+                requirements.add(prefix + normalize_requirement(line))
+
+        return sorted(requirements)
+
+    def _parse_package_json(self, path: Path, inputs: Dict) -> List[str]:
+        """提取 package.json 中影响生产安装的依赖，同目录的锁文件按内容计入指纹"""
+        data = json.loads(self._read_input(path, inputs))
+        requirements = []
+        for section in ("dependencies", "optionalDependencies"):
+            for name, spec in (data.get(section) or {}).items():
+                requirements.append(f"{section}: {name}@{str(spec).strip()}")
+
+        lockfile = self._find_node_lockfile(path.parent)
+        for filename, _ in NODE_LOCKFILES:
+            candidate = path.parent / filename
+            if lockfile is not None and candidate == lockfile[0]:
+                digest = hashlib.sha256(self._read_input(candidate, inputs).encode("utf-8")).hexdigest()
+                requirements.append(f"lockfile: {filename} {digest}")
+            else:
+                # 记录不存在的锁文件，新增锁文件时同样能检测到变化
+                inputs[str(candidate)] = self._stat_input(candidate)
+        return sorted(requirements)
+
+    def _parse_toml_dependencies(self, dep_type: str, path: Path, inputs: Dict) -> List[str]:
+        """提取 pyproject.toml / Pipfile 中的依赖"""
+        content = self._read_input(path, inputs)
+        if tomllib is None:
+            # 没有 TOML 解析器时退化为忽略注释和空白的逐行比较
+            lines = (re.sub(r"(^|\s)#.*$", "", line) for line in content.splitlines())
+            return [" ".join(line.split()) for line in lines if line.strip()]
+
+        data = tomllib.loads(content)
+        requirements = []
+        if dep_type == "pyproject.toml":
+            project = data.get("project", {})
+            requirements += [normalize_requirement(dep) for dep in project.get("dependencies", [])]
+            if "requires-python" in project:
+                requirements.append(f"requires-python: {project['requires-python'].replace(' ', '')}")
+            if "dependencies" in project.get("dynamic", []):
+                requirements.append("dynamic: dependencies")
+            for dep in data.get("build-system", {}).get("requires", []):
+                requirements.append(f"build-system: {normalize_requirement(dep)}")
+            for name, spec in data.get("tool", {}).get("poetry", {}).get("dependencies", {}).items():
+                requirements.append(f"poetry: {canonical_name(name)} {json.dumps(spec, sort_keys=True)}")
+        else:
+            for section in ("packages", "requires"):
+                for name, spec in data.get(section, {}).items():
+                    requirements.append(f"{section}: {canonical_name(name)} {json.dumps(spec, sort_keys=True)}")
+            for source in data.get("source", []):
+                requirements.append(f"source: {source.get('url', '')}")
+        return sorted(set(requirements))
     
-    def check_dependencies_changed(self, project_name: str) -> bool:
-        """检查依赖文件是否发生变化"""
+    def check_dependencies_changed(self, project_name: str,
+                                   dep_types: Optional[Tuple[str, ...]] = None) -> bool:
+        """检查依赖文件是否发生变化，dep_types 限定只检查的依赖类型"""
         project_dir = Path(self.scripts_dir) / project_name
         repo_project_dir = Path(self.repo_dir) / project_name
         info_file = project_dir / ".venv_info.json"
         
-        # 如果信息文件不存在，认为需要重新安装
-        if not info_file.exists():
+        # 优先从状态索引读取，索引中没有记录时再读取信息文件
+        state = self.load_state(project_name)
+        if state is None and not info_file.exists():
             self.log("虚拟环境信息文件不存在，需要创建虚拟环境", "DEBUG")
             return True
         
         try:
             # 读取上次记录的哈希值
-            with open(info_file, 'r', encoding='utf-8') as f:
-                info_data = json.load(f)
-            
-            old_hashes = info_data.get("dependency_hashes", {})
+            if state is not None:
+                old_hashes = state["dependency_hashes"]
+            else:
+                with open(info_file, 'r', encoding='utf-8') as f:
+                    info_data = json.load(f)
+                old_hashes = info_data.get("dependency_hashes", {})
+            if dep_types is not None:
+                old_hashes = {dep_type: info for dep_type, info in old_hashes.items() if dep_type in dep_types}
             
-            # 获取当前的哈希值
-            current_hashes = self.get_dependency_hashes(project_dir, repo_project_dir)
+            # 获取当前的哈希值（输入文件未变化时复用上次的指纹）
+            current_hashes = self.get_dependency_hashes(project_dir, repo_project_dir, previous=old_hashes,
+                                                        dep_types=dep_types)
             
             # 调试信息
             self.log(f"旧哈希值: {old_hashes}", "DEBUG")
@@ -141,6 +1137,14 @@ class QingLongVenvManager:
                         changed_files.append(f"  删除文件: {old_path}")
                     else:
                         changed_files.append(f"  修改文件: {current_path}")
+                        # 列出具体变化的依赖项
+                        old_requirements = old_info.get("requirements") if isinstance(old_info, dict) else None
+                        if old_requirements is not None:
+                            new_requirements = current_info.get("requirements", [])
+                            for requirement in sorted(set(new_requirements) - set(old_requirements)):
+                                changed_files.append(f"    + {requirement}")
+                            for requirement in sorted(set(old_requirements) - set(new_requirements)):
+                                changed_files.append(f"    - {requirement}")
             
             if changed:
                 self.log("检测到依赖文件发生变化", "INFO")
@@ -149,6 +1153,19 @@ class QingLongVenvManager:
                 return True
             else:
                 self.log("依赖文件未发生变化", "DEBUG")
+                # 只有 stat 信息变化时更新索引，下次检查可以直接跳过读取
+                if state is not None and current_hashes != old_hashes:
+                    with self._state_transaction() as conn:
+                        if conn is not None:
+                            row = conn.execute("SELECT dependency_hashes FROM venvs WHERE project_name = ?",
+                                               (project_name,)).fetchone()
+                            stored = json.loads(row[0] or "{}") if row else {}
+                            self._save_state(conn, {
+                                "project_name": project_name,
+                                "project_dir": str(project_dir),
+                                "dependency_hashes": self._merge_dependency_hashes(
+                                    stored, current_hashes, dep_types or tuple(stored) + tuple(current_hashes))
+                            })
                 return False
             
         except Exception as e:
@@ -167,7 +1184,8 @@ class QingLongVenvManager:
         
         # Node.js 项目检测
         nodejs_files = [
-            "package.json", "yarn.lock", "pnpm-lock.yaml"
+            "package.json", "package-lock.json", "npm-shrinkwrap.json",
+            "yarn.lock", "pnpm-lock.yaml"
         ]
         
         python_deps = [str(project_path / f) for f in python_files if (project_path / f).exists()]
@@ -181,13 +1199,277 @@ class QingLongVenvManager:
             "project_path": str(project_path)
         }
     
+    def _new_generation_dir(self, generations_dir: Path) -> Path:
+        """分配一个新的代目录（尚未创建），名称按创建时间排序"""
+        generations_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{os.getpid()}"
+        return generations_dir / name
+
+    def _generation_root(self, path: Optional[Path], generations_dir: Path) -> Optional[Path]:
+        """返回 path 所在的代目录，不在 generations_dir 下（旧版本的实体目录）时返回 None"""
+        if path is None:
+            return None
+        try:
+            relative = path.relative_to(generations_dir)
+        except ValueError:
+            return None
+        return generations_dir / relative.parts[0] if relative.parts else None
+
+    def _linked_generation(self, link: Path, generations_dir: Path) -> Optional[Path]:
+        """link 当前指向的代目录；只解析 link 本身，代目录可能是指向共享环境的符号链接"""
+        if not link.is_symlink():
+            return None
+        target = Path(os.path.normpath(os.path.join(link.parent, os.readlink(link))))
+        return self._generation_root(target, generations_dir)
+
+    def _retired_marker(self, generation: Path) -> Path:
+        """代目录的退役标记"""
+        return generation.with_name(f".{generation.name}{GENERATION_RETIRED_SUFFIX}")
+
+    def _previous_generation(self, generations_dir: Path, current: Optional[Path]) -> Optional[Path]:
+        """最近一次退役的代，即回滚的目标"""
+        candidates = []
+        if generations_dir.is_dir():
+            for entry in generations_dir.iterdir():
+                marker = self._retired_marker(entry)
+                if entry.name.startswith(".") or entry == current or not marker.exists():
+                    continue
+                candidates.append((marker.stat().st_mtime, entry))
+        return max(candidates)[1] if candidates else None
+
+    def _exchange_paths(self, first: Path, second: Path) -> bool:
+        """renameat2(RENAME_EXCHANGE) 原子交换两个路径，内核或 libc 不支持时返回 False"""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            renameat2 = libc.renameat2
+        except (OSError, AttributeError):
+            return False
+        return renameat2(AT_FDCWD, os.fsencode(str(first)), AT_FDCWD, os.fsencode(str(second)),
+                         RENAME_EXCHANGE) == 0
+
+    def _switch_generation(self, link: Path, target: Path, generations_dir: Path,
+                           legacy_target: Path) -> Optional[Path]:
+        """将 link 原子地指向 target，返回被替换下来的代目录
+
+        旧版本留下的实体目录会被移动到 legacy_target，作为可回滚的上一代。
+        """
+        previous = self._linked_generation(link, generations_dir)
+
+        # 先在旁边建好新链接，再用 rename 覆盖，任何时刻 link 都指向一个完整的环境
+        tmp_link = link.with_name(f".{link.name}.{os.getpid()}.{threading.get_ident()}")
+        os.symlink(os.path.relpath(target, link.parent), tmp_link)
+        try:
+            if link.is_symlink() or not os.path.lexists(link):
+                os.replace(tmp_link, link)
+            else:
+                legacy_target.parent.mkdir(parents=True, exist_ok=True)
+                if self._exchange_paths(tmp_link, link):
+                    os.rename(tmp_link, legacy_target)
+                else:
+                    # 不支持 RENAME_EXCHANGE 时有极短的窗口 link 不存在
+                    os.rename(link, legacy_target)
+                    os.rename(tmp_link, link)
+                previous = self._generation_root(legacy_target, generations_dir)
+        finally:
+            if tmp_link.is_symlink():
+                tmp_link.unlink()
+
+        current = self._generation_root(target, generations_dir)
+        if current is not None:
+            try:
+                self._retired_marker(current).unlink()
+            except FileNotFoundError:
+                pass
+        if previous is not None and previous != current:
+            self._retired_marker(previous).touch()
+        self._cleanup_generations(generations_dir, current)
+        return previous
+
+    def _remove_in_background(self, paths: List[Path]):
+        """在后台进程中删除目录，不阻塞构建"""
+        try:
+            subprocess.Popen(["rm", "-rf", "--"] + [str(path) for path in paths],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        except OSError as e:
+            self.log(f"启动后台清理失败，改为同步删除: {e}", "DEBUG")
+            for path in paths:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _discard_generation(self, generation: Path):
+        """丢弃一个代目录：先改名为 .trash-*，再在后台删除"""
+        if not os.path.lexists(generation):
+            return
+        trash = generation.with_name(f".trash-{generation.name}")
+        try:
+            os.rename(generation, trash)
+        except OSError:
+            trash = generation
+        self._remove_in_background([trash])
+
+    def _cleanup_generations(self, generations_dir: Path, current: Optional[Path]):
+        """清理当前代与上一代之外、退役时间超过 generation_grace 的代"""
+        if not generations_dir.is_dir():
+            return
+        previous = self._previous_generation(generations_dir, current)
+
+        now = time.time()
+        doomed = []
+        released = set()
+        for entry in generations_dir.iterdir():
+            if entry.name.startswith(".trash-"):
+                doomed.append(entry)  # 上次后台删除未完成
+                continue
+            if entry.name.startswith("."):
+                # 代目录已不存在的退役标记
+                if entry.name.endswith(GENERATION_RETIRED_SUFFIX) and \
+                        not os.path.lexists(generations_dir / entry.name[1:-len(GENERATION_RETIRED_SUFFIX)]):
+                    try:
+                        entry.unlink()
+                    except FileNotFoundError:
+                        pass
+                continue
+            if entry in (current, previous):
+                continue
+            # 没有退役标记的是中断的构建留下的暂存目录，按目录本身的时间计算
+            marker = self._retired_marker(entry)
+            try:
+                retired_at = (marker if marker.exists() else entry).lstat().st_mtime
+            except OSError:
+                continue
+            if now - retired_at < self.generation_grace:
+                continue
+            lock_hash = self._shared_venv_hash_of(entry)
+            trash = generations_dir / f".trash-{entry.name}"
+            try:
+                os.rename(entry, trash)
+            except OSError:
+                continue
+            doomed.append(trash)
+            if lock_hash is not None:
+                released.add(lock_hash)
+            try:
+                marker.unlink()
+            except FileNotFoundError:
+                pass
+
+        if doomed:
+            self.log(f"后台清理 {len(doomed)} 个旧代: {generations_dir}", "DEBUG")
+            self._remove_in_background(doomed)
+        if released:
+            # 其余保留的代仍指向的共享环境继续保持引用
+            remaining = {self._shared_venv_hash_of(entry) for entry in generations_dir.iterdir()
+                         if not entry.name.startswith(".")}
+            self._release_shared_venvs(generations_dir.parent.name, released - remaining)
+
+    def _shared_venv_hash(self, resolved: Dict[str, str], python_version: str) -> str:
+        """由锁定的包集合（包名 -> 版本）、解释器版本与平台计算共享环境的锁定哈希"""
+        inputs = {
+            "packages": sorted(f"{name}=={version}" for name, version in resolved.items()),
+            "python": python_version,
+            "implementation": sys.implementation.name,
+            "platform": sysconfig.get_platform(),
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _shared_venv_hash_of(self, generation: Path) -> Optional[str]:
+        """代目录是指向共享环境的符号链接时返回其锁定哈希"""
+        if not generation.is_symlink():
+            return None
+        target = Path(os.readlink(generation))
+        return target.name if target.parent == Path(self.shared_venv_dir) else None
+
+    def _acquire_shared_venv(self, project_name: str, lock_hash: str, staging: Optional[Path] = None,
+                             replace: bool = False) -> Optional[Path]:
+        """为项目登记对共享环境的引用，返回共享环境目录
+
+        给出 staging 时，共享环境不存在则把 staging 改名为共享环境（replace 时原子替换已有的环境）；
+        不给出时只复用已有的环境。无法登记引用或环境不可用时返回 None，调用方改用项目独立的环境。
+        """
+        target = Path(self.shared_venv_dir) / lock_hash
+        with self._state_transaction() as conn:
+            if conn is None:
+                return None
+            # 先写入引用以获得数据库写锁，与释放引用、删除环境的过程互斥
+            conn.execute("INSERT OR IGNORE INTO shared_venv_refs (lock_hash, project_name, created_at) "
+                         "VALUES (?, ?, ?)", (lock_hash, project_name, datetime.now().isoformat()))
+            if staging is not None and (replace or not target.exists()):
+                target.parent.mkdir(parents=True, exist_ok=True)
+                self._relocate_venv(staging, str(staging), str(target))
+                try:
+                    if not target.exists():
+                        os.rename(staging, target)
+                    elif self._exchange_paths(staging, target):
+                        # 交换后 staging 中是旧环境，由调用方丢弃；正在运行的进程仍持有旧文件
+                        self.log(f"已替换共享环境: {lock_hash[:12]}", "INFO")
+                    else:
+                        self.log("内核不支持原子交换，继续使用已有的共享环境", "WARNING")
+                except OSError as e:
+                    # 例如缓存目录与脚本目录不在同一文件系统
+                    self._relocate_venv(staging, str(target), str(staging))
+                    self.log(f"无法建立共享环境，改用项目独立的环境: {e}", "WARNING")
+                    conn.rollback()
+                    return None
+            if not (target / "pyvenv.cfg").exists():
+                conn.rollback()
+                return None
+        return target
+
+    def _release_shared_venvs(self, project_name: str, lock_hashes: Optional[set] = None):
+        """释放项目对共享环境的引用（默认全部），没有其他引用的共享环境在后台删除"""
+        doomed = []
+        with self._state_transaction() as conn:
+            if conn is None:
+                return
+            rows = conn.execute("SELECT lock_hash FROM shared_venv_refs WHERE project_name = ?",
+                                (project_name,)).fetchall()
+            for row in rows:
+                lock_hash = row["lock_hash"]
+                if lock_hashes is not None and lock_hash not in lock_hashes:
+                    continue
+                conn.execute("DELETE FROM shared_venv_refs WHERE lock_hash = ? AND project_name = ?",
+                             (lock_hash, project_name))
+                remaining = conn.execute("SELECT COUNT(*) FROM shared_venv_refs WHERE lock_hash = ?",
+                                         (lock_hash,)).fetchone()[0]
+                target = Path(self.shared_venv_dir) / lock_hash
+                if remaining == 0 and target.exists():
+                    trash = target.with_name(f".trash-{lock_hash}-{os.getpid()}")
+                    os.rename(target, trash)
+                    doomed.append(trash)
+                    self.log(f"共享环境 {lock_hash[:12]} 已无引用，后台删除", "INFO")
+        if doomed:
+            self._remove_in_background(doomed)
+
+    def _shared_venv_refcount(self, lock_hash: str) -> int:
+        """共享环境的引用计数"""
+        with self._state_transaction() as conn:
+            if conn is None:
+                return 0
+            return conn.execute("SELECT COUNT(*) FROM shared_venv_refs WHERE lock_hash = ?",
+                                (lock_hash,)).fetchone()[0]
+
+    def _clone_generation(self, source: Path, target: Path, ignore=None):
+        """以硬链接克隆当前代作为新一代的起点（安装过程只替换文件，不会改写共享的 inode）"""
+        def link_or_copy(src, dst):
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+        shutil.copytree(source, target, symlinks=True, copy_function=link_or_copy, ignore=ignore)
+
     def create_python_venv(self, project_name: str, force: bool = False) -> bool:
-        """创建 Python 虚拟环境"""
+        """创建 Python 虚拟环境
+
+        每次构建都在 .venv-generations 下的新目录中完成，成功后再把 .venv 符号链接原子地切换过去，
+        正在运行的任务不会看到装了一半的环境；失败时当前环境保持不变。
+        """
         project_dir = Path(self.scripts_dir) / project_name
         repo_project_dir = Path(self.repo_dir) / project_name
         venv_dir = project_dir / ".venv"
+        generations_dir = project_dir / VENV_GENERATIONS_DIR
         
         self.log(f"为项目 {project_name} 创建 Python 虚拟环境")
+        start = time.monotonic()
         
         # 检查项目目录
         if not project_dir.exists():
@@ -196,63 +1478,311 @@ class QingLongVenvManager:
         
         # 检查虚拟环境是否已存在
         venv_exists = venv_dir.exists()
-        dependencies_changed = self.check_dependencies_changed(project_name)
+        dependencies_changed = self.check_dependencies_changed(project_name, PYTHON_DEPENDENCY_TYPES)
         
         if venv_exists:
             if not force and not dependencies_changed:
                 self.log(f"虚拟环境已存在且依赖未变化: {venv_dir}", "INFO")
                 return True
             elif dependencies_changed:
-                self.log("依赖文件已更新，重新安装依赖...", "INFO")
-                # 不删除虚拟环境，只重新安装依赖
+                self.log("依赖文件已更新，在新一代环境中重新安装依赖...", "INFO")
+                # 以当前环境的硬链接克隆为起点，只安装差异部分
             elif force:
-                self.log("强制重建虚拟环境，删除现有环境...", "WARNING")
-                shutil.rmtree(venv_dir)
-                venv_exists = False
+                self.log("强制重建虚拟环境，在新一代目录中从头创建...", "WARNING")
         
-        try:
-            # 只有在虚拟环境不存在时才创建
-            if not venv_exists:
-                self.log("创建 Python 虚拟环境...")
-                result = subprocess.run([
-                    sys.executable, "-m", "venv", str(venv_dir)
-                ], capture_output=True, text=True, timeout=300)
+        # 旧版本创建的 .venv 是实体目录，首次切换时会被移入代目录
+        legacy = venv_exists and not venv_dir.is_symlink()
+        current = None
+        if legacy:
+            current = venv_dir
+        elif venv_exists:
+            current = self._linked_generation(venv_dir, generations_dir)
+        
+        # requirements.txt 项目的环境可以共享：先按锁定结果查找已有的共享环境，找到时无需构建
+        requirements_file = self._find_requirements_file(project_dir, repo_project_dir)
+        share = self.share_venvs and requirements_file is not None
+        if share and not force:
+            if self._switch_to_shared_venv(project_name, requirements_file, current, legacy, start):
+                return True
+        staging = self._new_generation_dir(generations_dir)
+        
+        with self._phase(project_name, "python_build") as build:
+            switched = False
+            try:
+                cloned = False
+                if current is not None and not force:
+                    # 没有可复用的共享环境时同样从当前代增量构建，完成后再发布为共享环境；
+                    # 代目录可能是指向共享环境的符号链接，环境中的绝对路径是共享环境的路径
+                    source_prefix = os.readlink(current) if current.is_symlink() else str(current)
+                    with self._phase(project_name, "venv_clone") as clone:
+                        self._clone_generation(current, staging,
+                                               ignore=shutil.ignore_patterns(GENERATION_META_FILE))
+                        self._relocate_venv(staging, source_prefix, str(staging))
+                        clone["source"] = "generation"
+                    self.log(f"✅ 已从当前环境克隆新一代: {staging.name}", "SUCCESS")
+                else:
+                    with self._phase(project_name, "venv_clone") as clone:
+                        cloned = clone["success"] = self._clone_template(staging)
+                    if cloned:
+                        self.log("✅ Python 虚拟环境创建成功（模板克隆）", "SUCCESS")
+                    else:
+                        self.log("创建 Python 虚拟环境...")
+                        result = self._run_installer([
+                            sys.executable, "-m", "venv", str(staging)
+                        ], project_name, timeout=300, phase="venv_create")
+                        
+                        if result.returncode != 0:
+                            self.log(f"虚拟环境创建失败: {result.stderr}", "ERROR")
+                            build["success"] = False
+                            return False
+                        
+                        self.log("✅ Python 虚拟环境创建成功", "SUCCESS")
+                        
+                        # 升级 pip
+                        pip_path = staging / "bin" / "pip"
+                        self.log("升级 pip...")
+                        self._run_pip_with_failover([
+                            str(pip_path), "install", "--upgrade", "pip"
+                        ], project_name, timeout=120, phase="pip_upgrade")
                 
-                if result.returncode != 0:
-                    self.log(f"虚拟环境创建失败: {result.stderr}", "ERROR")
+                # 安装或更新依赖，依赖变化时只安装差异部分
+                installed, resolved = self._install_python_dependencies(
+                    project_name, staging, project_dir, repo_project_dir, force_reinstall=force)
+                if not installed:
+                    self.log("依赖安装失败，保留当前环境不变", "ERROR")
+                    build["success"] = False
                     return False
                 
-                self.log("✅ Python 虚拟环境创建成功", "SUCCESS")
+                if resolved is not None:
+                    build["package_count"] = len(resolved)
                 
-                # 升级 pip
-                pip_path = venv_dir / "bin" / "pip"
-                self.log("升级 pip...")
-                subprocess.run([
-                    str(pip_path), "install", "--upgrade", "pip",
-                    "-i", "https://pypi.tuna.tsinghua.edu.cn/simple"
-                ], capture_output=True, text=True, timeout=120)
-            else:
-                self.log("✅ Python 虚拟环境已存在", "SUCCESS")
-            
-            # 安装或更新依赖（无论虚拟环境是否新建都执行）
-            self._install_python_dependencies(project_name, venv_dir, project_dir, repo_project_dir, force_reinstall=dependencies_changed or force)
-            
-            # 创建或更新虚拟环境信息文件
-            self._create_venv_info(project_name, venv_dir, project_dir, repo_project_dir)
-            
+                # 预编译字节码，任务首次运行时无需再写 .pyc，同时启动的任务也不会竞争写入
+                bytecode = self._precompile_bytecode(project_name, staging, project_dir)
+                
+                with open(staging / GENERATION_META_FILE, 'w', encoding='utf-8') as f:
+                    json.dump({"resolved": resolved, "created_at": datetime.now().isoformat()}, f)
+                
+                if share and resolved is not None:
+                    # 移入共享目录（已有相同的共享环境时丢弃本次构建），代目录改为指向它的符号链接
+                    python_version = self.get_venv_python_version(staging) or f"Python {platform.python_version()}"
+                    lock_hash = self._shared_venv_hash(resolved, python_version)
+                    shared = self._acquire_shared_venv(project_name, lock_hash, staging, replace=force)
+                    if shared is not None:
+                        self._discard_generation(staging)
+                        os.symlink(str(shared), staging)
+                        build["shared"] = lock_hash[:12]
+                        self.log(f"✅ 使用共享环境: {lock_hash[:12]}"
+                                 f"（{self._shared_venv_refcount(lock_hash)} 个项目引用）", "SUCCESS")
+                
+                # 原子切换：.venv 从此指向新一代，上一代保留用于回滚
+                previous = self._switch_generation(venv_dir, staging, generations_dir,
+                                                   generations_dir / f"legacy-{staging.name}")
+                switched = True
+                if legacy and previous is not None:
+                    # 旧版本的实体目录移入代目录后，改写其中的绝对路径以便回滚
+                    self._relocate_venv(previous, str(venv_dir), str(previous))
+                self.log(f"✅ 已切换到新一代环境: {staging.name}", "SUCCESS")
+                
+                # 创建或更新虚拟环境信息文件
+                with self._phase(project_name, "introspect"):
+                    self._create_venv_info(project_name, venv_dir, project_dir, repo_project_dir,
+                                           build_seconds=time.monotonic() - start, resolved=resolved,
+                                           bytecode=bytecode)
+                
+                return True
+                
+            except subprocess.TimeoutExpired:
+                self.log("虚拟环境创建超时", "ERROR")
+                build["success"] = False
+                return False
+            except Exception as e:
+                self.log(f"虚拟环境创建异常: {e}", "ERROR")
+                build["success"] = False
+                return False
+            finally:
+                if not switched:
+                    self._discard_generation(staging)
+        
+    def _switch_to_shared_venv(self, project_name: str, requirements_file: Path, current: Optional[Path],
+                               legacy: bool, start: float) -> bool:
+        """锁定结果已知且对应的共享环境已存在时不再构建，直接把 .venv 切换过去"""
+        project_dir = Path(self.scripts_dir) / project_name
+        venv_dir = project_dir / ".venv"
+        generations_dir = project_dir / VENV_GENERATIONS_DIR
+        
+        resolution = self._resolution_key(None, requirements_file)
+        if resolution is None:
+            return False
+        lock = self._load_lock(project_name, resolution[0])
+        if lock is None:
+            # 依赖集合变化后还没有锁定结果：先只解析，锁定哈希对应的共享环境已存在时就不必构建；
+            # 解析结果写入缓存，随后的构建直接按它安装
+            resolve_dir = current if current is not None else venv_dir
+            lock = self._resolve_requirements(project_name, requirements_file, resolve_dir, *resolution)
+        if lock is None:
+            return False
+        resolved = {entry["name"]: entry["version"] for entry in lock["packages"]}
+        lock_hash = self._shared_venv_hash(resolved, resolution[1]["python"])
+        
+        if current is not None and self._shared_venv_hash_of(current) == lock_hash:
+            # 依赖文件有改动但锁定结果不变（例如只改了注释）
+            self.log(f"锁定结果未变化，继续使用共享环境: {lock_hash[:12]}", "INFO")
+            self._create_venv_info(project_name, venv_dir, project_dir,
+                                   build_seconds=time.monotonic() - start, resolved=resolved)
             return True
-            
-        except subprocess.TimeoutExpired:
-            self.log("虚拟环境创建超时", "ERROR")
+        
+        shared = self._acquire_shared_venv(project_name, lock_hash)
+        if shared is None:
             return False
-        except Exception as e:
-            self.log(f"虚拟环境创建异常: {e}", "ERROR")
+        
+        with self._phase(project_name, "python_build") as build:
+            build["shared"] = lock_hash[:12]
+            build["package_count"] = len(resolved)
+            generation = self._new_generation_dir(generations_dir)
+            try:
+                os.symlink(str(shared), generation)
+                previous = self._switch_generation(venv_dir, generation, generations_dir,
+                                                   generations_dir / f"legacy-{generation.name}")
+            except OSError as e:
+                self.log(f"切换到共享环境失败，改为构建: {e}", "WARNING")
+                self._discard_generation(generation)
+                build["success"] = False
+                return False
+            if legacy and previous is not None:
+                self._relocate_venv(previous, str(venv_dir), str(previous))
+            self.log(f"✅ 已切换到共享环境: {lock_hash[:12]}"
+                     f"（{self._shared_venv_refcount(lock_hash)} 个项目引用）", "SUCCESS")
+            
+            # 共享环境的 site-packages 构建时已编译，只需编译项目脚本
+            bytecode = self._precompile_bytecode(project_name, venv_dir, project_dir, include_site_packages=False)
+            with self._phase(project_name, "introspect"):
+                self._create_venv_info(project_name, venv_dir, project_dir,
+                                       build_seconds=time.monotonic() - start, resolved=resolved,
+                                       bytecode=bytecode)
+        return True
+        
+    def get_template_path(self) -> Path:
+        """当前解释器对应的模板虚拟环境目录"""
+        executable = os.path.realpath(sys.executable)
+        version = ".".join(str(part) for part in sys.version_info[:3])
+        digest = hashlib.sha1(executable.encode("utf-8")).hexdigest()[:8]
+        return Path(self.template_dir) / f"python{version}-{digest}"
+
+    def build_template(self) -> bool:
+        """创建或刷新模板虚拟环境（python -m venv + 升级 pip），完成后原子替换"""
+        template = self.get_template_path()
+        template.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(str(template) + ".lock", 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.log("模板虚拟环境正在由其他进程刷新", "INFO")
+                return False
+
+            staging = Path(tempfile.mkdtemp(prefix=f".{template.name}-", dir=template.parent))
+            try:
+                self.log(f"创建模板虚拟环境: {template}")
+                result = self._run_installer([sys.executable, "-m", "venv", str(staging)],
+                                             "template", timeout=300, phase="venv_create")
+                if result.returncode != 0:
+                    self.log(f"模板虚拟环境创建失败: {result.stderr}", "ERROR")
+                    return False
+
+                result = self._run_pip_with_failover([
+                    str(staging / "bin" / "pip"), "install", "--upgrade", "pip"
+                ], "template", timeout=120, phase="pip_upgrade")
+                if result.returncode != 0:
+                    self.log(f"模板 pip 升级失败，继续使用自带 pip: {result.stderr}", "WARNING")
+
+                # 模板中的路径统一改写为最终位置，克隆时再改写为项目路径
+                self._relocate_venv(staging, str(staging), str(template))
+                self._precompile_bytecode("template", staging)
+                with open(staging / ".template_ready", 'w', encoding='utf-8') as f:
+                    f.write(datetime.now().isoformat())
+
+                old = template.with_name(f".{template.name}.old-{os.getpid()}")
+                if template.exists():
+                    os.rename(template, old)
+                os.rename(staging, template)
+                shutil.rmtree(old, ignore_errors=True)
+                self.log("✅ 模板虚拟环境已就绪", "SUCCESS")
+                return True
+            except subprocess.TimeoutExpired:
+                self.log("模板虚拟环境创建超时", "ERROR")
+                return False
+            finally:
+                if staging.exists():
+                    shutil.rmtree(staging, ignore_errors=True)
+
+    def _refresh_template_in_background(self):
+        """在后台进程中刷新模板，不阻塞当前构建"""
+        try:
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--data-dir", self.data_dir, "template", "--refresh"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+            )
+        except OSError as e:
+            self.log(f"启动模板刷新失败: {e}", "DEBUG")
+
+    def _relocate_venv(self, venv_dir: Path, old_prefix: str, new_prefix: str):
+        """改写 bin 目录脚本与 pyvenv.cfg 中的绝对路径"""
+        old_bytes = old_prefix.encode()
+        new_bytes = new_prefix.encode()
+        candidates = [venv_dir / "pyvenv.cfg"]
+        candidates += [path for path in (venv_dir / "bin").iterdir() if not path.is_symlink()]
+        for path in candidates:
+            if not path.is_file():
+                continue
+            with open(path, 'rb') as f:
+                content = f.read()
+            if old_bytes not in content:
+                continue
+            # 克隆出的文件可能是硬链接，必须写入新文件再替换
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(content.replace(old_bytes, new_bytes))
+            shutil.copymode(path, tmp_path)
+            os.replace(tmp_path, path)
+
+    def _clone_template(self, venv_dir: Path) -> bool:
+        """从模板克隆虚拟环境，文件优先使用硬链接，失败时快速复制"""
+        template = self.get_template_path()
+        marker = template / ".template_ready"
+        if not marker.exists():
+            if not self.build_template():
+                return False
+        elif time.time() - marker.stat().st_mtime > self.template_max_age:
+            # 模板过期时仍然使用旧模板，同时在后台刷新
+            self._refresh_template_in_background()
+
+        def link_or_copy(src, dst):
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+        self.log(f"从模板克隆虚拟环境: {template}")
+        try:
+            # 模板中预编译的字节码（与清单）一并硬链接，新环境无需重新编译引导包
+            shutil.copytree(template, venv_dir, symlinks=True, copy_function=link_or_copy,
+                            ignore=shutil.ignore_patterns(".template_ready"))
+            self._relocate_venv(venv_dir, str(template), str(venv_dir))
+        except (OSError, shutil.Error) as e:
+            self.log(f"模板克隆失败，改为直接创建: {e}", "WARNING")
+            shutil.rmtree(venv_dir, ignore_errors=True)
             return False
-    
+        return True
+
     def _install_python_dependencies(self, project_name: str, venv_dir: Path, 
-                                   project_dir: Path, repo_project_dir: Path, force_reinstall: bool = False):
-        """安装 Python 依赖"""
-        pip_path = venv_dir / "bin" / "pip"
+                                   project_dir: Path, repo_project_dir: Path,
+                                   force_reinstall: bool = False) -> Tuple[bool, Optional[Dict[str, str]]]:
+        """安装 Python 依赖，返回 (是否成功, 解析出的包集合)
+
+        包集合为包名 -> 版本，无法确定时为 None；没有可安装的依赖文件也视为成功。
+        """
+        resolved = None
+        installer = self._get_installer(project_name, project_dir, repo_project_dir)
         
         # 查找依赖文件的优先级顺序
         dependency_files = [
@@ -265,6 +1795,7 @@ class QingLongVenvManager:
         ]
         
         installed = False
+        attempted = False
         
         for dep_file, dep_type in dependency_files:
             if dep_file.exists():
@@ -280,42 +1811,30 @@ class QingLongVenvManager:
                                             for line in content.split('\n')):
                             self.log("requirements.txt 文件为空或只包含注释", "WARNING")
                             continue
+                        attempted = True
                         
-                        install_cmd = [
-                            str(pip_path), "install", "-r", str(dep_file),
-                            "-i", "https://pypi.tuna.tsinghua.edu.cn/simple",
-                            "--timeout", "300"
-                        ]
-                        
-                        if force_reinstall:
-                            install_cmd.append("--force-reinstall")
-                            self.log("强制重新安装 requirements.txt 依赖...")
-                        else:
-                            self.log("安装 requirements.txt 依赖...")
-                        
-                        result = subprocess.run(install_cmd, capture_output=True, text=True, timeout=600)
+                        ok, resolved = self._with_installer_fallback(
+                            installer, lambda backend: backend.install_requirements(
+                                project_name, venv_dir, dep_file, force_reinstall))
                         
                     elif dep_type == "pyproject.toml":
                         self.log("安装 pyproject.toml 项目...")
+                        attempted = True
                         # 复制 pyproject.toml 到项目目录
                         if dep_file != project_dir / "pyproject.toml":
                             shutil.copy2(dep_file, project_dir / "pyproject.toml")
                         
-                        result = subprocess.run([
-                            str(pip_path), "install", "-e", str(project_dir),
-                            "-i", "https://pypi.tuna.tsinghua.edu.cn/simple"
-                        ], capture_output=True, text=True, timeout=600)
+                        ok = self._with_installer_fallback(
+                            installer, lambda backend: backend.install_project(project_name, venv_dir, project_dir))
                         
                     elif dep_type == "Pipfile":
                         self.log("检测到 Pipfile，建议使用 pipenv 管理", "WARNING")
                         continue
                     
-                    if result.returncode == 0:
+                    if ok:
                         self.log("✅ 依赖安装成功", "SUCCESS")
                         installed = True
                         break
-                    else:
-                        self.log(f"依赖安装失败: {result.stderr}", "WARNING")
                         
                 except subprocess.TimeoutExpired:
                     self.log("依赖安装超时", "WARNING")
@@ -324,31 +1843,970 @@ class QingLongVenvManager:
         
         if not installed:
             self.log("未找到有效的依赖文件或安装失败", "WARNING")
-    
-    def _create_venv_info(self, project_name: str, venv_dir: Path, project_dir: Path, repo_project_dir: Path = None):
-        """创建虚拟环境信息文件"""
+        
+        return installed or not attempted, resolved
+
+    def _precompile_bytecode(self, project_name: str, venv_dir: Path, project_dir: Optional[Path] = None,
+                             include_site_packages: bool = True) -> Dict[str, any]:
+        """多进程预编译 site-packages 与项目脚本的字节码，只编译上次构建后有变化的文件
+
+        site-packages 中的文件只会随包整体替换，使用 unchecked-hash 模式（导入时不再检查源文件），
+        是否变化按 BYTECODE_MANIFEST_FILE 中记录的大小与 mtime 判断；项目脚本随时可能被修改，
+        使用默认的时间戳模式。返回耗时与编译的文件数，编译失败不影响构建。
+        """
+        python_path = venv_dir / "bin" / "python"
+        stats = {"seconds": 0.0, "site_packages_files": 0, "site_packages_compiled": 0,
+                 "project_files": 0, "project_compiled": 0}
+        if not python_path.exists():
+            return stats
+        start = time.monotonic()
+
+        site_packages = self._get_site_packages(venv_dir) if include_site_packages else None
+        if site_packages is not None:
+            manifest_file = venv_dir / BYTECODE_MANIFEST_FILE
+            try:
+                with open(manifest_file, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+            sources = {}
+            stale = []
+            for path in self._iter_python_sources(site_packages):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                relative = os.path.relpath(path, site_packages)
+                sources[relative] = [st.st_size, st.st_mtime_ns]
+                if manifest.get(relative) != sources[relative]:
+                    stale.append(path)
+            stats["site_packages_files"] = len(sources)
+            if stale and self._compile_bytecode(project_name, python_path, stale, "unchecked-hash", "site_packages"):
+                stats["site_packages_compiled"] = len(stale)
+            if stats["site_packages_compiled"] or (not stale and len(sources) != len(manifest)):
+                # 编译失败的文件（如不兼容当前版本的语法）同样记入清单，之后不再重试
+                tmp_file = manifest_file.with_name(f"{manifest_file.name}.{os.getpid()}")
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(sources, f)
+                os.replace(tmp_file, manifest_file)
+
+        if project_dir is not None:
+            stale = []
+            for path in self._iter_python_sources(project_dir, skip_hidden=True):
+                stats["project_files"] += 1
+                if not self._bytecode_current(path):
+                    stale.append(path)
+            if stale and self._compile_bytecode(project_name, python_path, stale, "timestamp", "project"):
+                stats["project_compiled"] = len(stale)
+
+        stats["seconds"] = round(time.monotonic() - start, 3)
+        compiled = stats["site_packages_compiled"] + stats["project_compiled"]
+        if compiled:
+            self.log(f"预编译字节码: {compiled} 个文件，耗时 {stats['seconds']:.2f}s", "INFO")
+        return stats
+
+    def _iter_python_sources(self, root: Path, skip_hidden: bool = False):
+        """遍历目录下的 .py 文件；项目目录中跳过隐藏目录（.venv、代目录等）与 node_modules"""
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if name != "__pycache__" and
+                           not (skip_hidden and (name.startswith(".") or name == "node_modules"))]
+            for filename in filenames:
+                if filename.endswith(".py"):
+                    yield os.path.join(dirpath, filename)
+
+    def _bytecode_current(self, source: str) -> bool:
+        """时间戳模式的 .pyc 是否与源文件一致（与 compileall 的判断相同）"""
+        try:
+            st = os.stat(source)
+            with open(importlib.util.cache_from_source(source), 'rb') as f:
+                header = f.read(16)
+        except (OSError, ValueError):
+            return False
+        expected = struct.pack("<4sLLL", importlib.util.MAGIC_NUMBER, 0,
+                               int(st.st_mtime) & 0xFFFFFFFF, st.st_size & 0xFFFFFFFF)
+        return header == expected
+
+    def _compile_bytecode(self, project_name: str, python_path: Path, files: List[str],
+                          invalidation_mode: str, target: str) -> bool:
+        """用虚拟环境的解释器编译给定的文件，按 CPU 数分片后多个 compileall 进程并行执行
+
+        （compileall -j 只对目录生效，文件列表需要自行分片）
+        """
+        workers = max(1, min(os.cpu_count() or 1, len(files) // BYTECODE_MIN_CHUNK))
+        chunks = [files[index::workers] for index in range(workers)]
+        with self._phase(project_name, "bytecode", target=target, file_count=len(files),
+                         workers=workers) as phase, tempfile.TemporaryDirectory(prefix="compile-") as work_dir:
+            def compile_chunk(index: int) -> subprocess.CompletedProcess:
+                file_list = os.path.join(work_dir, f"{index}.txt")
+                with open(file_list, 'w', encoding='utf-8') as f:
+                    f.write("\n".join(chunks[index]) + "\n")
+                # 文件已按清单筛选过；-f 使已有的时间戳 .pyc（如 pip 安装时生成的）同样按指定模式重新编译
+                return subprocess.run([str(python_path), "-m", "compileall", "-q", "-f",
+                                       "--invalidation-mode", invalidation_mode, "-i", file_list],
+                                      stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=600)
+
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(compile_chunk, range(workers)))
+            except (OSError, subprocess.TimeoutExpired) as e:
+                self.log(f"预编译字节码失败: {e}", "WARNING")
+                phase["success"] = False
+                return False
+            phase["exit_code"] = max(result.returncode for result in results)
+        for result in results:
+            if result.returncode != 0:
+                # 个别文件语法不兼容时 compileall 返回非零，其余文件已正常编译
+                self.log(f"部分文件预编译失败: {result.stdout.strip()[-2000:]}", "DEBUG")
+        return True
+
+    def _get_installer(self, project_name: str, project_dir: Path, repo_project_dir: Path) -> PipInstaller:
+        """选择安装后端：项目目录（或仓库目录）中的 .venv_installer 优先，其次是全局设置"""
+        name = self.installer
+        for path in (project_dir / ".venv_installer", repo_project_dir / ".venv_installer"):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    name = f.read().strip().lower() or name
+                break
+            except OSError:
+                continue
+        
+        backend = INSTALLER_BACKENDS.get(name)
+        if backend is None:
+            self.log(f"未知的安装后端 {name}，使用 pip", "WARNING")
+            return PipInstaller(self)
+        installer = backend(self)
+        if not installer.available():
+            self.log(f"未找到安装后端 {name}，回退到 pip", "WARNING")
+            return PipInstaller(self)
+        if installer.name != "pip":
+            self.log(f"项目 {project_name} 使用安装后端: {installer.name}", "INFO")
+        return installer
+
+    def _with_installer_fallback(self, installer: PipInstaller, install):
+        """用选定的后端执行安装，非 pip 后端失败（或超时、异常）时改用 pip 重试"""
+        try:
+            result = install(installer)
+        except Exception as e:
+            if installer.name == "pip":
+                raise
+            self.log(f"{installer.name} 安装异常: {e}", "WARNING")
+            result = False
+        ok = result[0] if isinstance(result, tuple) else result
+        if ok or installer.name == "pip":
+            return result
+        self.log(f"{installer.name} 安装失败，回退到 pip", "WARNING")
+        return install(PipInstaller(self))
+
+    def _read_pyvenv_cfg(self, venv_dir: Path) -> Dict[str, str]:
+        """读取虚拟环境的 pyvenv.cfg"""
+        config = {}
+        try:
+            with open(venv_dir / "pyvenv.cfg", 'r', encoding='utf-8') as f:
+                for line in f:
+                    key, sep, value = line.partition("=")
+                    if sep:
+                        config[key.strip().lower()] = value.strip()
+        except OSError:
+            pass
+        return config
+
+    def get_venv_python_version(self, venv_dir: Path) -> Optional[str]:
+        """从 pyvenv.cfg 获取解释器版本，格式与 python --version 一致"""
+        config = self._read_pyvenv_cfg(venv_dir)
+        version = config.get("version") or config.get("version_info")
+        if not version:
+            return None
+        # version_info 形如 3.12.1.final.0，只保留前三段
+        return "Python " + ".".join(version.split(".")[:3])
+
+    def _get_site_packages(self, venv_dir: Path) -> Optional[Path]:
+        """查找虚拟环境的 site-packages 目录"""
+        version = self.get_venv_python_version(venv_dir)
+        if version:
+            major_minor = ".".join(version.split()[-1].split(".")[:2])
+            site_packages = venv_dir / "lib" / f"python{major_minor}" / "site-packages"
+            if site_packages.is_dir():
+                return site_packages
+        candidates = sorted((venv_dir / "lib").glob("python3*/site-packages"))
+        return candidates[-1] if candidates else None
+
+    def list_installed_packages(self, venv_dir: Path) -> Optional[List[str]]:
+        """读取 dist-info 元数据列出已安装的包，格式与 pip list --format=freeze 一致"""
+        site_packages = self._get_site_packages(venv_dir)
+        if site_packages is None:
+            return None
+
+        packages = {}
+        for entry in os.scandir(site_packages):
+            if entry.name.endswith(".dist-info"):
+                metadata = os.path.join(entry.path, "METADATA")
+            elif entry.name.endswith(".egg-info"):
+                metadata = os.path.join(entry.path, "PKG-INFO") if entry.is_dir() else entry.path
+            else:
+                continue
+
+            name = version = None
+            try:
+                with open(metadata, 'r', encoding='utf-8', errors='replace') as f:
+                    for line in f:
+                        if not line.strip():
+                            break  # 头部结束
+                        if line.startswith("Name:"):
+                            name = line[5:].strip()
+                        elif line.startswith("Version:"):
+                            version = line[8:].strip()
+                        if name and version:
+                            break
+            except OSError:
+                continue
+
+            if name and version:
+                packages.setdefault(canonical_name(name), f"{name}=={version}")
+
+        return [packages[key] for key in sorted(packages)]
+
+    def _find_requirements_file(self, project_dir: Path, repo_project_dir: Path) -> Optional[Path]:
+        """按安装时的优先级返回第一个包含依赖的 requirements.txt"""
+        for path in (project_dir / "requirements.txt", repo_project_dir / "requirements.txt"):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    if any(line.strip() and not line.strip().startswith('#') for line in f):
+                        return path
+            except OSError:
+                continue
+        return None
+
+    def _resolution_key(self, venv_dir: Optional[Path], requirements_file: Path) -> Optional[Tuple[str, Dict]]:
+        """由规范化的依赖集合、解释器版本与平台计算锁定结果的缓存键，返回 (键, 组成部分)"""
+        fingerprint = self._fingerprint_dependency_file("requirements.txt", requirements_file)
+        if fingerprint is None:
+            return None
+        python_version = self.get_venv_python_version(venv_dir) if venv_dir is not None else None
+        inputs = {
+            "requirements": fingerprint["requirements"],
+            "python": python_version or f"Python {platform.python_version()}",
+            "implementation": sys.implementation.name,
+            "platform": sysconfig.get_platform(),
+        }
+        # 相对路径或本地文件形式的依赖只在同一目录下才等价
+        if any(re.search(r"(^|[\s@])(\.{1,2}/|/|file:)", requirement) for requirement in fingerprint["requirements"]):
+            inputs["base_dir"] = str(requirements_file.parent.resolve())
+        key = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+        return key, inputs
+
+    def _load_lock(self, project_name: str, key: str, use_cache: bool = True) -> Optional[Dict]:
+        """查找与缓存键匹配的锁定结果：项目中由 lock 命令写入的 .venv_lock.json 优先，其次是未过期的缓存"""
+        project_lock = Path(self.scripts_dir) / project_name / ".venv_lock.json"
+        try:
+            with open(project_lock, 'r', encoding='utf-8') as f:
+                lock = json.load(f)
+            if lock.get("key") == key:
+                return lock
+            self.log(f"{project_lock.name} 与当前依赖不一致，已忽略（重新执行 lock 更新）", "WARNING")
+        except (OSError, ValueError):
+            pass
+        if not use_cache:
+            return None
+
+        cache_file = Path(self.resolution_dir) / f"{key}.json"
+        state = self.load_state(project_name)
+        try:
+            # 被 gc 回收的环境按回收前的锁定结果重建，不受有效期限制
+            if time.time() - cache_file.stat().st_mtime > self.resolution_max_age and \
+                    not (state is not None and state["evicted_at"]):
+                return None
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_resolution(self, key: str, inputs: Dict, packages: List[Dict]) -> Dict:
+        """写入锁定结果缓存，返回锁定结果"""
+        lock = dict(inputs, key=key, packages=packages, created_at=datetime.now().isoformat())
+        try:
+            os.makedirs(self.resolution_dir, exist_ok=True)
+            cache_file = os.path.join(self.resolution_dir, f"{key}.json")
+            tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(lock, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            self.log(f"保存锁定结果失败: {e}", "DEBUG")
+        return lock
+
+    def lock_project(self, project_name: str, refresh: bool = False) -> bool:
+        """解析项目的 requirements.txt，将锁定结果写入项目目录的 .venv_lock.json
+
+        之后依赖集合不变时 create 直接按锁定结果安装，不再解析。
+        """
+        project_dir = Path(self.scripts_dir) / project_name
+        requirements_file = self._find_requirements_file(project_dir, Path(self.repo_dir) / project_name)
+        if requirements_file is None:
+            self.log(f"项目 {project_name} 没有 requirements.txt", "ERROR")
+            return False
+
+        venv_dir = project_dir / ".venv"
+        resolution = self._resolution_key(venv_dir if venv_dir.exists() else None, requirements_file)
+        if resolution is None:
+            return False
+        key, inputs = resolution
+
+        lock = None
+        cache_file = Path(self.resolution_dir) / f"{key}.json"
+        if not refresh and cache_file.exists() and time.time() - cache_file.stat().st_mtime <= self.resolution_max_age:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                lock = json.load(f)
+            self.log("使用缓存的锁定结果", "INFO")
+
+        if lock is None:
+            lock = self._resolve_requirements(project_name, requirements_file, venv_dir, key, inputs)
+            if lock is None:
+                return False
+
+        lock_file = project_dir / ".venv_lock.json"
+        tmp_file = lock_file.with_name(f".venv_lock.json.{os.getpid()}")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(lock, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, lock_file)
+        self.log(f"✅ 已锁定 {len(lock['packages'])} 个包: {lock_file}", "SUCCESS")
+        for entry in lock["packages"]:
+            self.log(f"  {entry['name']}=={entry['version']}", "INFO")
+        return True
+
+    def _resolve_requirements(self, project_name: str, requirements_file: Path, venv_dir: Path,
+                              key: str, inputs: Dict) -> Optional[Dict]:
+        """只解析不安装：pip install --dry-run --report 给出完整的包集合与文件哈希，结果写入缓存"""
+        if (venv_dir / "bin" / "pip").exists():
+            pip_cmd = [str(venv_dir / "bin" / "pip")]
+        elif (self.get_template_path() / "bin" / "pip").exists():
+            pip_cmd = [str(self.get_template_path() / "bin" / "pip")]
+        else:
+            pip_cmd = [sys.executable, "-m", "pip"]
+        with tempfile.TemporaryDirectory(prefix="lock-") as work_dir:
+            report_file = os.path.join(work_dir, "report.json")
+            cmd = pip_cmd + ["install", "--dry-run", "--ignore-installed", "--quiet", "--report", report_file,
+                             "-r", str(requirements_file),
+                             "--find-links", str(Path(self.wheel_store_dir) / "links")]
+            try:
+                result = self._run_pip_with_failover(cmd, project_name, timeout=600, phase="lock")
+            except subprocess.TimeoutExpired:
+                self.log("解析依赖超时", "ERROR")
+                return None
+            if result.returncode != 0:
+                self.log(f"解析依赖失败（需要 pip 22.2+）: {result.stderr}", "ERROR")
+                return None
+            with open(report_file, 'r', encoding='utf-8') as f:
+                report = json.load(f)
+
+        packages = []
+        for item in report.get("install", []):
+            download = item.get("download_info", {})
+            archive = download.get("archive_info", {})
+            digest = archive.get("hashes", {}).get("sha256")
+            if digest is None and archive.get("hash", "").startswith("sha256="):
+                digest = archive["hash"][len("sha256="):]
+            filename = urllib.parse.unquote(download.get("url", "").rsplit("/", 1)[-1])
+            is_wheel = filename.endswith(".whl")
+            # sdist 的哈希与构建出的 wheel 不同，首次安装时补齐
+            packages.append({
+                "name": canonical_name(item["metadata"]["name"]),
+                "version": item["metadata"]["version"],
+                "wheel": filename if is_wheel else None,
+                "sha256": digest if is_wheel else None,
+            })
+        return self._save_resolution(key, inputs, sorted(packages, key=lambda entry: entry["name"]))
+
+    def _install_from_wheel_store(self, project_name: str, pip_path: Path, venv_dir: Path,
+                                  requirements_file: Path, force_reinstall: bool = False) -> Optional[Dict[str, str]]:
+        """通过共享 wheel 仓库增量安装 requirements.txt
+
+        1. 相同依赖集合已有锁定结果时直接使用，只补齐仓库中缺少的 wheel（pip wheel --no-deps）；
+           否则 pip wheel 解析依赖并生成全部 wheel（优先离线使用仓库中已有的 wheel），并缓存锁定结果
+        2. 按 sha256 将 wheel 收录进仓库并解压一次
+        3. 与已安装的包对比，只硬链接新增或版本变化的包，卸载不再需要的包
+
+        成功时返回解析出的包集合（包名 -> 版本），失败时返回 None
+        """
+        site_packages = self._get_site_packages(venv_dir)
+        if site_packages is None:
+            self.log(f"未找到 site-packages 目录: {venv_dir}", "DEBUG")
+            return None
+
+        with open(requirements_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip().startswith(("-e", "--editable")):
+                    self.log("requirements.txt 包含可编辑安装，跳过共享 wheel 仓库", "DEBUG")
+                    return None
+
+        links_dir = Path(self.wheel_store_dir) / "links"
+        try:
+            links_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            self.log(f"创建 wheel 仓库失败: {e}", "DEBUG")
+            return None
+
+        # 强制重建时不使用缓存（重新解析并刷新缓存），但仍遵循 lock 命令写入的锁定结果
+        resolution = self._resolution_key(venv_dir, requirements_file)
+        lock = None
+        if resolution is not None:
+            lock = self._load_lock(project_name, resolution[0], use_cache=not force_reinstall)
+
+        with tempfile.TemporaryDirectory(prefix="wheels-", dir=self.wheel_store_dir) as work_dir:
+            wheels = []
+            if lock is not None:
+                missing = []
+                for entry in lock["packages"]:
+                    digest = entry.get("sha256")
+                    wheel_path = Path(self.wheel_store_dir) / "files" / (digest or "")[:2] / (digest or "") / \
+                        (entry.get("wheel") or "")
+                    if digest and entry.get("wheel") and wheel_path.is_file():
+                        wheels.append((entry["wheel"], digest))
+                    else:
+                        missing.append(f"{entry['name']}=={entry['version']}")
+                self.log(f"使用锁定的解析结果: {len(lock['packages'])} 个包，需获取 {len(missing)} 个", "INFO")
+                base_cmd = [str(pip_path), "wheel", "--no-deps", "-w", work_dir,
+                            "--find-links", str(links_dir)] + missing
+                phase = "fetch"
+            else:
+                missing = True
+                base_cmd = [
+                    str(pip_path), "wheel", "-r", str(requirements_file),
+                    "-w", work_dir, "--find-links", str(links_dir)
+                ]
+                phase = "resolve"
+
+            if missing:
+                result = None
+                try:
+                    if not force_reinstall and not self.offline:
+                        # 仓库与本地 wheelhouse 中已有全部 wheel 时无需访问网络；离线尝试单独记录，便于区分镜像的耗时与失败
+                        cmd = base_cmd + self._find_links_args() + ["--no-index"]
+                        self.log(f"执行: {' '.join(cmd)}", "DEBUG")
+                        result = self._run_installer(cmd, project_name, timeout=600, phase=f"{phase}_offline")
+                    if result is None or result.returncode != 0:
+                        result = self._run_pip_with_failover(base_cmd, project_name, timeout=600, phase=phase)
+                except subprocess.TimeoutExpired:
+                    self.log("生成 wheel 超时", "WARNING")
+                    return None
+
+                if result.returncode != 0:
+                    self.log(f"pip wheel 失败: {result.stderr}", "DEBUG")
+                    return None
+
+            # 仓库中还没有的 wheel 即为本次下载（或构建）得到的
+            with self._phase(project_name, "store") as store:
+                store["bytes_downloaded"] = 0
+                for wheel_file in sorted(Path(work_dir).glob("*.whl")):
+                    if not (links_dir / wheel_file.name).exists():
+                        store["bytes_downloaded"] += wheel_file.stat().st_size
+                    wheels.append(self._add_wheel_to_store(wheel_file))
+                store["package_count"] = len(wheels)
+
+        resolved = {}
+        for wheel_name, _ in wheels:
+            name, version = wheel_name.split("-")[:2]
+            resolved[canonical_name(name)] = version
+
+        if resolution is not None:
+            packages = [{"name": canonical_name(wheel_name.split("-")[0]), "version": wheel_name.split("-")[1],
+                         "wheel": wheel_name, "sha256": digest} for wheel_name, digest in sorted(wheels)]
+            if lock is None or lock["packages"] != packages:
+                self._save_resolution(resolution[0], resolution[1], packages)
+
+        with self._phase(project_name, "install") as install:
+            state = self.load_state(project_name)
+            previous = state["resolved"] if state is not None else {}
+            installed = self._get_installed_dist_infos(site_packages)
+            delta = []
+
+            for wheel_name, digest in wheels:
+                name, version = wheel_name.split("-")[:2]
+                key = canonical_name(name)
+                existing = installed.get(key)
+                if existing is not None:
+                    if not force_reinstall and existing[1] == version:
+                        continue
+                    self._remove_dist_info(site_packages, existing[0])
+                    if existing[1] == version:
+                        delta.append(f"  重装: {key}=={version}")
+                    else:
+                        delta.append(f"  更新: {key} {existing[1]} -> {version}")
+                else:
+                    delta.append(f"  新增: {key}=={version}")
+                self._link_wheel(venv_dir, site_packages, self._unpack_wheel(digest, wheel_name))
+
+            # 只卸载上次解析结果中有、本次没有的包，不动手动安装的包
+            for key in sorted(set(previous) - set(resolved) - BOOTSTRAP_PACKAGES):
+                existing = installed.get(key)
+                if existing is not None:
+                    self._remove_dist_info(site_packages, existing[0])
+                    delta.append(f"  卸载: {key}=={existing[1]}")
+            install["package_count"] = len(resolved)
+            install["changed"] = len(delta)
+
+        if delta:
+            self.log(f"增量安装: {len(resolved)} 个分发包，变化 {len(delta)} 个", "INFO")
+            for change in delta:
+                self.log(change, "INFO")
+        else:
+            self.log(f"增量安装: {len(resolved)} 个分发包均已是最新", "INFO")
+        return resolved
+
+    def _add_wheel_to_store(self, wheel_file: Path) -> Tuple[str, str]:
+        """将 wheel 按内容哈希收录到仓库，返回 (文件名, sha256)"""
+        sha = hashlib.sha256()
+        with open(wheel_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        store = Path(self.wheel_store_dir)
+        target = store / "files" / digest[:2] / digest / wheel_file.name
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(wheel_file, target)
+
+        # links 目录是供 pip --find-links 使用的平铺索引
+        link = store / "links" / wheel_file.name
+        if not link.exists() or not os.path.samefile(link, target):
+            tmp_link = link.with_name(f".{link.name}.{os.getpid()}.{threading.get_ident()}")
+            try:
+                os.link(target, tmp_link)
+            except OSError:
+                shutil.copy2(target, tmp_link)
+            os.replace(tmp_link, link)
+
+        return wheel_file.name, digest
+
+    def _unpack_wheel(self, digest: str, wheel_name: str) -> Path:
+        """将仓库中的 wheel 解压一次，作为硬链接的源目录"""
+        unpacked = Path(self.wheel_store_dir) / "unpacked" / digest
+        if unpacked.exists():
+            return unpacked
+
+        unpacked.parent.mkdir(parents=True, exist_ok=True)
+        wheel_path = Path(self.wheel_store_dir) / "files" / digest[:2] / digest / wheel_name
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{digest}-", dir=unpacked.parent))
+        try:
+            with zipfile.ZipFile(wheel_path) as zf:
+                for member in zf.infolist():
+                    extracted = zf.extract(member, tmp_dir)
+                    mode = member.external_attr >> 16
+                    if mode and not member.is_dir():
+                        os.chmod(extracted, mode & 0o777)
+            # 原子替换，其他进程并发解压时保留先完成的一份
+            os.rename(tmp_dir, unpacked)
+        except OSError:
+            if not unpacked.exists():
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return unpacked
+
+    def _link_wheel(self, venv_dir: Path, site_packages: Path, unpacked: Path):
+        """将解压后的 wheel 硬链接到虚拟环境中（等价于 pip 安装）"""
+        dist_info = next(unpacked.glob("*.dist-info"))
+        data_dir = dist_info.name[:-len(".dist-info")] + ".data"
+        python_path = venv_dir / "bin" / "python"
+        records = []
+
+        def place(src: Path, dst: Path, script: bool = False):
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if dst.exists() or dst.is_symlink():
+                dst.unlink()
+            if script:
+                # 脚本需要改写解释器路径，不能共享
+                with open(src, 'rb') as f:
+                    content = f.read()
+                if content.startswith(b"#!python"):
+                    content = b"#!" + str(python_path).encode() + content[len(b"#!python"):]
+                with open(dst, 'wb') as f:
+                    f.write(content)
+                os.chmod(dst, 0o755)
+            else:
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+            records.append(os.path.relpath(dst, site_packages))
+
+        data_targets = {
+            "purelib": site_packages,
+            "platlib": site_packages,
+            "scripts": venv_dir / "bin",
+            "data": venv_dir,
+            "headers": venv_dir / "include" / "site" / site_packages.parent.name / dist_info.name.split("-")[0],
+        }
+
+        for root, _, files in os.walk(unpacked):
+            rel_root = Path(root).relative_to(unpacked)
+            for file_name in files:
+                src = Path(root) / file_name
+                parts = rel_root.parts
+                if parts and parts[0] == data_dir:
+                    if len(parts) < 2 or parts[1] not in data_targets:
+                        continue
+                    dst = data_targets[parts[1]].joinpath(*parts[2:], file_name)
+                    place(src, dst, script=parts[1] == "scripts")
+                elif parts and parts[0] == dist_info.name and file_name in ("RECORD", "INSTALLER"):
+                    continue
+                else:
+                    place(src, site_packages / rel_root / file_name)
+
+        # 生成 console_scripts / gui_scripts 入口脚本
+        entry_points = dist_info / "entry_points.txt"
+        if entry_points.exists():
+            section = None
+            with open(entry_points, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith("["):
+                        section = line.strip("[]")
+                        continue
+                    if section not in ("console_scripts", "gui_scripts") or "=" not in line:
+                        continue
+                    name, target = (part.strip() for part in line.split("=", 1))
+                    module, _, attr = target.split("[")[0].strip().partition(":")
+                    script_path = venv_dir / "bin" / name
+                    if script_path.exists():
+                        script_path.unlink()
+                    with open(script_path, 'w', encoding='utf-8') as sf:
+                        sf.write(
+                            f"#!{python_path}\n"
+                            "# -*- coding: utf-8 -*-\n"
+                            "import re\n"
+                            "import sys\n"
+                            f"from {module} import {attr.split('.')[0]}\n"
+                            "if __name__ == '__main__':\n"
+                            "    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])\n"
+                            f"    sys.exit({attr}())\n"
+                        )
+                    os.chmod(script_path, 0o755)
+                    records.append(os.path.relpath(script_path, site_packages))
+
+        # INSTALLER 与 RECORD 按虚拟环境单独生成，不能写入共享的硬链接文件
+        target_dist_info = site_packages / dist_info.name
+        with open(target_dist_info / "INSTALLER", 'w', encoding='utf-8') as f:
+            f.write("qinglong_venv_manager\n")
+        records.append(os.path.relpath(target_dist_info / "INSTALLER", site_packages))
+        records.append(os.path.relpath(target_dist_info / "RECORD", site_packages))
+        with open(target_dist_info / "RECORD", 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            for record in records:
+                writer.writerow([record, "", ""])
+
+    def _get_installed_dist_infos(self, site_packages: Path) -> Dict[str, Tuple[Path, str]]:
+        """按规范化包名索引已安装的 dist-info 目录，值为 (目录, 版本)"""
+        installed = {}
+        for dist_info in site_packages.glob("*.dist-info"):
+            name, _, version = dist_info.name[:-len(".dist-info")].rpartition("-")
+            if name:
+                installed[canonical_name(name)] = (dist_info, version)
+        return installed
+
+    def _remove_dist_info(self, site_packages: Path, dist_info: Path):
+        """按 RECORD 卸载一个已安装的分发包"""
+        record = dist_info / "RECORD"
+        dirs = set()
+        if record.exists():
+            with open(record, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.reader(f):
+                    if not row:
+                        continue
+                    path = Path(os.path.normpath(os.path.join(site_packages, row[0])))
+                    if path.is_file() or path.is_symlink():
+                        path.unlink()
+                        dirs.add(path.parent)
+        shutil.rmtree(dist_info, ignore_errors=True)
+
+        # 清理卸载后留下的空目录
+        for directory in sorted(dirs, key=lambda p: len(p.parts), reverse=True):
+            while directory != site_packages and site_packages in directory.parents:
+                try:
+                    if any(entry.name != "__pycache__" for entry in directory.iterdir()):
+                        break
+                except OSError:
+                    break
+                shutil.rmtree(directory, ignore_errors=True)
+                directory = directory.parent
+
+    def _open_state_db(self) -> sqlite3.Connection:
+        """打开状态索引数据库"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        conn = sqlite3.connect(self.state_db, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(STATE_SCHEMA)
+        conn.execute(FILE_HASH_SCHEMA)
+        conn.execute(PHASE_METRICS_SCHEMA)
+        conn.execute(JOBS_SCHEMA)
+        conn.execute(JOBS_INDEX)
+        conn.execute(SHARED_VENV_REFS_SCHEMA)
+        conn.execute(STATE_META_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(venvs)")}
+        for column, definition in STATE_MIGRATIONS:
+            if column not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE venvs ADD COLUMN {column} {definition}")
+                except sqlite3.OperationalError as e:
+                    # 其他进程可能已经完成迁移
+                    if "duplicate column" not in str(e):
+                        raise
+        return conn
+
+    @contextmanager
+    def _state_transaction(self):
+        """状态索引事务，数据库不可用时返回 None 且不影响调用方"""
+        try:
+            conn = self._open_state_db()
+        except (sqlite3.Error, OSError) as e:
+            self.log(f"状态索引不可用: {e}", "DEBUG")
+            yield None
+            return
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _save_state(self, conn: sqlite3.Connection, record: Dict[str, any]):
+        """写入或更新项目状态，只更新 record 中给出的字段"""
+        record = {key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+                  for key, value in record.items()}
+        columns = list(record)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != "project_name")
+        conn.execute(
+            f"INSERT INTO venvs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(project_name) DO UPDATE SET {updates}",
+            [record[column] for column in columns]
+        )
+
+    def _row_to_state(self, row: sqlite3.Row) -> Dict[str, any]:
+        state = dict(row)
+        state["dependency_hashes"] = json.loads(state["dependency_hashes"] or "{}")
+        state["packages"] = json.loads(state["packages"] or "[]")
+        state["resolved"] = json.loads(state["resolved"] or "{}")
+        state["activation"] = json.loads(state["activation"] or "{}")
+        return state
+
+    def load_state(self, project_name: str) -> Optional[Dict[str, any]]:
+        """从状态索引读取单个项目，没有记录时返回 None"""
+        if not os.path.exists(self.state_db):
+            return None
+        try:
+            conn = self._open_state_db()
+            try:
+                row = conn.execute("SELECT * FROM venvs WHERE project_name = ?", (project_name,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self.log(f"读取状态索引失败: {e}", "DEBUG")
+            return None
+        return self._row_to_state(row) if row else None
+
+    def load_all_states(self) -> List[Dict[str, any]]:
+        """读取状态索引中的全部项目"""
+        conn = self._open_state_db()
+        try:
+            rows = conn.execute("SELECT * FROM venvs ORDER BY project_name").fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_state(row) for row in rows]
+
+    def _read_project_state_from_disk(self, project_dir: Path) -> Optional[Dict[str, any]]:
+        """从项目目录中的 .venv_info.json 与虚拟环境重建状态记录"""
+        venv_dir = project_dir / ".venv"
+        if not venv_dir.exists() and not (project_dir / "node_modules").exists():
+            return None
+
+        record = {
+            "project_name": project_dir.name,
+            "project_dir": str(project_dir),
+            "venv_dir": str(venv_dir) if venv_dir.exists() else None,
+        }
+
+        info_file = project_dir / ".venv_info.json"
+        if info_file.exists():
+            try:
+                with open(info_file, 'r', encoding='utf-8') as f:
+                    info_data = json.load(f)
+                record.update({
+                    "python_version": info_data.get("python_version"),
+                    "dependency_hashes": info_data.get("dependency_hashes", {}),
+                    "resolved": info_data.get("resolved_packages", {}),
+                    "package_count": info_data.get("package_count", 0),
+                    "created_at": info_data.get("created_at"),
+                    "last_updated": info_data.get("last_updated"),
+                })
+            except Exception as e:
+                self.log(f"读取 {info_file} 失败: {e}", "DEBUG")
+
+        if venv_dir.exists():
+            record["python_version"] = self.get_venv_python_version(venv_dir) or record.get("python_version")
+            packages = self.list_installed_packages(venv_dir)
+            if packages is not None:
+                record["packages"] = packages
+                record["package_count"] = len(packages)
+            site_packages = self._get_site_packages(venv_dir)
+            if site_packages is not None:
+                record["activation"] = self._build_activation_entry(project_dir.name, project_dir,
+                                                                    venv_dir, site_packages)
+
+        return record
+
+    def reindex(self) -> int:
+        """扫描磁盘重建状态索引，返回索引的项目数"""
+        if not Path(self.scripts_dir).exists():
+            self.log(f"脚本目录不存在: {self.scripts_dir}", "ERROR")
+            return 0
+
+        records = []
+        for item in sorted(Path(self.scripts_dir).iterdir()):
+            if item.is_dir():
+                record = self._read_project_state_from_disk(item)
+                if record is not None:
+                    records.append(record)
+
+        # 保留原有的激活时间，其余字段以磁盘为准
+        with self._state_transaction() as conn:
+            if conn is None:
+                raise RuntimeError(f"无法打开状态索引: {self.state_db}")
+            activated = dict(conn.execute("SELECT project_name, last_activated FROM venvs").fetchall())
+            # 被 gc 回收的项目磁盘上已没有环境，保留其记录以便重建
+            evicted = [row["project_name"] for row in
+                       conn.execute("SELECT project_name, project_dir FROM venvs WHERE evicted_at IS NOT NULL")
+                       if os.path.isdir(row["project_dir"])]
+            conn.execute(f"DELETE FROM venvs WHERE project_name NOT IN ({', '.join('?' for _ in evicted)})",
+                         evicted)
+            for record in records:
+                record["last_activated"] = activated.get(record["project_name"])
+                record["evicted_at"] = None
+                self._save_state(conn, record)
+            conn.execute("INSERT OR REPLACE INTO state_meta (key, value) VALUES ('indexed_at', ?)",
+                         (datetime.now().isoformat(timespec="seconds"),))
+
+        self.write_activation_map()
+        self.log(f"✅ 状态索引已重建: {len(records)} 个项目", "SUCCESS")
+        return len(records)
+
+    def _ensure_indexed(self):
+        """状态索引从未扫描过磁盘时先 reindex
+
+        入队、阶段指标或一次 create 都会先创建 state.db，因此不能按文件是否存在判断：
+        升级前构建的环境只有 reindex 之后才会出现在索引中。
+        """
+        with self._state_transaction() as conn:
+            if conn is None:
+                return
+            indexed = conn.execute("SELECT 1 FROM state_meta WHERE key = 'indexed_at'").fetchone()
+        if indexed is None:
+            self.reindex()
+
+    def _build_activation_entry(self, project_name: str, project_dir: Path, venv_dir: Path,
+                                site_packages: Path) -> Dict[str, any]:
+        """预先计算激活虚拟环境所需的全部信息，sitecustomize 无需再探测目录"""
+        paths = []
+        imports = []
+        # 与 site.addsitedir 一致：按文件名顺序处理 .pth
+        for pth_file in sorted(site_packages.glob("*.pth")):
+            try:
+                with open(pth_file, 'r', encoding='utf-8') as f:
+                    lines = f.read().splitlines()
+            except (OSError, UnicodeDecodeError):
+                continue
+            for line in lines:
+                line = line.rstrip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith(("import ", "import\t")):
+                    imports.append(line)
+                    continue
+                path = os.path.normpath(os.path.join(site_packages, line))
+                if os.path.isdir(path) and path not in paths and path != str(site_packages):
+                    paths.append(path)
+
+        return {
+            "project_dir": str(project_dir),
+            "site_packages": str(site_packages),
+            "paths": paths,
+            "imports": imports,
+            "env": {
+                "VIRTUAL_ENV": str(venv_dir),
+                "VIRTUAL_ENV_PROJECT": project_name
+            }
+        }
+
+    def write_activation_map(self):
+        """根据状态索引重新生成 sitecustomize 使用的激活映射文件"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.activation_map_file + ".lock", 'w') as lock:
+                # 多个构建同时完成时串行写入，保证映射包含所有已提交的项目
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                projects = {}
+                for state in self.load_all_states():
+                    activation = state["activation"]
+                    if not activation:
+                        continue
+                    if state["evicted_at"]:
+                        # 被 gc 回收的环境保留条目，激活时由 sitecustomize 调用 rehydrate 命令重建；
+                        # site_packages 可能位于其他项目仍在使用的共享环境中，不能按目录是否存在判断
+                        projects[state["project_name"]] = dict(activation, evicted=True)
+                    elif os.path.isdir(activation["site_packages"]):
+                        projects[state["project_name"]] = activation
+
+                activation_map = {
+                    "version": 1,
+                    "scripts_dir": str(self.scripts_dir),
+                    "usage_dir": self.usage_dir,
+                    "rehydrate": [sys.executable, os.path.abspath(__file__), "--data-dir", self.data_dir, "create"],
+                    "rehydrate_timeout": self.rehydrate_timeout,
+                    "enqueue": [sys.executable, os.path.abspath(__file__), "--data-dir", self.data_dir, "enqueue"],
+                    "projects": projects
+                }
+                tmp_file = f"{self.activation_map_file}.{os.getpid()}.{threading.get_ident()}"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(activation_map, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp_file, self.activation_map_file)
+        except (OSError, sqlite3.Error) as e:
+            self.log(f"更新激活映射失败: {e}", "WARNING")
+
+    def _create_venv_info(self, project_name: str, venv_dir: Path, project_dir: Path, repo_project_dir: Path = None,
+                          build_seconds: Optional[float] = None, resolved: Optional[Dict[str, str]] = None,
+                          bytecode: Optional[Dict[str, any]] = None):
+        """创建虚拟环境信息文件并更新状态索引"""
         try:
             # 获取 Python 版本
             python_path = venv_dir / "bin" / "python"
-            result = subprocess.run([str(python_path), "--version"], 
-                                  capture_output=True, text=True)
-            python_version = result.stdout.strip() if result.returncode == 0 else "未知版本"
+            python_version = self.get_venv_python_version(venv_dir) or "未知版本"
             
             # 获取已安装包数量
             pip_path = venv_dir / "bin" / "pip"
-            result = subprocess.run([str(pip_path), "list", "--format=freeze"], 
-                                  capture_output=True, text=True)
-            packages = [line for line in result.stdout.split('\n') if line.strip()]
+            packages = self.list_installed_packages(venv_dir) or []
+            site_packages = self._get_site_packages(venv_dir) or venv_dir / "lib" / "python3.11" / "site-packages"
+            # 激活映射记录代目录中的真实路径：已启动的任务在切换后继续使用原来那一代
+            site_packages = Path(os.path.realpath(site_packages))
+            activation = self._build_activation_entry(project_name, project_dir, venv_dir, site_packages)
             
-            # 获取依赖文件哈希值
+            # 获取 Python 依赖文件的哈希值，package.json 的指纹由 Node.js 环境构建负责
             if repo_project_dir is None:
                 repo_project_dir = Path(self.repo_dir) / project_name
-            dependency_hashes = self.get_dependency_hashes(project_dir, repo_project_dir)
+            state = self.load_state(project_name)
+            if resolved is None:
+                # pip 回退安装、pyproject/-e 安装或回滚到没有元数据的一代时没有解析结果：
+                # 保留上次的解析结果作为增量卸载的基准；从未记录过时以实际安装的包为准
+                resolved = state["resolved"] if state is not None and state["resolved"] else {
+                    canonical_name(package.split("==")[0]): package.split("==")[1]
+                    for package in packages if canonical_name(package.split("==")[0]) not in BOOTSTRAP_PACKAGES}
+            python_hashes = self.get_dependency_hashes(
+                project_dir, repo_project_dir, previous=state["dependency_hashes"] if state else None,
+                dep_types=PYTHON_DEPENDENCY_TYPES)
             
-            # 读取现有信息文件以保留创建时间
+            # 读取现有记录以保留创建时间
             info_file = project_dir / ".venv_info.json"
             created_at = datetime.now().isoformat()
-            if info_file.exists():
+            if state is not None and state.get("created_at"):
+                created_at = state["created_at"]
+            elif info_file.exists():
                 try:
                     with open(info_file, 'r', encoding='utf-8') as f:
                         existing_info = json.load(f)
@@ -362,29 +2820,104 @@ class QingLongVenvManager:
                 "venv_dir": str(venv_dir),
                 "python_path": str(python_path),
                 "pip_path": str(pip_path),
-                "site_packages": str(venv_dir / "lib" / "python3.11" / "site-packages"),
+                "site_packages": str(site_packages),
                 "python_version": python_version,
                 "package_count": len(packages),
-                "dependency_hashes": dependency_hashes,
+                "dependency_hashes": self._merge_dependency_hashes(
+                    state["dependency_hashes"] if state else {}, python_hashes, PYTHON_DEPENDENCY_TYPES),
+                "resolved_packages": resolved,
+                "bytecode": bytecode or {},
                 "last_updated": datetime.now().isoformat(),
                 "created_at": created_at,
                 "manager": "qinglong_venv_manager"
             }
             
-            info_file = project_dir / ".venv_info.json"
-            with open(info_file, 'w', encoding='utf-8') as f:
-                json.dump(venv_info, f, indent=2, ensure_ascii=False)
+            # 索引与信息文件在同一事务中更新，写文件失败时索引回滚
+            with self._state_transaction() as conn:
+                if conn is not None:
+                    # 在事务内读取最新的指纹再合并，不覆盖 Node.js 构建写入的 package.json 指纹
+                    row = conn.execute("SELECT dependency_hashes FROM venvs WHERE project_name = ?",
+                                       (project_name,)).fetchone()
+                    venv_info["dependency_hashes"] = self._merge_dependency_hashes(
+                        json.loads(row[0] or "{}") if row else {}, python_hashes, PYTHON_DEPENDENCY_TYPES)
+                    self._save_state(conn, {
+                        "project_name": project_name,
+                        "project_dir": str(project_dir),
+                        "venv_dir": str(venv_dir),
+                        "python_version": python_version,
+                        "dependency_hashes": venv_info["dependency_hashes"],
+                        "resolved": resolved,
+                        "packages": packages,
+                        "package_count": len(packages),
+                        "build_seconds": build_seconds,
+                        "activation": activation,
+                        "created_at": created_at,
+                        "last_updated": venv_info["last_updated"],
+                        "evicted_at": None
+                    })
+                
+                # 先写临时文件再替换，避免并发读取到写了一半的文件
+                tmp_file = info_file.with_name(f".venv_info.json.{os.getpid()}.{threading.get_ident()}")
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(venv_info, f, indent=2, ensure_ascii=False)
+                os.replace(tmp_file, info_file)
             
+            self.write_activation_map()
             self.log(f"虚拟环境信息已保存: {info_file}")
             
         except Exception as e:
             self.log(f"创建虚拟环境信息文件失败: {e}", "WARNING")
     
+    def _find_node_lockfile(self, directory: Path) -> Optional[Tuple[Path, str]]:
+        """查找目录中的锁文件，返回 (锁文件路径, 包管理器)"""
+        for filename, tool in NODE_LOCKFILES:
+            lockfile = directory / filename
+            if lockfile.exists():
+                return lockfile, tool
+        return None
+
+    def _node_install_commands(self, tool: Optional[str], incremental: bool) -> List[List[str]]:
+        """按优先级生成 Node.js 依赖安装命令，前一个失败时依次尝试下一个
+
+        tool 为锁文件对应的包管理器，没有锁文件时为 None。所有命令都使用
+        node_store_dir 中的共享缓存并优先离线安装，且都在现有 node_modules
+        上增量更新；只有 npm 在全新安装时使用会清空 node_modules 的 npm ci。
+        """
+        store = Path(self.node_store_dir)
+        npm_install = [
+            "npm", "install", "--omit=dev", "--no-audit", "--no-fund",
+            "--prefer-offline", "--cache", str(store / "npm")
+        ]
+        attempts = []
+        if tool == "pnpm" and shutil.which("pnpm"):
+            pnpm_install = ["pnpm", "install", "--prod", "--prefer-offline", "--store-dir", str(store / "pnpm")]
+            attempts.append(pnpm_install + ["--frozen-lockfile"])
+            attempts.append(pnpm_install)
+        elif tool == "yarn" and shutil.which("yarn"):
+            attempts.append([
+                "yarn", "install", "--frozen-lockfile", "--production", "--prefer-offline",
+                "--non-interactive", "--cache-folder", str(store / "yarn")
+            ])
+        elif tool == "npm" and not incremental:
+            attempts.append([
+                "npm", "ci", "--omit=dev", "--no-audit", "--no-fund",
+                "--prefer-offline", "--cache", str(store / "npm")
+            ])
+        elif tool is not None and tool != "npm":
+            self.log(f"未找到 {tool}，使用 npm 安装", "WARNING")
+        # npm install 会遵循 package-lock.json，并且只调整与现有 node_modules 不同的部分
+        attempts.append(npm_install)
+        return attempts
+
     def create_nodejs_env(self, project_name: str, force: bool = False) -> bool:
-        """创建 Node.js 环境"""
+        """创建 Node.js 环境
+
+        与 Python 环境相同，依赖安装在 .node-generations 下的新目录中进行，成功后原子切换 node_modules。
+        """
         project_dir = Path(self.scripts_dir) / project_name
         repo_project_dir = Path(self.repo_dir) / project_name
         node_modules_dir = project_dir / "node_modules"
+        generations_dir = project_dir / NODE_GENERATIONS_DIR
         
         self.log(f"为项目 {project_name} 创建 Node.js 环境")
         
@@ -395,21 +2928,17 @@ class QingLongVenvManager:
         
         # 检查 Node.js 环境是否已存在
         nodejs_exists = node_modules_dir.exists()
-        dependencies_changed = self.check_dependencies_changed(project_name)
+        dependencies_changed = self.check_dependencies_changed(project_name, NODE_DEPENDENCY_TYPES)
         
         if nodejs_exists:
             if not force and not dependencies_changed:
                 self.log(f"Node.js 环境已存在且依赖未变化: {node_modules_dir}", "INFO")
                 return True
-            elif dependencies_changed:
-                self.log("package.json 已更新，重新安装依赖...", "INFO")
-                # 删除 node_modules 以确保完全重新安装
-                shutil.rmtree(node_modules_dir)
-                nodejs_exists = False
             elif force:
-                self.log("强制重建 Node.js 环境，删除现有环境...", "WARNING")
-                shutil.rmtree(node_modules_dir)
-                nodejs_exists = False
+                self.log("强制重建 Node.js 环境，在新一代目录中从头安装...", "WARNING")
+            else:
+                # 以当前 node_modules 的硬链接克隆为起点，只更新有变化的包
+                self.log("package.json 或锁文件已更新，增量更新依赖...", "INFO")
         
         # 查找 package.json
         package_files = [
@@ -427,35 +2956,108 @@ class QingLongVenvManager:
             self.log("未找到 package.json 文件", "ERROR")
             return False
         
-        try:
-            self.log(f"发现依赖文件: {package_json}")
-            
-            # 复制 package.json 到项目目录
-            target_package = project_dir / "package.json"
-            if package_json != target_package:
-                shutil.copy2(package_json, target_package)
-                self.log(f"已复制 package.json 到: {target_package}")
-            
-            # 安装依赖
-            self.log("安装 Node.js 依赖...")
-            result = subprocess.run([
-                "npm", "install", "--production", "--no-audit"
-            ], cwd=str(project_dir), capture_output=True, text=True, timeout=600)
-            
-            if result.returncode == 0:
-                self.log("✅ Node.js 依赖安装成功", "SUCCESS")
-                return True
-            else:
-                self.log(f"Node.js 依赖安装失败: {result.stderr}", "ERROR")
-                return False
+        legacy = nodejs_exists and not node_modules_dir.is_symlink()
+        current = None
+        if legacy:
+            current = node_modules_dir
+        elif nodejs_exists:
+            current = Path(os.path.realpath(node_modules_dir))
+        staging = self._new_generation_dir(generations_dir)
+        
+        with self._phase(project_name, "node_build") as build:
+            switched = False
+            try:
+                self.log(f"发现依赖文件: {package_json}")
+                lockfile = self._find_node_lockfile(package_json.parent)
                 
-        except subprocess.TimeoutExpired:
-            self.log("Node.js 依赖安装超时", "ERROR")
-            return False
-        except Exception as e:
-            self.log(f"Node.js 环境创建异常: {e}", "ERROR")
-            return False
-    
+                # 复制 package.json 及锁文件到项目目录
+                target_package = project_dir / "package.json"
+                if package_json != target_package:
+                    shutil.copy2(package_json, target_package)
+                    self.log(f"已复制 package.json 到: {target_package}")
+                    if lockfile is not None:
+                        shutil.copy2(lockfile[0], project_dir / lockfile[0].name)
+                        self.log(f"已复制 {lockfile[0].name} 到: {project_dir}")
+                
+                tool = lockfile[1] if lockfile is not None else None
+                build["tool"] = tool or "npm"
+                if lockfile is None:
+                    self.log("未找到锁文件，按 package.json 解析依赖", "WARNING")
+                
+                # 新一代目录中放入 package.json、锁文件与 .npmrc，包管理器在其中安装
+                staging.mkdir()
+                copied = ["package.json", ".npmrc"] + [filename for filename, _ in NODE_LOCKFILES]
+                for name in copied:
+                    if (project_dir / name).is_file():
+                        shutil.copy2(project_dir / name, staging / name)
+                # 项目中的其他条目以符号链接映射进来，相对路径的 file: 依赖照常解析
+                for entry in os.scandir(project_dir):
+                    if entry.name in copied or entry.name in ("node_modules", ".venv", NODE_GENERATIONS_DIR,
+                                                              VENV_GENERATIONS_DIR):
+                        continue
+                    os.symlink(os.path.join("..", "..", entry.name), staging / entry.name)
+                incremental = current is not None and not force
+                if incremental:
+                    self._clone_generation(current, staging / "node_modules")
+                    # 顶层的元数据文件（.package-lock.json、.modules.yaml 等）会被原地改写，不能共享 inode
+                    for entry in os.scandir(staging / "node_modules"):
+                        if entry.is_file(follow_symlinks=False):
+                            tmp_path = f"{entry.path}.tmp"
+                            shutil.copy2(entry.path, tmp_path)
+                            os.replace(tmp_path, entry.path)
+                
+                # 安装依赖
+                self.log("安装 Node.js 依赖...")
+                result = None
+                for cmd in self._node_install_commands(tool, incremental):
+                    self.log(f"执行: {' '.join(cmd)}", "DEBUG")
+                    result = self._run_installer(cmd, project_name, timeout=600, cwd=str(staging), phase="node_install")
+                    if result.returncode == 0:
+                        break
+                    self.log(f"{cmd[0]} {cmd[1]} 失败: {result.stderr}", "DEBUG")
+                
+                if result.returncode == 0:
+                    self.log("✅ Node.js 依赖安装成功", "SUCCESS")
+                    (staging / "node_modules").mkdir(exist_ok=True)  # 没有任何依赖时包管理器不会创建
+                    self._switch_generation(node_modules_dir, staging / "node_modules", generations_dir,
+                                            generations_dir / f"legacy-{staging.name}" / "node_modules")
+                    switched = True
+                    self.log(f"✅ 已切换到新一代 node_modules: {staging.name}", "SUCCESS")
+                    current = self.get_dependency_hashes(project_dir, repo_project_dir,
+                                                         dep_types=NODE_DEPENDENCY_TYPES)
+                    with self._state_transaction() as conn:
+                        if conn is not None:
+                            # 只更新 package.json 的指纹，Python 依赖的指纹由 Python 环境构建负责
+                            row = conn.execute(
+                                "SELECT dependency_hashes FROM venvs WHERE project_name = ?", (project_name,)
+                            ).fetchone()
+                            dependency_hashes = self._merge_dependency_hashes(
+                                json.loads(row[0] or "{}") if row else {}, current, NODE_DEPENDENCY_TYPES)
+                            self._save_state(conn, {
+                                "project_name": project_name,
+                                "project_dir": str(project_dir),
+                                "dependency_hashes": dependency_hashes,
+                                "last_updated": datetime.now().isoformat(),
+                                "evicted_at": None
+                            })
+                    return True
+                else:
+                    self.log(f"Node.js 依赖安装失败: {result.stderr}", "ERROR")
+                    build["success"] = False
+                    return False
+                    
+            except subprocess.TimeoutExpired:
+                self.log("Node.js 依赖安装超时", "ERROR")
+                build["success"] = False
+                return False
+            except Exception as e:
+                self.log(f"Node.js 环境创建异常: {e}", "ERROR")
+                build["success"] = False
+                return False
+            finally:
+                if not switched:
+                    self._discard_generation(staging)
+        
     def create_venv(self, project_name: str, force: bool = False) -> bool:
         """自动检测并创建虚拟环境"""
         self.log("=" * 60)
@@ -477,28 +3079,34 @@ class QingLongVenvManager:
             self.log("未检测到 Python 或 Node.js 项目配置文件", "WARNING")
             self.log("支持的配置文件:")
             self.log("  Python: requirements.txt, pyproject.toml, setup.py, Pipfile")
-            self.log("  Node.js: package.json, yarn.lock, pnpm-lock.yaml")
+            self.log("  Node.js: package.json, package-lock.json, yarn.lock, pnpm-lock.yaml")
             return False
         
-        success = True
+        state = self.load_state(project_name)
+        if state is not None and state["evicted_at"]:
+            self.log(f"环境已于 {state['evicted_at'][:16]} 被回收，按保留的锁定结果重建", "INFO")
         
-        # 创建 Python 虚拟环境
-        if project_info["has_python"]:
-            self.log("检测到 Python 项目", "INFO")
-            for dep_file in project_info["python_deps"]:
-                self.log(f"  - {dep_file}")
+        # 构建期间持有项目锁，dedupe 会跳过正在重建的项目
+        with self._project_lock(project_name):
+            success = True
+        
+            # 创建 Python 虚拟环境
+            if project_info["has_python"]:
+                self.log("检测到 Python 项目", "INFO")
+                for dep_file in project_info["python_deps"]:
+                    self.log(f"  - {dep_file}")
             
-            if not self.create_python_venv(project_name, force):
-                success = False
+                if not self.create_python_venv(project_name, force):
+                    success = False
         
-        # 创建 Node.js 环境
-        if project_info["has_nodejs"]:
-            self.log("检测到 Node.js 项目", "INFO")
-            for dep_file in project_info["nodejs_deps"]:
-                self.log(f"  - {dep_file}")
+            # 创建 Node.js 环境
+            if project_info["has_nodejs"]:
+                self.log("检测到 Node.js 项目", "INFO")
+                for dep_file in project_info["nodejs_deps"]:
+                    self.log(f"  - {dep_file}")
             
-            if not self.create_nodejs_env(project_name, force):
-                success = False
+                if not self.create_nodejs_env(project_name, force):
+                    success = False
         
         if success:
             self.log("=" * 60)
@@ -510,7 +3118,706 @@ class QingLongVenvManager:
             self.log("=" * 60)
         
         return success
-    
+
+    @contextmanager
+    def _project_lock(self, project_name: str, blocking: bool = True):
+        """项目构建锁（flock），blocking=False 且锁已被占用时返回 False"""
+        lock_dir = Path(self.cache_dir) / "locks"
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        with open(lock_dir / f"{project_name}.lock", 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def discover_projects(self) -> List[str]:
+        """查找 scripts 目录下所有包含依赖文件的项目"""
+        if not Path(self.scripts_dir).exists():
+            return []
+
+        projects = []
+        for item in sorted(Path(self.scripts_dir).iterdir()):
+            if not item.is_dir() or item.name.startswith("."):
+                continue
+            project_info = self.detect_project_type(str(Path(self.repo_dir) / item.name))
+            if not project_info["has_python"] and not project_info["has_nodejs"]:
+                project_info = self.detect_project_type(str(item))
+            if project_info["has_python"] or project_info["has_nodejs"]:
+                projects.append(item.name)
+        return projects
+
+    def _watch_dirs(self, project_name: str) -> Tuple[set, set]:
+        """项目需要监听的目录，以及指纹中记录的全部输入文件"""
+        dirs = {os.path.join(self.scripts_dir, project_name), os.path.join(self.repo_dir, project_name)}
+        inputs = set()
+        state = self.load_state(project_name)
+        for info in (state["dependency_hashes"] if state else {}).values():
+            for path in info.get("inputs", {}):
+                inputs.add(path)
+                dirs.add(os.path.dirname(path))
+        return {d for d in dirs if os.path.isdir(d)}, inputs
+
+    def _watch_rebuild(self, project_name: str) -> Optional[bool]:
+        """依赖确实发生变化时才重建，返回 None 表示无需重建"""
+        if not self.check_dependencies_changed(project_name):
+            return None
+        return self.create_venv(project_name)
+
+    def watch(self, debounce: float = 2.0, workers: int = 1) -> bool:
+        """监听依赖文件变化并自动重建虚拟环境（inotify，空闲时阻塞等待，不占用 CPU）
+
+        事件按项目合并：最后一次写入后 debounce 秒内没有新事件才排队重建；
+        项目正在重建时再次变化，会在本次完成后重新检查。
+        """
+        try:
+            inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            self.log(f"inotify 不可用，无法启动 watch 模式: {e}", "ERROR")
+            return False
+
+        project_watches = {}  # 目录 -> 项目名
+        project_inputs = {}   # 项目名 -> 指纹输入文件
+
+        def watch_dir(path: str, project_name: Optional[str]):
+            if path in project_watches and project_name is None:
+                return
+            try:
+                inotify.add_watch(path)
+            except OSError as e:
+                self.log(f"无法监听目录 {path}: {e}", "WARNING")
+                return
+            if project_name is not None:
+                project_watches[path] = project_name
+
+        def register(project_name: str):
+            dirs, inputs = self._watch_dirs(project_name)
+            project_inputs[project_name] = inputs
+            for path in dirs:
+                watch_dir(path, project_name)
+
+        roots = [self.scripts_dir, self.repo_dir]
+        for root in roots:
+            if os.path.isdir(root):
+                watch_dir(root, None)
+        projects = set()
+        for root in roots:
+            if os.path.isdir(root):
+                projects.update(item.name for item in os.scandir(root)
+                                if item.is_dir() and not item.name.startswith("."))
+        for project_name in projects:
+            register(project_name)
+
+        # 启动时检查一遍，补上 watch 未运行期间的变化
+        pending = {project_name: time.monotonic() for project_name in self.discover_projects()}
+        running = {}
+        rerun = set()
+
+        def handle_sigterm(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        self.log(f"开始监听 {len(projects)} 个项目的依赖文件 ({len(inotify.watches)} 个目录，防抖 {debounce}s)")
+
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        try:
+            while True:
+                now = time.monotonic()
+                timeout = None
+                if pending:
+                    timeout = max(0.0, min(pending.values()) - now)
+                if running:
+                    # 有构建在进行时定期检查是否完成
+                    timeout = 1.0 if timeout is None else min(timeout, 1.0)
+                try:
+                    ready, _, _ = select.select([inotify.fd], [], [], timeout)
+                except InterruptedError:
+                    continue
+
+                if ready:
+                    for directory, name, mask in inotify.read_events():
+                        if mask & Inotify.IN_Q_OVERFLOW:
+                            self.log("inotify 事件队列溢出，重新检查全部项目", "WARNING")
+                            for project_name in projects:
+                                pending[project_name] = time.monotonic() + debounce
+                            continue
+                        path = os.path.join(directory, name)
+                        if directory in roots:
+                            # scripts / repo 下新增的项目目录
+                            if mask & Inotify.IN_ISDIR and mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO) \
+                                    and not name.startswith("."):
+                                projects.add(name)
+                                register(name)
+                                pending[name] = time.monotonic() + debounce
+                            continue
+                        project_name = project_watches.get(directory)
+                        if project_name is None or mask & Inotify.IN_ISDIR:
+                            continue
+                        if name in WATCHED_DEPENDENCY_FILES or path in project_inputs.get(project_name, ()):
+                            self.log(f"检测到依赖文件变化: {path}", "DEBUG")
+                            pending[project_name] = time.monotonic() + debounce
+
+                now = time.monotonic()
+                for project_name, deadline in list(pending.items()):
+                    if deadline > now:
+                        continue
+                    del pending[project_name]
+                    if project_name in running:
+                        rerun.add(project_name)
+                    else:
+                        running[project_name] = executor.submit(
+                            self._run_captured, self._watch_rebuild, project_name)
+
+                for project_name, future in list(running.items()):
+                    if not future.done():
+                        continue
+                    del running[project_name]
+                    result, output, duration = future.result()
+                    if result is not None or self.debug:
+                        sys.stdout.write(output)
+                        sys.stdout.flush()
+                    # 依赖文件可能新增了 -r 引入的文件，重新登记监听目录
+                    register(project_name)
+                    if project_name in rerun:
+                        rerun.discard(project_name)
+                        pending[project_name] = time.monotonic()
+        except KeyboardInterrupt:
+            self.log("收到停止信号，等待正在进行的构建完成...")
+        finally:
+            executor.shutdown(wait=True)
+            inotify.close()
+        self.log("watch 已停止")
+        return True
+
+    def _run_captured(self, func, *args) -> Tuple[bool, str, float]:
+        """在当前线程中执行构建函数，日志写入独立缓冲区"""
+        buffer = io.StringIO()
+        self._local.stream = buffer
+        start = time.monotonic()
+        try:
+            success = func(*args)
+        except Exception as e:
+            self.log(f"构建异常: {e}", "ERROR")
+            success = False
+        finally:
+            self._local.stream = None
+        return success, buffer.getvalue(), time.monotonic() - start
+
+    def _sync_project(self, project_name: str, force: bool = False) -> Dict[str, any]:
+        """同时构建单个项目的 Python 与 Node.js 环境"""
+        start = time.monotonic()
+        project_info = self.detect_project_type(str(Path(self.repo_dir) / project_name))
+        if not project_info["has_python"] and not project_info["has_nodejs"]:
+            project_info = self.detect_project_type(str(Path(self.scripts_dir) / project_name))
+
+        jobs = {}
+        if project_info["has_python"]:
+            jobs["Python"] = self.create_python_venv
+        if project_info["has_nodejs"]:
+            jobs["Node.js"] = self.create_nodejs_env
+
+        results = {}
+        with self._project_lock(project_name), ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as executor:
+            futures = {kind: executor.submit(self._run_captured, func, project_name, force)
+                       for kind, func in jobs.items()}
+            for kind, future in futures.items():
+                results[kind] = future.result()
+
+        return {
+            "project_name": project_name,
+            "results": results,
+            "success": all(result[0] for result in results.values()),
+            "duration": time.monotonic() - start
+        }
+
+    def sync_venvs(self, workers: int = 4, force: bool = False) -> bool:
+        """并发为所有项目创建或更新虚拟环境"""
+        projects = self.discover_projects()
+        if not projects:
+            self.log("未找到需要创建虚拟环境的项目", "WARNING")
+            return True
+
+        workers = max(1, workers)
+        self.log(f"开始同步 {len(projects)} 个项目的虚拟环境 (并发数: {workers})")
+        start = time.monotonic()
+
+        summaries = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._sync_project, project, force) for project in projects]
+            for future in as_completed(futures):
+                summary = future.result()
+                summaries.append(summary)
+
+                # 项目完成后整块输出日志，避免不同项目的输出交错
+                self.log("=" * 60)
+                self.log(f"项目 {summary['project_name']} ({len(summaries)}/{len(projects)})")
+                for kind, (_, output, _) in summary["results"].items():
+                    sys.stdout.write(output)
+                sys.stdout.flush()
+
+        # 汇总
+        self.log("=" * 60)
+        print(f"{Colors.WHITE}{'项目名':<25} {'Python':<10} {'Node.js':<10} {'耗时':<10}{Colors.NC}")
+        print("-" * 60)
+        for summary in sorted(summaries, key=lambda x: x["project_name"]):
+            cells = []
+            for kind in ("Python", "Node.js"):
+                result = summary["results"].get(kind)
+                if result is None:
+                    cells.append(f"{'-':<10}")
+                elif result[0]:
+                    cells.append(f"{Colors.GREEN}{'成功':<10}{Colors.NC}")
+                else:
+                    cells.append(f"{Colors.RED}{'失败':<10}{Colors.NC}")
+            print(f"{summary['project_name'][:24]:<25} {cells[0]} {cells[1]} {summary['duration']:.1f}s")
+        print("-" * 60)
+
+        failed = [summary["project_name"] for summary in summaries if not summary["success"]]
+        elapsed = time.monotonic() - start
+        if failed:
+            self.log(f"同步完成: {len(summaries) - len(failed)} 成功, {len(failed)} 失败, 耗时 {elapsed:.1f}s", "WARNING")
+            self.log(f"失败项目: {', '.join(sorted(failed))}", "WARNING")
+            return False
+
+        self.log(f"🎉 同步完成: {len(summaries)} 个项目全部成功, 耗时 {elapsed:.1f}s", "SUCCESS")
+        return True
+
+    def _hash_file(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _scan_dedupe_files(self, root: Path, files: Dict[str, os.stat_result]):
+        """收集目录下的普通文件（不跟随符号链接）"""
+        stack = [str(root)]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        if st.st_size > 0:
+                            files[entry.path] = st
+                except OSError:
+                    continue
+
+    def dedupe(self, workers: int = 4) -> Dict[str, int]:
+        """将各项目 .venv 与 node_modules 中内容相同的文件替换为硬链接
+
+        只有 size 相同且位于同一文件系统的文件才会计算哈希，哈希结果按
+        size / mtime / inode 缓存在状态索引中，重复运行时只重新计算变化的文件。
+        项目锁只在扫描与替换该项目的文件时短暂持有，正在重建的项目会被跳过。
+        """
+        stats = {"projects": 0, "skipped": 0, "files": 0, "hashed": 0, "linked": 0, "reclaimed": 0}
+        venvs = self.list_venvs()
+        if not venvs:
+            self.log("没有可去重的虚拟环境", "WARNING")
+            return stats
+
+        files = {}
+        owners = {}
+        for venv in venvs:
+            project_name = venv["project_name"]
+            # 只在扫描该项目时持有锁，哈希期间不阻塞其他项目的重建
+            with self._project_lock(project_name, blocking=False) as locked:
+                if not locked:
+                    self.log(f"项目 {project_name} 正在重建，跳过", "WARNING")
+                    stats["skipped"] += 1
+                    continue
+                project_dir = Path(venv["project_dir"])
+                roots = []
+                if venv["has_python_venv"]:
+                    site_packages = self._get_site_packages(project_dir / ".venv")
+                    if site_packages is not None:
+                        roots.append(site_packages)
+                if venv["has_nodejs_env"]:
+                    roots.append(project_dir / "node_modules")
+                project_files = {}
+                for root in roots:
+                    self._scan_dedupe_files(root, project_files)
+            for path in project_files:
+                owners.setdefault(path, project_name)
+            files.update(project_files)
+            stats["projects"] += 1
+        stats["files"] = len(files)
+        self.log(f"扫描 {stats['projects']} 个项目，共 {len(files)} 个文件")
+
+        # 只有 size 相同、且不是同一个 inode 的文件才可能需要合并
+        by_size = {}
+        for path, st in files.items():
+            by_size.setdefault((st.st_dev, st.st_size), []).append(path)
+        candidates = [path for paths in by_size.values()
+                      if len({files[p].st_ino for p in paths}) > 1 for path in paths]
+
+        with self._state_transaction() as conn:
+            cache = {}
+            if conn is not None:
+                for row in conn.execute("SELECT path, size, mtime_ns, inode, digest FROM file_hashes"):
+                    cache[row[0]] = (row[1], row[2], row[3], row[4])
+
+        digests = {}
+        to_hash = []
+        for path in candidates:
+            st = files[path]
+            cached = cache.get(path)
+            if cached is not None and cached[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+                digests[path] = cached[3]
+            else:
+                to_hash.append(path)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(self._hash_file, path): path for path in to_hash}
+            for future in as_completed(futures):
+                try:
+                    digests[futures[future]] = future.result()
+                except OSError as e:
+                    self.log(f"读取文件失败 {futures[future]}: {e}", "DEBUG")
+        stats["hashed"] = len(to_hash)
+
+        # 按 (设备, 大小, 权限, 属主, 哈希) 分组，保证硬链接不改变文件属性
+        groups = {}
+        for path, digest in digests.items():
+            st = files[path]
+            key = (st.st_dev, st.st_size, st.st_mode, st.st_uid, st.st_gid, digest)
+            groups.setdefault(key, []).append(path)
+
+        # 链接数最多的 inode 作为保留的副本，需要替换的文件按所属项目归类
+        plans = {}
+        for paths in groups.values():
+            paths.sort(key=lambda p: (-files[p].st_nlink, p))
+            keep = paths[0]
+            for path in paths[1:]:
+                if files[path].st_ino != files[keep].st_ino:
+                    plans.setdefault(owners[path], []).append((path, keep))
+
+        removed_links = {}
+        for project_name, links in sorted(plans.items()):
+            # 逐个项目加锁，只在替换该项目的文件时持有
+            with self._project_lock(project_name, blocking=False) as locked:
+                if not locked:
+                    self.log(f"项目 {project_name} 正在重建，跳过硬链接", "WARNING")
+                    continue
+                for path, keep in links:
+                    st = files[path]
+                    kept = files[keep]
+                    tmp_link = f"{path}.dedupe-{os.getpid()}"
+                    try:
+                        current = os.lstat(path)
+                        if (current.st_ino, current.st_size, current.st_mtime_ns) != \
+                                (st.st_ino, st.st_size, st.st_mtime_ns):
+                            continue  # 哈希之后文件发生了变化
+                        os.link(keep, tmp_link)
+                        # 保留的副本属于其他项目，可能在哈希之后被替换
+                        linked = os.lstat(tmp_link)
+                        if (linked.st_ino, linked.st_mtime_ns) != (kept.st_ino, kept.st_mtime_ns):
+                            os.unlink(tmp_link)
+                            continue
+                        os.replace(tmp_link, path)
+                    except OSError as e:
+                        self.log(f"创建硬链接失败 {path}: {e}", "DEBUG")
+                        if os.path.lexists(tmp_link):
+                            os.unlink(tmp_link)
+                        continue
+                    stats["linked"] += 1
+                    removed_links[st.st_ino] = removed_links.get(st.st_ino, 0) + 1
+                    if removed_links[st.st_ino] == st.st_nlink:
+                        stats["reclaimed"] += st.st_size
+                    files[path] = kept
+
+        with self._state_transaction() as conn:
+            if conn is not None:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, inode, digest) VALUES (?, ?, ?, ?, ?)",
+                    [(path, files[path].st_size, files[path].st_mtime_ns, files[path].st_ino, digest)
+                     for path, digest in digests.items()]
+                )
+                # 清理已不存在的文件
+                stale = [path for path in cache if path not in files and not os.path.exists(path)]
+                conn.executemany("DELETE FROM file_hashes WHERE path = ?", [(path,) for path in stale])
+
+        self.log(f"✅ 去重完成: 计算哈希 {stats['hashed']} 个文件，新建硬链接 {stats['linked']} 个，"
+                 f"释放 {stats['reclaimed'] / 1024 / 1024:.1f} MB", "SUCCESS")
+        return stats
+
+    def enqueue(self, project_name: str, force: bool = False) -> Optional[int]:
+        """将项目加入构建队列并确保后台 worker 在运行，立即返回任务 ID
+
+        同一项目已有排队中的任务时合并为一个（force 取并集），正在运行的
+        任务不参与合并：它可能已经读取了旧的依赖文件。
+        """
+        with self._state_transaction() as conn:
+            if conn is None:
+                return None
+            conn.execute(
+                "INSERT INTO jobs (project_name, force, enqueued_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (project_name) WHERE status = 'queued' "
+                "DO UPDATE SET requests = requests + 1, force = max(force, excluded.force)",
+                (project_name, int(force), datetime.now().isoformat(timespec="seconds"))
+            )
+            job_id = conn.execute(
+                "SELECT id FROM jobs WHERE project_name = ? AND status = 'queued'", (project_name,)
+            ).fetchone()[0]
+        self.log(f"项目 {project_name} 已加入构建队列 (任务 #{job_id})", "SUCCESS")
+        self._ensure_worker()
+        return job_id
+
+    def _worker_lock_path(self) -> Path:
+        lock_dir = Path(self.cache_dir) / "locks"
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        return lock_dir / "worker.lock"
+
+    def _worker_running(self) -> bool:
+        with open(self._worker_lock_path(), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        return False
+
+    def _ensure_worker(self):
+        """没有 worker 在运行时启动一个后台 worker 进程"""
+        if self._worker_running():
+            return
+        log_file = Path(self.log_dir) / "venv_manager" / "worker.log"
+        try:
+            log_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(log_file, 'a') as output:
+                subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), "--data-dir", self.data_dir, "worker"],
+                    stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.STDOUT, start_new_session=True
+                )
+        except OSError as e:
+            self.log(f"启动后台 worker 失败: {e}", "WARNING")
+
+    def _claim_job(self) -> Optional[Dict[str, any]]:
+        """取出最早排队、且该项目没有正在运行任务的一个任务"""
+        with self._state_transaction() as conn:
+            if conn is None:
+                return None
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND project_name NOT IN "
+                    "(SELECT project_name FROM jobs WHERE status = 'running') ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, worker_pid = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (datetime.now().isoformat(timespec="seconds"), os.getpid(), row["id"])
+                ).rowcount
+                if claimed:
+                    return dict(row)
+
+    def _finish_job(self, job_id: int, success: bool, duration: float):
+        with self._state_transaction() as conn:
+            if conn is None:
+                return
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, duration = ? WHERE id = ?",
+                ("done" if success else "failed", datetime.now().isoformat(timespec="seconds"),
+                 round(duration, 3), job_id)
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND id NOT IN "
+                "(SELECT id FROM jobs WHERE status IN ('done', 'failed') ORDER BY id DESC LIMIT ?)",
+                (self.job_history,)
+            )
+
+    def _worker_loop(self):
+        while True:
+            job = self._claim_job()
+            if job is None:
+                return
+            # create_venv 内部持有项目锁，与手动执行的 create 同样互斥
+            success, output, duration = self._run_captured(self.create_venv, job["project_name"], bool(job["force"]))
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            self._finish_job(job["id"], success, duration)
+
+    def _requeue_stale_jobs(self):
+        """将异常退出遗留的 running 任务重新排队；同一项目已有排队任务时并入该任务"""
+        with self._state_transaction() as conn:
+            if conn is None:
+                return
+            stale = conn.execute("SELECT id, project_name, force, requests FROM jobs "
+                                 "WHERE status = 'running' ORDER BY id").fetchall()
+            for row in stale:
+                queued = conn.execute("SELECT id FROM jobs WHERE project_name = ? AND status = 'queued'",
+                                      (row["project_name"],)).fetchone()
+                if queued is None:
+                    conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL, worker_pid = NULL "
+                                 "WHERE id = ?", (row["id"],))
+                else:
+                    # 排队任务的唯一索引只允许一行，遗留任务的请求并入已有的排队任务
+                    conn.execute("UPDATE jobs SET requests = requests + ?, force = max(force, ?) WHERE id = ?",
+                                 (row["requests"], row["force"], queued["id"]))
+                    conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+                self.log(f"恢复异常退出时遗留的任务: {row['project_name']}", "WARNING")
+
+    def run_worker(self, workers: int = 1) -> bool:
+        """处理构建队列直到清空；同一时间只有一个 worker 进程"""
+        while True:
+            with open(self._worker_lock_path(), 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.log("已有 worker 在运行", "DEBUG")
+                    return True
+
+                # 持有 worker 锁说明不存在其他 worker，遗留的 running 任务来自异常退出的进程
+                try:
+                    self._requeue_stale_jobs()
+                except sqlite3.Error as e:
+                    self.log(f"恢复遗留任务失败: {e}", "ERROR")
+
+                with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                    for _ in range(max(1, workers)):
+                        executor.submit(self._worker_loop)
+
+            # 释放锁后再检查一次，避免入队方恰好在退出前看到锁仍被持有
+            with self._state_transaction() as conn:
+                if conn is None or conn.execute("SELECT 1 FROM jobs WHERE status = 'queued' LIMIT 1").fetchone() is None:
+                    return True
+
+    def show_status(self, limit: int = 20):
+        """显示排队中、运行中以及最近完成的构建任务"""
+        with self._state_transaction() as conn:
+            if conn is None:
+                self.log("状态索引不可用", "ERROR")
+                return
+            active = conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY id").fetchall()
+            finished = conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('done', 'failed') ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+        worker = f"{Colors.GREEN}运行中{Colors.NC}" if self._worker_running() else "未运行"
+        print(f"\n后台 worker: {worker}")
+        status_text = {
+            "queued": f"{Colors.YELLOW}{'排队中':<8}{Colors.NC}",
+            "running": f"{Colors.CYAN}{'运行中':<8}{Colors.NC}",
+            "done": f"{Colors.GREEN}{'成功':<8}{Colors.NC}",
+            "failed": f"{Colors.RED}{'失败':<8}{Colors.NC}",
+        }
+        print(f"{Colors.WHITE}{'ID':<6} {'项目名':<25} {'状态':<8} {'合并':<6} {'入队时间':<20} {'耗时':<8}{Colors.NC}")
+        print("-" * 80)
+        for row in list(active) + list(finished):
+            duration = f"{row['duration']:.1f}s" if row["duration"] is not None else "-"
+            print(f"{row['id']:<6} {row['project_name'][:24]:<25} {status_text[row['status']]} "
+                  f"{row['requests']:<6} {row['enqueued_at']:<20} {duration:<8}")
+        print("-" * 80)
+        print(f"排队 {sum(1 for row in active if row['status'] == 'queued')} 个，"
+              f"运行 {sum(1 for row in active if row['status'] == 'running')} 个")
+
+    def load_phase_events(self, project_name: Optional[str] = None) -> List[Dict[str, any]]:
+        """读取阶段事件日志（含轮转的上一份）"""
+        events = []
+        for path in (self.events_file + ".1", self.events_file):
+            try:
+                f = open(path, 'r', encoding='utf-8')
+            except OSError:
+                continue
+            with f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if project_name is None or event.get("project") == project_name:
+                        events.append(event)
+        return events
+
+    def show_stats(self, project_name: Optional[str] = None, top: int = 10):
+        """按阶段汇总耗时分布（p50 / p95），并列出构建最慢的项目"""
+        events = self.load_phase_events(project_name)
+        if not events:
+            self.log(f"没有阶段事件记录: {self.events_file}", "WARNING")
+            return
+
+        by_phase = {}
+        for event in events:
+            by_phase.setdefault(event["phase"], []).append(event)
+
+        print(f"\n{Colors.WHITE}{'阶段':<16} {'次数':>6} {'失败':>6} {'p50':>9} {'p95':>9} {'最大':>9} {'下载':>10}{Colors.NC}")
+        print("-" * 72)
+        rows = []
+        for phase, phase_events in by_phase.items():
+            durations = [event["duration_seconds"] for event in phase_events]
+            rows.append((
+                phase, len(phase_events), sum(1 for event in phase_events if not event.get("success")),
+                percentile(durations, 50), percentile(durations, 95), max(durations),
+                sum(event.get("bytes_downloaded") or 0 for event in phase_events)
+            ))
+        for phase, count, failures, p50, p95, longest, downloaded in sorted(rows, key=lambda row: -row[4]):
+            failed = f"{Colors.RED}{failures:>6}{Colors.NC}" if failures else f"{failures:>6}"
+            print(f"{phase:<16} {count:>6} {failed} {p50:>8.2f}s {p95:>8.2f}s {longest:>8.2f}s "
+                  f"{downloaded / 1024 / 1024:>8.1f}MB")
+        print("-" * 72)
+
+        builds = {}
+        for event in events:
+            if event["phase"] in ("python_build", "node_build"):
+                builds.setdefault(event["project"], []).append(event["duration_seconds"])
+        if project_name is None and builds:
+            print(f"\n{Colors.WHITE}构建最慢的项目 (按 p95){Colors.NC}")
+            print(f"{Colors.WHITE}{'项目名':<25} {'构建次数':>8} {'p50':>9} {'p95':>9}{Colors.NC}")
+            print("-" * 56)
+            ranked = sorted(builds.items(), key=lambda item: -percentile(item[1], 95))[:top]
+            for name, durations in ranked:
+                print(f"{name[:24]:<25} {len(durations):>8} {percentile(durations, 50):>8.2f}s "
+                      f"{percentile(durations, 95):>8.2f}s")
+            print("-" * 56)
+
+    def rollback(self, project_name: str) -> bool:
+        """将 .venv / node_modules 原子地切回上一代"""
+        project_dir = Path(self.scripts_dir) / project_name
+        if not project_dir.exists():
+            self.log(f"项目目录不存在: {project_dir}", "ERROR")
+            return False
+        
+        rolled_back = False
+        with self._project_lock(project_name):
+            for link, generations_dir in ((project_dir / ".venv", project_dir / VENV_GENERATIONS_DIR),
+                                          (project_dir / "node_modules", project_dir / NODE_GENERATIONS_DIR)):
+                current = self._linked_generation(link, generations_dir)
+                previous = self._previous_generation(generations_dir, current)
+                if previous is None:
+                    continue
+                
+                target = previous if link.name == ".venv" else previous / "node_modules"
+                if not target.is_dir():
+                    self.log(f"上一代已不完整，无法回滚: {target}", "ERROR")
+                    continue
+                self._switch_generation(link, target, generations_dir, generations_dir / f"legacy-{previous.name}")
+                self.log(f"✅ {link.name} 已回滚到: {previous.name}", "SUCCESS")
+                rolled_back = True
+                
+                if link.name == ".venv":
+                    # 恢复该代构建时的解析结果，后续增量安装以它为基准
+                    resolved = None
+                    try:
+                        with open(previous / GENERATION_META_FILE, 'r', encoding='utf-8') as f:
+                            resolved = json.load(f).get("resolved")
+                    except (OSError, ValueError):
+                        pass
+                    self._create_venv_info(project_name, link, project_dir, resolved=resolved)
+        
+        if not rolled_back:
+            self.log(f"项目 {project_name} 没有可回滚的上一代环境", "WARNING")
+        return rolled_back
+
     def remove_venv(self, project_name: str) -> bool:
         """删除虚拟环境"""
         project_dir = Path(self.scripts_dir) / project_name
@@ -522,19 +3829,21 @@ class QingLongVenvManager:
         
         removed = False
         
-        # 删除 Python 虚拟环境
-        if venv_dir.exists():
+        # 删除 Python 虚拟环境（符号链接及所有代）
+        if os.path.lexists(venv_dir):
             try:
-                shutil.rmtree(venv_dir)
+                self._remove_generations(venv_dir, project_dir / VENV_GENERATIONS_DIR)
+                # 共享环境只在最后一个引用释放时删除
+                self._release_shared_venvs(project_name)
                 self.log(f"✅ 已删除 Python 虚拟环境: {venv_dir}", "SUCCESS")
                 removed = True
             except Exception as e:
                 self.log(f"删除 Python 虚拟环境失败: {e}", "ERROR")
         
         # 删除 Node.js 环境
-        if node_modules_dir.exists():
+        if os.path.lexists(node_modules_dir):
             try:
-                shutil.rmtree(node_modules_dir)
+                self._remove_generations(node_modules_dir, project_dir / NODE_GENERATIONS_DIR)
                 self.log(f"✅ 已删除 Node.js 环境: {node_modules_dir}", "SUCCESS")
                 removed = True
             except Exception as e:
@@ -548,75 +3857,191 @@ class QingLongVenvManager:
             except Exception as e:
                 self.log(f"删除信息文件失败: {e}", "WARNING")
         
+        with self._state_transaction() as conn:
+            if conn is not None:
+                conn.execute("DELETE FROM venvs WHERE project_name = ?", (project_name,))
+        self.write_activation_map()
+        
         if not removed:
             self.log(f"项目 {project_name} 没有虚拟环境需要删除", "WARNING")
             return False
         
         return True
     
+    def _remove_generations(self, link: Path, generations_dir: Path):
+        """删除环境链接，所有代目录改名后在后台删除"""
+        if link.is_symlink():
+            link.unlink()
+        elif link.exists():
+            shutil.rmtree(link)
+        if generations_dir.is_dir():
+            trash = generations_dir.with_name(f".trash-{generations_dir.name}-{os.getpid()}")
+            os.rename(generations_dir, trash)
+            self._remove_in_background([trash])
+
+    def _last_activated(self, project_name: str) -> Optional[float]:
+        """sitecustomize 最近一次激活项目的时间（usage 标记文件的 mtime）"""
+        try:
+            return os.stat(os.path.join(self.usage_dir, project_name)).st_mtime
+        except OSError:
+            return None
+
+    @staticmethod
+    def _parse_size(value: str) -> int:
+        """解析 20G、512M、1.5T 或字节数"""
+        units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+        value = value.strip().upper().rstrip("B")
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+
+    def _disk_usage(self, roots: List[Path], seen: set) -> int:
+        """统计目录实际占用的磁盘空间，seen 中已计入的 inode（硬链接）不再重复计算"""
+        total = 0
+        stack = [str(root) for root in roots if root.is_dir() and not root.is_symlink()]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_blocks * 512
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+        return total
+
+    def _evict_project(self, project_name: str, include_node: bool = False) -> bool:
+        """回收项目的 .venv（可选 node_modules），保留状态记录、.venv_info.json 与锁定结果"""
+        project_dir = Path(self.scripts_dir) / project_name
+        with self._project_lock(project_name, blocking=False) as locked:
+            if not locked:
+                self.log(f"项目 {project_name} 正在重建，跳过", "WARNING")
+                return False
+            try:
+                self._remove_generations(project_dir / ".venv", project_dir / VENV_GENERATIONS_DIR)
+                self._release_shared_venvs(project_name)
+                if include_node and os.path.lexists(project_dir / "node_modules"):
+                    self._remove_generations(project_dir / "node_modules", project_dir / NODE_GENERATIONS_DIR)
+            except OSError as e:
+                self.log(f"回收项目 {project_name} 失败: {e}", "ERROR")
+                return False
+            with self._state_transaction() as conn:
+                if conn is not None:
+                    self._save_state(conn, {"project_name": project_name, "project_dir": str(project_dir),
+                                            "evicted_at": datetime.now().isoformat()})
+        return True
+
+    def gc(self, max_bytes: Optional[int] = None, max_idle_days: Optional[float] = None,
+           include_node: bool = False, dry_run: bool = False) -> List[str]:
+        """按最近使用时间回收虚拟环境，返回被回收的项目
+
+        闲置超过 max_idle_days 的环境全部回收；之后总占用仍超过 max_bytes 时，
+        从最久未使用的环境开始回收。被回收的项目保留状态记录与锁定结果，
+        下次激活或 create 时按锁定结果重建。
+        """
+        self._ensure_indexed()
+
+        seen = set()
+        candidates = []
+        for state in self.load_all_states():
+            if state["evicted_at"] or not state["activation"]:
+                continue
+            project_dir = Path(state["project_dir"])
+            venv_dir = project_dir / ".venv"
+            if not os.path.lexists(venv_dir):
+                continue
+            roots = [project_dir / VENV_GENERATIONS_DIR, venv_dir]
+            if include_node:
+                roots += [project_dir / NODE_GENERATIONS_DIR, project_dir / "node_modules"]
+            size = self._disk_usage(roots, seen)
+            # 共享环境按引用数平摊到各项目
+            shared = {self._shared_venv_hash_of(gen) for gen in (project_dir / VENV_GENERATIONS_DIR).glob("*")
+                      if not gen.name.startswith(".")} - {None}
+            for lock_hash in shared:
+                shared_size = self._disk_usage([Path(self.shared_venv_dir) / lock_hash], set())
+                size += shared_size // max(1, self._shared_venv_refcount(lock_hash))
+
+            last_used = self._last_activated(state["project_name"])
+            if last_used is None:
+                try:
+                    stamp = state["last_activated"] or state["last_updated"] or state["created_at"]
+                    last_used = datetime.fromisoformat(stamp).timestamp()
+                except (TypeError, ValueError):
+                    last_used = 0.0
+            candidates.append((last_used, state["project_name"], size))
+
+        candidates.sort()
+        total = sum(size for _, _, size in candidates)
+        now = time.time()
+        evicted = []
+        print(f"{Colors.WHITE}{'项目名':<25} {'最近使用':<20} {'占用':<12} {'操作':<10}{Colors.NC}")
+        print("-" * 70)
+        for last_used, project_name, size in candidates:
+            idle = max_idle_days is not None and now - last_used > max_idle_days * 86400
+            over = max_bytes is not None and total > max_bytes
+            action = "保留"
+            if idle or over:
+                if dry_run or self._evict_project(project_name, include_node):
+                    evicted.append(project_name)
+                    total -= size
+                    action = "回收" if not dry_run else "将回收"
+            used = datetime.fromtimestamp(last_used).strftime("%Y-%m-%d %H:%M") if last_used else "未知"
+            color = Colors.YELLOW if action != "保留" else Colors.NC
+            print(f"{project_name[:24]:<25} {used:<20} {size / 1024 / 1024:>8.1f} MB  {color}{action}{Colors.NC}")
+        print("-" * 70)
+
+        if evicted and not dry_run:
+            self.write_activation_map()
+        self.log(f"{'预计' if dry_run else '已'}回收 {len(evicted)} 个环境，剩余占用 "
+                 f"{total / 1024 / 1024:.1f} MB", "SUCCESS")
+        return evicted
+
     def list_venvs(self) -> List[Dict[str, any]]:
-        """列出所有虚拟环境"""
+        """列出所有虚拟环境（从状态索引读取）"""
         self.log("扫描虚拟环境...")
         
         if not Path(self.scripts_dir).exists():
             self.log(f"脚本目录不存在: {self.scripts_dir}", "ERROR")
             return []
         
+        # 首次使用时从磁盘建立索引
+        self._ensure_indexed()
+        
         venvs = []
         
-        for item in Path(self.scripts_dir).iterdir():
-            if item.is_dir():
-                project_name = item.name
-                venv_dir = item / ".venv"
-                node_modules_dir = item / "node_modules"
-                info_file = item / ".venv_info.json"
-                
-                venv_info = {
-                    "project_name": project_name,
-                    "project_dir": str(item),
-                    "has_python_venv": venv_dir.exists(),
-                    "has_nodejs_env": node_modules_dir.exists(),
-                    "python_version": "未知",
-                    "package_count": 0,
-                    "created_at": "未知",
-                    "status": "未知"
-                }
-                
-                # 读取详细信息
-                if info_file.exists():
-                    try:
-                        with open(info_file, 'r', encoding='utf-8') as f:
-                            info_data = json.load(f)
-                        venv_info.update({
-                            "python_version": info_data.get("python_version", "未知"),
-                            "package_count": info_data.get("package_count", 0),
-                            "created_at": info_data.get("created_at", "未知")
-                        })
-                    except Exception as e:
-                        self.log(f"读取 {info_file} 失败: {e}", "DEBUG")
-                
-                # 检查虚拟环境状态
-                if venv_dir.exists():
-                    python_path = venv_dir / "bin" / "python"
-                    if python_path.exists():
-                        try:
-                            result = subprocess.run([str(python_path), "--version"], 
-                                                  capture_output=True, text=True, timeout=5)
-                            if result.returncode == 0:
-                                venv_info["status"] = "正常"
-                                if venv_info["python_version"] == "未知":
-                                    venv_info["python_version"] = result.stdout.strip()
-                            else:
-                                venv_info["status"] = "异常"
-                        except:
-                            venv_info["status"] = "异常"
-                    else:
-                        venv_info["status"] = "损坏"
-                elif node_modules_dir.exists():
-                    venv_info["status"] = "Node.js"
-                
-                if venv_info["has_python_venv"] or venv_info["has_nodejs_env"]:
-                    venvs.append(venv_info)
+        for state in self.load_all_states():
+            project_dir = Path(state["project_dir"])
+            venv_dir = project_dir / ".venv"
+            node_modules_dir = project_dir / "node_modules"
+            
+            venv_info = {
+                "project_name": state["project_name"],
+                "project_dir": str(project_dir),
+                "has_python_venv": venv_dir.exists(),
+                "has_nodejs_env": node_modules_dir.exists(),
+                "python_version": state["python_version"] or "未知",
+                "package_count": state["package_count"] or 0,
+                "created_at": state["created_at"] or "未知",
+                "status": "未知"
+            }
+            
+            # 检查虚拟环境状态（解释器链接失效即视为损坏）
+            if venv_info["has_python_venv"]:
+                venv_info["status"] = "正常" if (venv_dir / "bin" / "python").exists() else "损坏"
+            elif venv_info["has_nodejs_env"]:
+                venv_info["status"] = "Node.js"
+            elif state["evicted_at"]:
+                venv_info["status"] = "已回收"
+            
+            if venv_info["has_python_venv"] or venv_info["has_nodejs_env"] or state["evicted_at"]:
+                venvs.append(venv_info)
         
         return venvs
     
@@ -648,7 +4073,7 @@ class QingLongVenvManager:
                 types.append("Python")
             if venv["has_nodejs_env"]:
                 types.append("Node.js")
-            venv_type = "+".join(types)
+            venv_type = "+".join(types) or "-"
             
             python_version = venv["python_version"].replace("Python ", "") if venv["python_version"] != "未知" else "-"
             package_count = str(venv["package_count"]) if venv["package_count"] > 0 else "-"
@@ -664,7 +4089,7 @@ class QingLongVenvManager:
                     created_at = created_at[:16]
             
             # 状态颜色
-            status_color = Colors.GREEN if status == "正常" else Colors.YELLOW if status == "Node.js" else Colors.RED
+            status_color = Colors.GREEN if status == "正常" else Colors.YELLOW if status in ("Node.js", "已回收") else Colors.RED
             
             print(f"{project_name:<25} {venv_type:<15} {python_version:<20} {package_count:<10} "
                   f"{status_color}{status:<10}{Colors.NC} {created_at:<20}")
@@ -672,6 +4097,19 @@ class QingLongVenvManager:
         print("-" * 100)
         self.log(f"共找到 {len(venvs)} 个虚拟环境", "INFO")
     
+    def _print_generations(self, link: Path, generations_dir: Path):
+        """显示当前代与可回滚的上一代"""
+        if not link.is_symlink():
+            return
+        current = self._linked_generation(link, generations_dir)
+        previous = self._previous_generation(generations_dir, current)
+        print(f"  当前代: {current.name if current else os.readlink(link)}")
+        lock_hash = self._shared_venv_hash_of(current) if current is not None else None
+        if lock_hash is not None:
+            print(f"  共享环境: {lock_hash[:12]}（{self._shared_venv_refcount(lock_hash)} 个项目引用）")
+        if previous is not None:
+            print(f"  上一代: {previous.name}（可执行 rollback 切回）")
+
     def show_venv_info(self, project_name: str):
         """显示特定项目的虚拟环境信息"""
         project_dir = Path(self.scripts_dir) / project_name
@@ -686,6 +4124,7 @@ class QingLongVenvManager:
         venv_dir = project_dir / ".venv"
         node_modules_dir = project_dir / "node_modules"
         info_file = project_dir / ".venv_info.json"
+        state = self.load_state(project_name)
         
         # 基本信息
         print(f"项目名称: {Colors.CYAN}{project_name}{Colors.NC}")
@@ -695,22 +4134,23 @@ class QingLongVenvManager:
         if venv_dir.exists():
             print(f"\n{Colors.GREEN}✅ Python 虚拟环境{Colors.NC}")
             print(f"  虚拟环境目录: {venv_dir}")
+            self._print_generations(venv_dir, project_dir / VENV_GENERATIONS_DIR)
             
             python_path = venv_dir / "bin" / "python"
             if python_path.exists():
                 try:
-                    # Python 版本
-                    result = subprocess.run([str(python_path), "--version"], 
-                                          capture_output=True, text=True)
-                    if result.returncode == 0:
-                        print(f"  Python 版本: {result.stdout.strip()}")
+                    # Python 版本与已安装包优先从状态索引读取
+                    if state is not None and state["python_version"]:
+                        print(f"  Python 版本: {state['python_version']}")
+                        packages = state["packages"]
+                    else:
+                        python_version = self.get_venv_python_version(venv_dir)
+                        if python_version:
+                            print(f"  Python 版本: {python_version}")
+                        packages = self.list_installed_packages(venv_dir)
                     
                     # 已安装包
-                    pip_path = venv_dir / "bin" / "pip"
-                    result = subprocess.run([str(pip_path), "list", "--format=freeze"], 
-                                          capture_output=True, text=True)
-                    if result.returncode == 0:
-                        packages = [line for line in result.stdout.split('\n') if line.strip()]
+                    if packages is not None:
                         print(f"  已安装包数量: {len(packages)}")
                         
                         if packages:
@@ -733,6 +4173,7 @@ class QingLongVenvManager:
         if node_modules_dir.exists():
             print(f"\n{Colors.GREEN}✅ Node.js 环境{Colors.NC}")
             print(f"  node_modules 目录: {node_modules_dir}")
+            self._print_generations(node_modules_dir, project_dir / NODE_GENERATIONS_DIR)
             
             package_json = project_dir / "package.json"
             if package_json.exists():
@@ -753,8 +4194,22 @@ class QingLongVenvManager:
         else:
             print(f"\n{Colors.YELLOW}❌ Node.js 环境未创建{Colors.NC}")
         
-        # 详细信息文件
-        if info_file.exists():
+        # 详细信息
+        if state is not None:
+            print(f"\n{Colors.BLUE}📋 详细信息{Colors.NC}")
+            print(f"  创建时间: {state['created_at'] or '未知'}")
+            print(f"  更新时间: {state['last_updated'] or '未知'}")
+            if state["build_seconds"] is not None:
+                print(f"  构建耗时: {state['build_seconds']:.1f}s")
+            last_activated = self._last_activated(project_name)
+            if last_activated is not None:
+                print(f"  最近激活: {datetime.fromtimestamp(last_activated).isoformat(timespec='seconds')}")
+            else:
+                print(f"  最近激活: {state['last_activated'] or '未知'}")
+            if state["evicted_at"]:
+                print(f"  {Colors.YELLOW}已回收: {state['evicted_at'][:16]}（下次激活或 create 时重建）{Colors.NC}")
+            print(f"  管理器: qinglong_venv_manager")
+        elif info_file.exists():
             try:
                 with open(info_file, 'r', encoding='utf-8') as f:
                     info_data = json.load(f)
@@ -814,6 +4269,16 @@ def main():
   # 强制重建虚拟环境
   python3 qinglong_venv_manager.py create my_project --force
   
+  # 加入后台构建队列（立即返回），并查看队列状态
+  python3 qinglong_venv_manager.py enqueue my_project
+  python3 qinglong_venv_manager.py status
+  
+  # 并发同步所有项目的虚拟环境
+  python3 qinglong_venv_manager.py sync --workers 8
+  
+  # 监听依赖文件变化，自动重建虚拟环境
+  python3 qinglong_venv_manager.py watch
+  
   # 开启调试模式查看详细信息
   python3 qinglong_venv_manager.py create my_project --debug
   
@@ -823,6 +4288,33 @@ def main():
   # 查看项目详细信息
   python3 qinglong_venv_manager.py info my_project
   
+  # 从磁盘重建状态索引
+  python3 qinglong_venv_manager.py reindex
+  
+  # 按阶段查看构建耗时分布
+  python3 qinglong_venv_manager.py stats
+  
+  # 将各项目中相同的包文件替换为硬链接
+  python3 qinglong_venv_manager.py dedupe
+  
+  # 探测多个镜像的延迟并查看排名（QL_VENV_INDEX_URL 中用空白或逗号分隔）
+  python3 qinglong_venv_manager.py indexes --refresh
+  
+  # 离线模式，只从本地 wheelhouse 安装
+  python3 qinglong_venv_manager.py --offline create my_project
+  
+  # 使用 uv 并行下载与解析（未安装或失败时回退到 pip；项目目录中的 .venv_installer 可单独指定）
+  python3 qinglong_venv_manager.py --installer uv create my_project
+  
+  # 锁定依赖版本，之后依赖不变时直接按锁定结果安装
+  python3 qinglong_venv_manager.py lock my_project
+  
+  # 回收 30 天未使用的环境，并把总占用控制在 20G 以内（下次激活或 create 时按锁定结果重建）
+  python3 qinglong_venv_manager.py gc --max-idle-days 30 --max-size 20G --dry-run
+  
+  # 切回上一代虚拟环境 / node_modules
+  python3 qinglong_venv_manager.py rollback my_project
+  
   # 删除虚拟环境
   python3 qinglong_venv_manager.py remove my_project
   
@@ -833,13 +4325,43 @@ def main():
     
     # 全局选项
     parser.add_argument('--debug', action='store_true', help='开启调试模式，显示详细信息')
+    parser.add_argument('--data-dir', help='青龙数据目录，默认读取 QL_DATA_DIR 环境变量或 /ql/data')
+    parser.add_argument('--prometheus', action='store_true', help='导出 Prometheus textfile 指标到日志目录')
+    parser.add_argument('--offline', action='store_true', help='离线模式，只从本地 wheelhouse 与 wheel 仓库安装')
+    parser.add_argument('--installer', choices=sorted(INSTALLER_BACKENDS),
+                        help='安装后端，默认读取 QL_VENV_INSTALLER 环境变量或 pip')
     
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
     
     # create 命令
     create_parser = subparsers.add_parser('create', help='创建虚拟环境')
-    create_parser.add_argument('project', help='项目名称')
+    create_parser.add_argument('project', nargs='?', help='项目名称')
     create_parser.add_argument('--force', action='store_true', help='强制重建虚拟环境')
+    create_parser.add_argument('--all', action='store_true', help='为所有项目创建虚拟环境（同 sync）')
+    create_parser.add_argument('--workers', type=int, default=4, help='并发数（配合 --all 使用）')
+    
+    # enqueue 命令
+    enqueue_parser = subparsers.add_parser('enqueue', help='将项目加入后台构建队列后立即返回')
+    enqueue_parser.add_argument('project', help='项目名称')
+    enqueue_parser.add_argument('--force', action='store_true', help='强制重建虚拟环境')
+    
+    # worker 命令
+    worker_parser = subparsers.add_parser('worker', help='处理构建队列直到清空（通常由 enqueue 自动启动）')
+    worker_parser.add_argument('--workers', type=int, default=1, help='同时构建的项目数，默认 1')
+    
+    # status 命令
+    status_parser = subparsers.add_parser('status', help='显示构建队列中的任务')
+    status_parser.add_argument('--limit', type=int, default=20, help='显示最近完成的任务数，默认 20')
+    
+    # sync 命令
+    sync_parser = subparsers.add_parser('sync', help='并发为所有项目创建或更新虚拟环境')
+    sync_parser.add_argument('--force', action='store_true', help='强制重建虚拟环境')
+    sync_parser.add_argument('--workers', type=int, default=4, help='并发数，默认 4')
+    
+    # watch 命令
+    watch_parser = subparsers.add_parser('watch', help='监听依赖文件变化并自动重建虚拟环境')
+    watch_parser.add_argument('--debounce', type=float, default=2.0, help='最后一次写入后等待的秒数，默认 2')
+    watch_parser.add_argument('--workers', type=int, default=1, help='同时重建的项目数，默认 1')
     
     # list 命令
     subparsers.add_parser('list', help='列出所有虚拟环境')
@@ -848,6 +4370,15 @@ def main():
     info_parser = subparsers.add_parser('info', help='显示项目虚拟环境详细信息')
     info_parser.add_argument('project', help='项目名称')
     
+    # lock 命令
+    lock_parser = subparsers.add_parser('lock', help='解析依赖并写入锁定结果 .venv_lock.json')
+    lock_parser.add_argument('project', help='项目名称')
+    lock_parser.add_argument('--refresh', action='store_true', help='忽略缓存重新解析')
+    
+    # rollback 命令
+    rollback_parser = subparsers.add_parser('rollback', help='原子地切回上一代虚拟环境')
+    rollback_parser.add_argument('project', help='项目名称')
+    
     # remove 命令
     remove_parser = subparsers.add_parser('remove', help='删除虚拟环境')
     remove_parser.add_argument('project', help='项目名称')
@@ -860,17 +4391,79 @@ def main():
     check_parser = subparsers.add_parser('check', help='检查依赖文件是否发生变化')
     check_parser.add_argument('project', help='项目名称')
     
+    # reindex 命令
+    subparsers.add_parser('reindex', help='扫描磁盘重建状态索引')
+    
+    # stats 命令
+    stats_parser = subparsers.add_parser('stats', help='按阶段汇总构建耗时 (p50/p95)')
+    stats_parser.add_argument('--project', help='只统计指定项目')
+    stats_parser.add_argument('--top', type=int, default=10, help='列出构建最慢的前 N 个项目，默认 10')
+    
+    # dedupe 命令
+    dedupe_parser = subparsers.add_parser('dedupe', help='将各项目中内容相同的包文件替换为硬链接')
+    dedupe_parser.add_argument('--workers', type=int, default=4, help='计算哈希的并发数，默认 4')
+    
+    # gc 命令
+    gc_parser = subparsers.add_parser('gc', help='按最近使用时间回收虚拟环境，保留锁定结果以便重建')
+    gc_parser.add_argument('--max-size', help='环境总占用上限，如 20G，默认读取 QL_VENV_GC_MAX_SIZE')
+    gc_parser.add_argument('--max-idle-days', type=float,
+                           help='闲置超过该天数的环境全部回收，默认读取 QL_VENV_GC_MAX_IDLE_DAYS')
+    gc_parser.add_argument('--include-node', action='store_true', help='同时回收 node_modules')
+    gc_parser.add_argument('--dry-run', action='store_true', help='只显示将回收的环境')
+    
+    # indexes 命令
+    indexes_parser = subparsers.add_parser('indexes', help='探测依赖来源的延迟并显示排名')
+    indexes_parser.add_argument('--refresh', action='store_true', help='忽略缓存的排名重新探测')
+    
+    # template 命令
+    template_parser = subparsers.add_parser('template', help='创建或刷新当前解释器的模板虚拟环境')
+    template_parser.add_argument('--refresh', action='store_true', help='即使模板已存在也重新创建')
+    
     args = parser.parse_args()
     
     if not args.command:
         parser.print_help()
         return
     
-    manager = QingLongVenvManager(debug=args.debug)
+    manager = QingLongVenvManager(debug=args.debug, data_dir=args.data_dir)
+    if args.prometheus:
+        # 与 --offline 相同写入环境变量，后台 worker 等子进程同样导出指标
+        os.environ["QL_VENV_PROMETHEUS"] = "1"
+        manager.prometheus_file = os.path.join(manager.log_dir, "venv_manager.prom")
+    if args.offline:
+        # 写入环境变量，后台 worker 等子进程同样离线
+        os.environ["QL_VENV_OFFLINE"] = "1"
+        manager.offline = True
+    if args.installer:
+        os.environ["QL_VENV_INSTALLER"] = args.installer
+        manager.installer = args.installer
     
     try:
         if args.command == 'create':
-            success = manager.create_venv(args.project, args.force)
+            if args.all:
+                success = manager.sync_venvs(args.workers, args.force)
+            elif args.project:
+                success = manager.create_venv(args.project, args.force)
+            else:
+                parser.error("create 需要指定项目名称或 --all")
+            sys.exit(0 if success else 1)
+            
+        elif args.command == 'enqueue':
+            sys.exit(0 if manager.enqueue(args.project, args.force) is not None else 1)
+            
+        elif args.command == 'worker':
+            success = manager.run_worker(args.workers)
+            sys.exit(0 if success else 1)
+            
+        elif args.command == 'status':
+            manager.show_status(args.limit)
+            
+        elif args.command == 'sync':
+            success = manager.sync_venvs(args.workers, args.force)
+            sys.exit(0 if success else 1)
+            
+        elif args.command == 'watch':
+            success = manager.watch(args.debounce, args.workers)
             sys.exit(0 if success else 1)
             
         elif args.command == 'list':
@@ -879,6 +4472,14 @@ def main():
         elif args.command == 'info':
             manager.show_venv_info(args.project)
             
+        elif args.command == 'lock':
+            success = manager.lock_project(args.project, args.refresh)
+            sys.exit(0 if success else 1)
+            
+        elif args.command == 'rollback':
+            success = manager.rollback(args.project)
+            sys.exit(0 if success else 1)
+            
         elif args.command == 'remove':
             success = manager.remove_venv(args.project)
             sys.exit(0 if success else 1)
@@ -886,6 +4487,37 @@ def main():
         elif args.command == 'activate':
             manager.activate_venv_command(args.project)
             
+        elif args.command == 'reindex':
+            manager.reindex()
+            
+        elif args.command == 'stats':
+            manager.show_stats(args.project, args.top)
+            
+        elif args.command == 'dedupe':
+            manager.dedupe(args.workers)
+            
+        elif args.command == 'gc':
+            max_size = args.max_size or manager.gc_max_size
+            max_idle_days = args.max_idle_days
+            if max_idle_days is None and manager.gc_max_idle_days:
+                max_idle_days = float(manager.gc_max_idle_days)
+            if max_size is None and max_idle_days is None:
+                parser.error("gc 需要指定 --max-size 或 --max-idle-days")
+            manager.gc(manager._parse_size(max_size) if max_size else None, max_idle_days,
+                       args.include_node, args.dry_run)
+            
+        elif args.command == 'indexes':
+            manager.show_indexes(args.refresh)
+            
+        elif args.command == 'template':
+            template = manager.get_template_path()
+            if args.refresh or not (template / ".template_ready").exists():
+                success = manager.build_template()
+            else:
+                manager.log(f"模板虚拟环境已存在: {template}", "SUCCESS")
+                success = True
+            sys.exit(0 if success else 1)
+            
         elif args.command == 'check':
             changed = manager.check_dependencies_changed(args.project)
             if changed:
@@ -0,0 +1,60 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_bench import load_activation_function
+
+
+class ActivationFallbackTest(unittest.TestCase):
+    """激活映射中没有登记的项目回退到检查 .venv"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self.tmp.name)
+        self.site_packages = (self.data_dir / "scripts" / "legacy" / ".venv" / "lib" /
+                              f"python{sys.version_info[0]}.{sys.version_info[1]}" / "site-packages")
+        self.site_packages.mkdir(parents=True)
+        (self.data_dir / "scripts" / "plain").mkdir(parents=True)
+
+        environ = mock.patch.dict(os.environ, {"QL_DATA_DIR": str(self.data_dir)})
+        environ.start()
+        self.addCleanup(environ.stop)
+        saved_path = list(sys.path)
+        self.addCleanup(sys.path.__setitem__, slice(None), saved_path)
+        self.activate = load_activation_function(self.data_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _run_script(self, project):
+        with mock.patch.object(sys, "argv", [str(self.data_dir / "scripts" / project / "main.py")]), \
+                redirect_stdout(io.StringIO()):
+            return self.activate()
+
+    def test_activates_without_activation_map(self):
+        self.assertTrue(self._run_script("legacy"))
+        self.assertIn(str(self.site_packages), sys.path)
+        self.assertEqual(os.environ["VIRTUAL_ENV_PROJECT"], "legacy")
+
+    def test_activates_project_missing_from_map(self):
+        activation_map = self.data_dir / "venv_cache" / "activation.json"
+        activation_map.parent.mkdir()
+        activation_map.write_text(json.dumps({"scripts_dir": str(self.data_dir / "scripts"), "projects": {}}),
+                                  encoding="utf-8")
+        self.assertTrue(self._run_script("legacy"))
+        self.assertIn(str(self.site_packages), sys.path)
+
+    def test_project_without_venv_is_not_activated(self):
+        self.assertFalse(self._run_script("plain"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_manager import QingLongVenvManager
+
+
+class DedupeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = QingLongVenvManager(data_dir=self.tmp.name)
+        for project in ("a", "b", "c"):
+            package = Path(self.manager.scripts_dir) / project / "node_modules" / "left-pad"
+            package.mkdir(parents=True)
+            (package / "index.js").write_text("module.exports = 1;\n", encoding="utf-8")
+            (Path(self.manager.scripts_dir) / project / "package.json").write_text("{}\n", encoding="utf-8")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _inode(self, project):
+        return os.stat(Path(self.manager.scripts_dir) / project / "node_modules" / "left-pad" / "index.js").st_ino
+
+    def test_links_identical_files(self):
+        stats = self.manager.dedupe()
+        self.assertEqual(stats["linked"], 2)
+        self.assertEqual(len({self._inode(project) for project in ("a", "b", "c")}), 1)
+
+    def test_project_locks_are_not_held_while_hashing(self):
+        held = []
+        hash_file = self.manager._hash_file
+
+        def probe(path):
+            for project in ("a", "b", "c"):
+                with self.manager._project_lock(project, blocking=False) as locked:
+                    held.append(not locked)
+            return hash_file(path)
+
+        with mock.patch.object(self.manager, "_hash_file", probe):
+            self.manager.dedupe(workers=1)
+        self.assertTrue(held)
+        self.assertFalse(any(held))
+
+    def test_skips_project_being_rebuilt(self):
+        inode = self._inode("b")
+        with self.manager._project_lock("b", blocking=False) as locked:
+            self.assertTrue(locked)
+            stats = self.manager.dedupe()
+        self.assertEqual(stats["skipped"], 1)
+        self.assertEqual(self._inode("b"), inode)
+        self.assertEqual(self._inode("a"), self._inode("c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_manager import NODE_DEPENDENCY_TYPES, PYTHON_DEPENDENCY_TYPES, QingLongVenvManager
+
+
+class PerTypeDependencyHashesTest(unittest.TestCase):
+    """同时有 Python 与 Node.js 依赖的项目，两种构建各自只记录自己的指纹"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = QingLongVenvManager(data_dir=self.tmp.name)
+        self.project_dir = Path(self.manager.scripts_dir) / "mixed"
+        self.project_dir.mkdir(parents=True)
+        (self.project_dir / "requirements.txt").write_text("requests==2.31.0\n")
+        self._write_package_json({"left-pad": "1.3.0"})
+        self.venv_dir = self.project_dir / ".venv"
+        subprocess.run([sys.executable, "-m", "venv", "--without-pip", str(self.venv_dir)], check=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write_package_json(self, dependencies):
+        (self.project_dir / "package.json").write_text(json.dumps({"dependencies": dependencies}))
+
+    def _changed(self):
+        return (self.manager.check_dependencies_changed("mixed", PYTHON_DEPENDENCY_TYPES),
+                self.manager.check_dependencies_changed("mixed", NODE_DEPENDENCY_TYPES))
+
+    def test_python_build_does_not_record_package_json(self):
+        self.manager._create_venv_info("mixed", self.venv_dir, self.project_dir)
+        self.assertEqual(self._changed(), (False, True))
+
+    def test_node_change_survives_python_rebuild(self):
+        self.manager._create_venv_info("mixed", self.venv_dir, self.project_dir)
+        with self.manager._state_transaction() as conn:
+            current = self.manager.get_dependency_hashes(self.project_dir, Path(self.manager.repo_dir) / "mixed",
+                                                         dep_types=NODE_DEPENDENCY_TYPES)
+            self.manager._save_state(conn, {"project_name": "mixed", "project_dir": str(self.project_dir),
+                                            "dependency_hashes": self.manager._merge_dependency_hashes(
+                                                self.manager.load_state("mixed")["dependency_hashes"],
+                                                current, NODE_DEPENDENCY_TYPES)})
+        self.assertEqual(self._changed(), (False, False))
+
+        # 修改 package.json 后先进行 Python 构建，Node.js 的变化仍然能被检测到
+        (self.project_dir / "requirements.txt").write_text("requests==2.32.0\n")
+        self._write_package_json({"left-pad": "1.3.0", "is-odd": "3.0.1"})
+        self.assertEqual(self._changed(), (True, True))
+        self.manager._create_venv_info("mixed", self.venv_dir, self.project_dir)
+        self.assertEqual(self._changed(), (False, True))
+        self.assertIn("package.json", self.manager.load_state("mixed")["dependency_hashes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import importlib.util
+import io
+import json
+import threading
+import unittest
+from collections import Counter
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+spec = importlib.util.spec_from_file_location("env_to_json", ROOT / "env-to-json.py")
+env_to_json = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(env_to_json)
+
+
+class StubQingLong(BaseHTTPRequestHandler):
+    """只实现推送用到的 OpenAPI 接口，按 方法+路径 计数"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, data):
+        body = json.dumps({"code": 200, "data": data}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        server.counts[(self.command, path)] += 1
+        if path == "/open/auth/token":
+            return self._reply({"token": "t"})
+        if self.command == "GET":
+            return self._reply(list(server.envs.values()))
+        if self.command == "POST":
+            created = []
+            for env in body:
+                server.next_id += 1
+                created.append(dict(env, id=server.next_id, status=0))
+                server.envs[server.next_id] = created[-1]
+            return self._reply(created)
+        if self.command == "PUT":
+            server.envs[body["id"]].update(body)
+            return self._reply(server.envs[body["id"]])
+        for env_id in body:
+            del server.envs[env_id]
+        return self._reply(None)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class PushEnvsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubQingLong)
+        self.server.counts = Counter()
+        self.server.next_id = 0
+        self.server.envs = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = env_to_json.Client(f"http://127.0.0.1:{self.server.server_port}", "id", "secret")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _seed(self, count, status=0):
+        for index in range(count):
+            self.server.next_id += 1
+            self.server.envs[self.server.next_id] = {
+                "id": self.server.next_id, "name": f"OLD_{index}", "value": "old",
+                "remarks": "r", "status": status}
+
+    def _push(self, envs, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            env_to_json.push_envs(self.client, envs, **kwargs)
+
+    def _values(self):
+        return sorted((env["name"], env["value"]) for env in self.server.envs.values())
+
+    def test_request_count_independent_of_number_of_changes(self):
+        self._seed(40)
+        # 10 个不变、20 个更新、10 个仅存在于青龙，另新增 30 个
+        envs = [{"name": f"OLD_{i}", "value": "old" if i < 10 else "new", "remarks": ""}
+                for i in range(30)]
+        envs += [{"name": f"NEW_{i}", "value": "v", "remarks": ""} for i in range(30)]
+        self._push(envs, prune=True, batch_size=500, update_mode="recreate")
+
+        self.assertEqual(self.server.counts, Counter({
+            ("GET", "/open/auth/token"): 1, ("GET", "/open/envs"): 1,
+            ("POST", "/open/envs"): 1, ("DELETE", "/open/envs"): 1}))
+        self.assertEqual(self._values(), sorted((env["name"], env["value"]) for env in envs))
+
+    def test_batches_follow_batch_size(self):
+        self._seed(25)
+        envs = [{"name": f"OLD_{i}", "value": "new", "remarks": ""} for i in range(25)]
+        envs += [{"name": f"NEW_{i}", "value": "v", "remarks": ""} for i in range(5)]
+        self._push(envs, batch_size=10, update_mode="recreate")
+
+        # 30 个新建（5 新增 + 25 重建）分 3 批，25 个旧 id 分 3 批删除
+        self.assertEqual(self.server.counts[("POST", "/open/envs")], 3)
+        self.assertEqual(self.server.counts[("DELETE", "/open/envs")], 3)
+        self.assertEqual(self.server.counts[("PUT", "/open/envs")], 0)
+
+    def test_updates_in_place_by_default(self):
+        self._seed(3)
+        envs = [{"name": f"OLD_{i}", "value": "new", "remarks": ""} for i in range(3)]
+        self._push(envs)
+
+        self.assertEqual(self.server.counts[("PUT", "/open/envs")], 3)
+        self.assertNotIn(("POST", "/open/envs"), self.server.counts)
+        self.assertNotIn(("DELETE", "/open/envs"), self.server.counts)
+        self.assertEqual(sorted(self.server.envs), [1, 2, 3])
+
+    def test_disabled_variables_keep_their_status(self):
+        self._seed(2, status=1)
+        envs = [{"name": f"OLD_{i}", "value": "new", "remarks": ""} for i in range(2)]
+        self._push(envs, update_mode="recreate")
+
+        self.assertEqual(self.server.counts[("PUT", "/open/envs")], 2)
+        self.assertEqual([env["status"] for env in self.server.envs.values()], [1, 1])
+        self.assertEqual(self._values(), [("OLD_0", "new"), ("OLD_1", "new")])
+
+    def _seed_accounts(self):
+        for index in range(3):
+            self.server.next_id += 1
+            self.server.envs[self.server.next_id] = {
+                "id": self.server.next_id, "name": "COOKIE", "value": f"account{index}",
+                "remarks": f"账号{index}", "status": 0}
+
+    def _assert_accounts_stable(self, update_mode):
+        self._seed_accounts()
+        envs = [{"name": "COOKIE", "value": value, "remarks": ""}
+                for value in ("account0", "changed", "account2")]
+        self._push(envs, update_mode=update_mode)
+        values = [env["value"] for env in self.server.envs.values()]
+        self.assertEqual(values, ["account0", "changed", "account2"])
+        self.assertEqual(sorted(self.server.envs), [1, 2, 3])
+
+        # 同一份 .env 再次推送不再产生任何修改
+        self.server.counts.clear()
+        self._push(envs, update_mode=update_mode)
+        self.assertEqual(sum(self.server.counts.values()), 2)
+
+    def test_multi_account_order_is_kept(self):
+        self._assert_accounts_stable("put")
+
+    def test_recreate_keeps_same_name_variables_in_place(self):
+        self._assert_accounts_stable("recreate")
+
+    def test_dry_run_sends_no_writes(self):
+        self._seed(2)
+        self._push([{"name": "NEW", "value": "v", "remarks": ""}], prune=True, dry_run=True)
+        self.assertEqual(sum(self.server.counts.values()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
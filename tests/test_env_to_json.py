@@ -0,0 +1,87 @@
+import importlib.util
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+spec = importlib.util.spec_from_file_location("env_to_json", ROOT / "env-to-json.py")
+env_to_json = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(env_to_json)
+
+
+def parse(text):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        envs = list(env_to_json.iter_env_file(io.StringIO(text)))
+    return envs, output.getvalue()
+
+
+def values(envs):
+    return [(env["name"], env["value"]) for env in envs]
+
+
+class IterEnvFileTest(unittest.TestCase):
+    def test_export_prefix_and_whitespace(self):
+        envs, _ = parse("export A=1\n  export\tB = two\nexportC=3\n")
+        self.assertEqual(values(envs), [("A", "1"), ("B", "two"), ("exportC", "3")])
+
+    def test_inline_comments(self):
+        envs, _ = parse('A=1 # 注释\nB=x#y\nC="quoted # kept" # 注释\nD= # 空值\nE=\t#tab\n# 整行注释\n')
+        self.assertEqual(values(envs), [("A", "1"), ("B", "x#y"), ("C", "quoted # kept"), ("D", ""), ("E", "")])
+
+    def test_quotes_and_escapes(self):
+        envs, _ = parse('A="line\\nbreak \\"q\\" \\$HOME \\x"\nB=\'single \\\'q\\\' \\n\'\n')
+        self.assertEqual(values(envs), [("A", 'line\nbreak "q" $HOME \\x'), ("B", "single 'q' \\n")])
+
+    def test_multi_line_values(self):
+        envs, _ = parse('KEY="-----BEGIN-----\nabc\n-----END-----"\nNEXT=1\n')
+        self.assertEqual(values(envs), [("KEY", "-----BEGIN-----\nabc\n-----END-----"), ("NEXT", "1")])
+        self.assertEqual(envs[1]["remarks"], "从.env文件第4行导入")
+
+    def test_duplicate_keys_report_line_numbers(self):
+        envs, output = parse("A=1\nB=2\n\nA=3\n")
+        self.assertEqual(values(envs), [("A", "1"), ("B", "2"), ("A", "3")])
+        self.assertIn("第4行的 A 与第1行重复", output)
+
+    def test_invalid_lines_are_reported(self):
+        envs, output = parse("A=1\nnot an assignment\n")
+        self.assertEqual(values(envs), [("A", "1")])
+        self.assertIn("第2行格式不正确", output)
+
+    def test_unterminated_quote_keeps_following_lines(self):
+        envs, output = parse('A=1\nE="unterminated\nF=3\nG=4\n')
+        self.assertEqual(values(envs), [("A", "1"), ("F", "3"), ("G", "4")])
+        self.assertEqual([env["remarks"] for env in envs][1:], ["从.env文件第3行导入", "从.env文件第4行导入"])
+        self.assertIn("第2行的 E 引号未闭合", output)
+
+    def test_nested_unterminated_quotes(self):
+        envs, output = parse("A='x\nB=\"y\nC=3\n")
+        self.assertEqual(values(envs), [("C", "3")])
+        self.assertIn("第1行的 A 引号未闭合", output)
+        self.assertIn("第2行的 B 引号未闭合", output)
+
+
+class WriterTest(unittest.TestCase):
+    envs = [{"name": "A", "value": "值", "remarks": "r"}, {"name": "B", "value": "2", "remarks": "r"}]
+
+    def test_json_array(self):
+        out = io.StringIO()
+        self.assertEqual(env_to_json.write_json_array(iter(self.envs), out), 2)
+        self.assertEqual(json.loads(out.getvalue()), self.envs)
+        self.assertIn("值", out.getvalue())
+
+    def test_empty_json_array(self):
+        out = io.StringIO()
+        self.assertEqual(env_to_json.write_json_array(iter([]), out), 0)
+        self.assertEqual(json.loads(out.getvalue()), [])
+
+    def test_ndjson(self):
+        out = io.StringIO()
+        self.assertEqual(env_to_json.write_ndjson(iter(self.envs), out), 2)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], self.envs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_bench import build_wheel, load_activation_function
+from qinglong_venv_manager import VENV_GENERATIONS_DIR, QingLongVenvManager
+
+
+class GcTest(unittest.TestCase):
+    """a、b 的锁定结果相同（共用一个共享环境），c 独立；均从本地 wheelhouse 构建"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        wheelhouse = root / "wheelhouse"
+        wheelhouse.mkdir()
+        build_wheel(wheelhouse, "qltest_base", "1.0.0", [])
+        build_wheel(wheelhouse, "qltest_app", "2.0.0", ["qltest_base>=1.0"])
+
+        environ = mock.patch.dict(os.environ, {
+            "QL_VENV_INDEX_URL": str(wheelhouse),
+            "PIP_CONFIG_FILE": os.devnull,
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+        for key in ("QL_VENV_OFFLINE", "QL_VENV_INSTALLER", "QL_VENV_SHARED"):
+            os.environ.pop(key, None)
+
+        self.manager = QingLongVenvManager(data_dir=str(root / "data"))
+        requirements = {"a": "qltest_app==2.0.0\n", "b": "qltest_app==2.0.0\n", "c": "qltest_base==1.0.0\n"}
+        for project, text in requirements.items():
+            (Path(self.manager.scripts_dir) / project).mkdir(parents=True)
+            (Path(self.manager.repo_dir) / project).mkdir(parents=True)
+            (Path(self.manager.repo_dir) / project / "requirements.txt").write_text(text, encoding="utf-8")
+            self.assertTrue(self.manager.create_venv(project))
+
+        # a 最久未使用，c 最近使用
+        now = time.time()
+        for project, days in (("a", 10), ("b", 2), ("c", 1)):
+            usage = Path(self.manager.usage_dir) / project
+            usage.parent.mkdir(parents=True, exist_ok=True)
+            usage.touch()
+            os.utime(usage, (now - days * 86400, now - days * 86400))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _gc(self, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return self.manager.gc(**kwargs)
+
+    def _project_dir(self, project):
+        return Path(self.manager.scripts_dir) / project
+
+    def _shared_hash(self, project):
+        generation = self.manager._linked_generation(self._project_dir(project) / ".venv",
+                                                     self._project_dir(project) / VENV_GENERATIONS_DIR)
+        return self.manager._shared_venv_hash_of(generation)
+
+    def _own_size(self, project):
+        project_dir = self._project_dir(project)
+        return self.manager._disk_usage([project_dir / VENV_GENERATIONS_DIR, project_dir / ".venv"], set())
+
+    def test_evicts_idle_projects(self):
+        self.assertEqual(self._gc(max_idle_days=5, dry_run=True), ["a"])
+        self.assertTrue(os.path.lexists(self._project_dir("a") / ".venv"))
+        self.assertEqual(self._gc(max_idle_days=1.5), ["a", "b"])
+
+    def test_evicts_least_recently_used_until_under_size(self):
+        # 共享环境按引用数平摊：a、b 各计一半，回收 a 后 b、c 之和恰好不超过上限；
+        # 不平摊时 b 会计入整个共享环境，也会被回收
+        lock_hash = self._shared_hash("a")
+        self.assertEqual(lock_hash, self._shared_hash("b"))
+        shared = self.manager._disk_usage([Path(self.manager.shared_venv_dir) / lock_hash], set())
+        own_c = self.manager._disk_usage([Path(self.manager.shared_venv_dir) / self._shared_hash("c")], set())
+        limit = self._own_size("b") + shared // 2 + self._own_size("c") + own_c
+        self.assertEqual(self._gc(max_bytes=limit, dry_run=True), ["a"])
+        self.assertEqual(self._gc(max_bytes=0, dry_run=True), ["a", "b", "c"])
+
+    def test_evicted_project_keeps_state_and_rebuilds_from_lock(self):
+        lock_hash = self._shared_hash("a")
+        before = self.manager.load_state("a")
+        resolutions = sorted(os.listdir(self.manager.resolution_dir))
+        self.assertTrue(resolutions)
+
+        self.assertTrue(self.manager._evict_project("a"))
+        project_dir = self._project_dir("a")
+        self.assertFalse(os.path.lexists(project_dir / ".venv"))
+        self.assertFalse(os.path.lexists(project_dir / VENV_GENERATIONS_DIR))
+        # 状态记录、依赖指纹与锁定结果保留；b 仍引用共享环境
+        state = self.manager.load_state("a")
+        self.assertIsNotNone(state["evicted_at"])
+        self.assertEqual(state["dependency_hashes"], before["dependency_hashes"])
+        self.assertEqual(state["resolved"], before["resolved"])
+        self.assertEqual(sorted(os.listdir(self.manager.resolution_dir)), resolutions)
+        self.assertTrue((project_dir / ".venv_info.json").exists())
+        self.assertEqual(self.manager._shared_venv_refcount(lock_hash), 1)
+        self.assertTrue((Path(self.manager.shared_venv_dir) / lock_hash).is_dir())
+
+        self.manager.write_activation_map()
+        with open(self.manager.activation_map_file, encoding="utf-8") as f:
+            self.assertTrue(json.load(f)["projects"]["a"]["evicted"])
+
+        # 按保留的锁定结果重建，不重新解析
+        with mock.patch.object(self.manager, "_resolve_requirements", side_effect=AssertionError("重新解析")):
+            self.assertTrue(self.manager.create_venv("a"))
+        self.assertIsNone(self.manager.load_state("a")["evicted_at"])
+        self.assertEqual(self._shared_hash("a"), lock_hash)
+        self.assertTrue((project_dir / ".venv" / "bin" / "python").exists())
+        self.assertEqual(self.manager._shared_venv_refcount(lock_hash), 2)
+
+
+class RehydrateTimeoutTest(unittest.TestCase):
+    """sitecustomize 同步重建超时后转入后台队列，任务不再阻塞"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self.tmp.name)
+        self.marker = self.data_dir / "enqueued"
+        scripts_dir = self.data_dir / "scripts"
+        (scripts_dir / "demo").mkdir(parents=True)
+        activation_map = {
+            "scripts_dir": str(scripts_dir),
+            "usage_dir": str(self.data_dir / "venv_cache" / "usage"),
+            "rehydrate": [sys.executable, "-c", "import time; time.sleep(60)"],
+            "rehydrate_timeout": 1,
+            "enqueue": [sys.executable, "-c",
+                        f"import sys; open({str(self.marker)!r}, 'w').write(sys.argv[1])"],
+            "projects": {"demo": {"project_dir": str(scripts_dir / "demo"), "site_packages": "/nonexistent",
+                                  "evicted": True}},
+        }
+        (self.data_dir / "venv_cache").mkdir()
+        (self.data_dir / "venv_cache" / "activation.json").write_text(json.dumps(activation_map), encoding="utf-8")
+
+        environ = mock.patch.dict(os.environ, {"QL_DATA_DIR": str(self.data_dir)})
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop("QL_VENV_REHYDRATING", None)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_timeout_enqueues_build(self):
+        activate = load_activation_function(self.data_dir)
+        start = time.monotonic()
+        with mock.patch.object(sys, "argv", [str(self.data_dir / "scripts" / "demo" / "main.py")]), \
+                redirect_stdout(io.StringIO()) as output:
+            self.assertFalse(activate())
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertEqual(self.marker.read_text(), "demo")
+        self.assertIn("后台构建队列", output.getvalue())
+
+    def test_activation_map_carries_timeout_and_enqueue_command(self):
+        manager = QingLongVenvManager(data_dir=str(self.data_dir))
+        manager.write_activation_map()
+        with open(manager.activation_map_file, encoding="utf-8") as f:
+            activation_map = json.load(f)
+        self.assertEqual(activation_map["rehydrate_timeout"], manager.rehydrate_timeout)
+        self.assertEqual(activation_map["enqueue"][-1], "enqueue")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_bench import build_wheel
+from qinglong_venv_manager import VENV_GENERATIONS_DIR, QingLongVenvManager
+
+
+class GenerationTest(unittest.TestCase):
+    """每次构建生成新一代并原子切换 .venv，上一代保留用于回滚"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        wheelhouse = root / "wheelhouse"
+        wheelhouse.mkdir()
+        build_wheel(wheelhouse, "qltest_base", "1.0.0", [])
+        build_wheel(wheelhouse, "qltest_app", "2.0.0", ["qltest_base>=1.0"])
+
+        environ = mock.patch.dict(os.environ, {
+            "QL_VENV_INDEX_URL": str(wheelhouse),
+            "QL_VENV_SHARED": "0",
+            "PIP_CONFIG_FILE": os.devnull,
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+        for key in ("QL_VENV_OFFLINE", "QL_VENV_INSTALLER"):
+            os.environ.pop(key, None)
+
+        self.manager = QingLongVenvManager(data_dir=str(root / "data"))
+        self.project_dir = Path(self.manager.scripts_dir) / "demo"
+        self.project_dir.mkdir(parents=True)
+        (Path(self.manager.repo_dir) / "demo").mkdir(parents=True)
+        self.venv = self.project_dir / ".venv"
+        self.generations_dir = self.project_dir / VENV_GENERATIONS_DIR
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _build(self, requirements):
+        (Path(self.manager.repo_dir) / "demo" / "requirements.txt").write_text(requirements, encoding="utf-8")
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(self.manager.create_venv("demo"))
+        self._assert_valid_link()
+        return self._current()
+
+    def _current(self):
+        return self.manager._linked_generation(self.venv, self.generations_dir)
+
+    def _assert_valid_link(self):
+        self.assertTrue(self.venv.is_symlink())
+        self.assertTrue((self.venv / "bin" / "python").exists())
+
+    def _imports(self, module):
+        result = subprocess.run([str(self.venv / "bin" / "python"), "-c", f"import {module}"], capture_output=True)
+        return result.returncode == 0
+
+    def test_rebuild_keeps_previous_generation_and_rolls_back(self):
+        first = self._build("qltest_base==1.0.0\n")
+        self.assertEqual(first.parent, self.generations_dir)
+        self.assertFalse(self._imports("qltest_app"))
+
+        # 构建新一代期间 .venv 仍指向完整的当前代
+        precompile = self.manager._precompile_bytecode
+
+        def check_during_build(*args, **kwargs):
+            self._assert_valid_link()
+            self.assertEqual(self._current(), first)
+            return precompile(*args, **kwargs)
+
+        with mock.patch.object(self.manager, "_precompile_bytecode", side_effect=check_during_build) as hook:
+            second = self._build("qltest_app==2.0.0\n")
+        hook.assert_called()
+        self.assertNotEqual(second, first)
+        self.assertTrue(self._imports("qltest_app"))
+        self.assertTrue(first.is_dir())
+        self.assertTrue(self.manager._retired_marker(first).exists())
+        self.assertEqual(self.manager._previous_generation(self.generations_dir, second), first)
+
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(self.manager.rollback("demo"))
+        self._assert_valid_link()
+        self.assertEqual(self._current(), first)
+        self.assertFalse(self._imports("qltest_app"))
+        self.assertEqual(self.manager.load_state("demo")["resolved"], {"qltest-base": "1.0.0"})
+        # 回滚后被替换的一代同样保留，可以再切回去
+        self.assertEqual(self.manager._previous_generation(self.generations_dir, first), second)
+
+    def test_existing_venv_directory_is_migrated_to_legacy_generation(self):
+        subprocess.run([sys.executable, "-m", "venv", str(self.venv)], check=True)
+        self.assertFalse(self.venv.is_symlink())
+
+        current = self._build("qltest_base==1.0.0\n")
+        legacy = [entry for entry in self.generations_dir.iterdir() if entry.name.startswith("legacy-")]
+        self.assertEqual(len(legacy), 1)
+        legacy = legacy[0]
+        self.assertNotEqual(current, legacy)
+        self.assertEqual(self.manager._previous_generation(self.generations_dir, current), legacy)
+
+        # 旧环境中的绝对路径改写为新位置，回滚后仍然可用
+        for name in ("pyvenv.cfg", os.path.join("bin", "activate")):
+            content = (legacy / name).read_text(encoding="utf-8")
+            self.assertIn(str(legacy), content)
+            self.assertNotIn(str(self.venv), content.replace(str(legacy), ""))
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(self.manager.rollback("demo"))
+        self.assertEqual(self._current(), legacy)
+        result = subprocess.run([str(self.venv / "bin" / "python"), "-c", "import sys; print(sys.prefix)"],
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import random
+import sys
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_bench import _QuietHandler, _SlowHandler, build_index, build_wheel
+from qinglong_venv_manager import QingLongVenvManager
+
+
+class _CountingHandler(_QuietHandler):
+    requests = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        super().do_GET()
+
+
+class _BrokenHandler(_CountingHandler):
+    """模拟故障镜像：探测页正常，项目页不返回响应直接断开连接"""
+
+    def do_GET(self):
+        type(self).requests += 1
+        if self.path.rstrip("/").endswith("/pip"):
+            self.send_error(404)
+
+
+class IndexFailoverTest(unittest.TestCase):
+    """对 qinglong_venv_bench 生成的本地 PEP 503 索引验证切换、排序与离线模式"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        catalog = build_index(self.root / "index", 3, random.Random(0))
+        self.package = sorted(catalog)[-1]
+
+        self.data_dir = self.root / "data"
+        (self.data_dir / "scripts" / "demo").mkdir(parents=True)
+        (self.data_dir / "repo" / "demo").mkdir(parents=True)
+        (self.data_dir / "repo" / "demo" / "requirements.txt").write_text(self.package + "\n", encoding="utf-8")
+
+        environ = mock.patch.dict(os.environ, {
+            "PIP_CONFIG_FILE": os.devnull,
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+            "PIP_CACHE_DIR": str(self.root / "pip-cache"),
+            # 故障镜像只重试一次，pip 在重试时才会输出连接错误
+            "PIP_RETRIES": "1",
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+        for key in ("PIP_INDEX_URL", "PIP_EXTRA_INDEX_URL", "PIP_FIND_LINKS", "QL_VENV_OFFLINE",
+                    "QL_VENV_INSTALLER"):
+            os.environ.pop(key, None)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _serve(self, handler) -> str:
+        handler = type(handler.__name__, (handler,), {"requests": 0})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(self.root / "index")))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.handlers = getattr(self, "handlers", []) + [handler]
+        return f"http://127.0.0.1:{server.server_address[1]}/simple"
+
+    def _manager(self, *sources: str) -> QingLongVenvManager:
+        os.environ["QL_VENV_INDEX_URL"] = " ".join(sources)
+        return QingLongVenvManager(data_dir=str(self.data_dir))
+
+    def test_ranks_indexes_by_latency(self):
+        slow = self._serve(type("Slow", (_SlowHandler,), {"delay": 0.5}))
+        fast = self._serve(_QuietHandler)
+        dead = "http://127.0.0.1:9/simple"
+        manager = self._manager(dead, slow, fast)
+        self.assertEqual(manager.rank_indexes(), [fast, slow, dead])
+
+    def test_fails_over_to_next_index_and_backs_off(self):
+        broken = self._serve(_BrokenHandler)
+        good = self._serve(_CountingHandler)
+        manager = self._manager(broken, good)
+
+        with mock.patch.object(manager, "rank_indexes", return_value=[broken, good]):
+            self.assertTrue(manager.create_python_venv("demo"))
+        self.assertGreater(self.handlers[0].requests, 0)
+        self.assertGreater(self.handlers[1].requests, 0)
+        self.assertIn(self.package.replace("_", "-"), manager.load_state("demo")["resolved"])
+
+        # 故障镜像进入退避期，即使延迟更低也排到最后
+        entry = manager._load_index_ranking()["indexes"][broken]
+        self.assertEqual(entry["failures"], 1)
+        self.assertEqual(manager.rank_indexes(), [good, broken])
+
+    def test_offline_installs_from_wheelhouse_only(self):
+        index = self._serve(_CountingHandler)
+        wheelhouse = self.root / "wheelhouse"
+        wheelhouse.mkdir()
+        for wheel in (self.root / "index" / "files").iterdir():
+            wheel.replace(wheelhouse / wheel.name)
+        os.environ["QL_VENV_OFFLINE"] = "1"
+        manager = self._manager(index, str(wheelhouse))
+
+        self.assertTrue(manager.create_python_venv("demo"))
+        self.assertIn(self.package.replace("_", "-"), manager.load_state("demo")["resolved"])
+        self.assertEqual(self.handlers[0].requests, 0)
+
+    def test_offline_fails_without_local_wheels(self):
+        index = self._serve(_CountingHandler)
+        wheelhouse = self.root / "wheelhouse"
+        wheelhouse.mkdir()
+        build_wheel(wheelhouse, "qltest_unrelated", "1.0.0", [])
+        os.environ["QL_VENV_OFFLINE"] = "1"
+        manager = self._manager(index, str(wheelhouse))
+
+        self.assertFalse(manager.create_python_venv("demo"))
+        self.assertEqual(self.handlers[0].requests, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
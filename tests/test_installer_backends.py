@@ -0,0 +1,77 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_bench import build_wheel
+from qinglong_venv_manager import QingLongVenvManager, UvInstaller
+
+
+class InstallerBackendTest(unittest.TestCase):
+    """两个安装后端从同一个本地 wheelhouse 安装同一组依赖"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        wheelhouse = root / "wheelhouse"
+        wheelhouse.mkdir()
+        build_wheel(wheelhouse, "qltest_base", "1.0.0", [])
+        build_wheel(wheelhouse, "qltest_app", "2.0.0", ["qltest_base>=1.0"])
+
+        self.data_dir = root / "data"
+        (self.data_dir / "scripts" / "demo").mkdir(parents=True)
+        (self.data_dir / "repo" / "demo").mkdir(parents=True)
+        (self.data_dir / "repo" / "demo" / "requirements.txt").write_text("qltest_app==2.0.0\n", encoding="utf-8")
+
+        environ = mock.patch.dict(os.environ, {
+            "QL_VENV_INDEX_URL": str(wheelhouse),
+            "PIP_CONFIG_FILE": os.devnull,
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+        for key in ("QL_VENV_OFFLINE", "QL_VENV_INSTALLER", "UV_HTTP_TIMEOUT"):
+            os.environ.pop(key, None)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _install(self, installer):
+        manager = QingLongVenvManager(data_dir=str(self.data_dir))
+        manager.installer = installer
+        self.assertTrue(manager.create_python_venv("demo"))
+        state = manager.load_state("demo")
+        self.assertEqual(state["resolved"], {"qltest-app": "2.0.0", "qltest-base": "1.0.0"})
+        return manager
+
+    def test_pip(self):
+        self._install("pip")
+
+    @unittest.skipUnless(UvInstaller(None).available(), "未安装 uv")
+    def test_uv(self):
+        self._install("uv")
+        # 超时只传给 uv 子进程，不残留在本进程的环境中
+        self.assertNotIn("UV_HTTP_TIMEOUT", os.environ)
+
+    def test_fallback_keeps_previous_resolution(self):
+        manager = self._install("pip")
+        # 增量安装失败时回退到 pip 完整重装，此时没有解析结果，不能清空上次的记录
+        with mock.patch.object(manager, "_install_from_wheel_store", side_effect=RuntimeError("仓库不可用")):
+            self.assertTrue(manager.create_python_venv("demo", force=True))
+        self.assertEqual(manager.load_state("demo")["resolved"], {"qltest-app": "2.0.0", "qltest-base": "1.0.0"})
+
+        # 之后依赖减少时按保留的记录卸载不再需要的包
+        (self.data_dir / "repo" / "demo" / "requirements.txt").write_text("qltest_base==1.0.0\n", encoding="utf-8")
+        self.assertTrue(manager.create_python_venv("demo"))
+        packages = manager.list_installed_packages(self.data_dir / "scripts" / "demo" / ".venv")
+        self.assertIn("qltest_base==1.0.0", packages)
+        self.assertNotIn("qltest_app==2.0.0", packages)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import sqlite3
+import sys
+import tempfile
+import unittest
+from contextlib import contextmanager
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_manager import QingLongVenvManager
+
+
+class PhaseMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = QingLongVenvManager(data_dir=self.tmp.name)
+        self.manager.prometheus_file = str(Path(self.tmp.name) / "log" / "venv_manager.prom")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_textfile_written_once_per_build(self):
+        with mock.patch.object(self.manager, "_write_prometheus_textfile",
+                               wraps=self.manager._write_prometheus_textfile) as write:
+            with self.manager._phase("a", "python_build"):
+                for phase in ("resolve", "install", "bytecode"):
+                    with self.manager._phase("a", phase):
+                        pass
+            self.assertEqual(write.call_count, 1)
+
+        text = Path(self.manager.prometheus_file).read_text(encoding="utf-8")
+        for phase in ("python_build", "resolve", "install", "bytecode"):
+            self.assertIn(f'qinglong_venv_phase_runs_total{{project="a",phase="{phase}"}} 1', text)
+
+    def test_state_errors_do_not_fail_the_build(self):
+        @contextmanager
+        def broken_transaction():
+            raise sqlite3.OperationalError("database is locked")
+            yield
+
+        with mock.patch.object(self.manager, "_state_transaction", broken_transaction):
+            with self.manager._phase("a", "python_build") as event:
+                event["exit_code"] = 0
+        self.assertTrue(event["success"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_bench import build_wheel
+from qinglong_venv_manager import VENV_GENERATIONS_DIR, QingLongVenvManager
+
+
+class SharedVenvTest(unittest.TestCase):
+    """a、b 两个项目的依赖锁定结果相同，共用一个共享环境"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        wheelhouse = root / "wheelhouse"
+        wheelhouse.mkdir()
+        build_wheel(wheelhouse, "qltest_base", "1.0.0", [])
+        build_wheel(wheelhouse, "qltest_app", "2.0.0", ["qltest_base>=1.0"])
+
+        environ = mock.patch.dict(os.environ, {
+            "QL_VENV_INDEX_URL": str(wheelhouse),
+            "PIP_CONFIG_FILE": os.devnull,
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+        for key in ("QL_VENV_OFFLINE", "QL_VENV_INSTALLER", "QL_VENV_SHARED"):
+            os.environ.pop(key, None)
+
+        self.manager = QingLongVenvManager(data_dir=str(root / "data"))
+        for project in ("a", "b"):
+            (Path(self.manager.scripts_dir) / project).mkdir(parents=True)
+            (Path(self.manager.repo_dir) / project).mkdir(parents=True)
+            (Path(self.manager.repo_dir) / project / "requirements.txt").write_text(
+                "qltest_app==2.0.0\n", encoding="utf-8")
+            self.assertTrue(self._quiet(self.manager.create_venv, project))
+        self.lock_hash = self._shared_hash("a")
+        self.shared = Path(self.manager.shared_venv_dir) / self.lock_hash
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def _quiet(func, *args, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return func(*args, **kwargs)
+
+    def _venv(self, project):
+        return Path(self.manager.scripts_dir) / project / ".venv"
+
+    def _shared_hash(self, project):
+        return self.manager._shared_venv_hash_of(
+            self.manager._linked_generation(self._venv(project), self._venv(project).parent / VENV_GENERATIONS_DIR))
+
+    def _imports(self, project):
+        result = subprocess.run([str(self._venv(project) / "bin" / "python"), "-c", "import qltest_app"],
+                                capture_output=True)
+        return result.returncode == 0
+
+    def test_projects_share_one_directory(self):
+        self.assertIsNotNone(self.lock_hash)
+        self.assertEqual(self._shared_hash("b"), self.lock_hash)
+        self.assertEqual(os.path.realpath(self._venv("a")), os.path.realpath(self._venv("b")))
+        self.assertEqual(os.path.realpath(self._venv("a")), str(self.shared))
+        self.assertEqual(self.manager._shared_venv_refcount(self.lock_hash), 2)
+        self.assertTrue(self._imports("a") and self._imports("b"))
+
+    def test_shared_directory_removed_with_last_reference(self):
+        self.assertTrue(self._quiet(self.manager.remove_venv, "a"))
+        self.assertTrue((self.shared / "pyvenv.cfg").exists())
+        self.assertEqual(self.manager._shared_venv_refcount(self.lock_hash), 1)
+        self.assertTrue(self._imports("b"))
+
+        self.assertTrue(self._quiet(self.manager.remove_venv, "b"))
+        # 无引用的共享环境先改名为 .trash-* 再在后台删除
+        self.assertFalse(self.shared.exists())
+        self.assertEqual(self.manager._shared_venv_refcount(self.lock_hash), 0)
+
+    def test_force_rebuild_keeps_other_project_working(self):
+        replaced = self.shared.stat().st_ino
+        self.assertTrue(self._quiet(self.manager.create_python_venv, "a", force=True))
+        # 共享环境被原子替换为新构建的环境，b 通过同一路径继续使用
+        self.assertNotEqual(self.shared.stat().st_ino, replaced)
+        self.assertEqual(self._shared_hash("a"), self.lock_hash)
+        self.assertEqual(self._shared_hash("b"), self.lock_hash)
+        self.assertEqual(self.manager._shared_venv_refcount(self.lock_hash), 2)
+        self.assertTrue(self._imports("a"))
+        self.assertTrue(self._imports("b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
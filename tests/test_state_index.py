@@ -0,0 +1,49 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_manager import QingLongVenvManager
+
+
+class StateIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = QingLongVenvManager(data_dir=self.tmp.name)
+        # 升级前已经存在的环境：磁盘上有，状态索引中没有
+        for project in ("a", "b"):
+            (Path(self.manager.scripts_dir) / project / "node_modules" / "left-pad").mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _names(self):
+        return [venv["project_name"] for venv in self.manager.list_venvs()]
+
+    def test_reindexes_when_database_was_created_by_another_command(self):
+        # 入队或阶段指标先创建了 state.db
+        with self.manager._state_transaction() as conn:
+            self.assertIsNotNone(conn)
+        self.assertEqual(self._names(), ["a", "b"])
+
+    def test_reindexes_only_once(self):
+        self.assertEqual(self._names(), ["a", "b"])
+        with mock.patch.object(self.manager, "reindex") as reindex:
+            self.assertEqual(self._names(), ["a", "b"])
+            self.manager.gc(dry_run=True)
+        reindex.assert_not_called()
+
+    def test_gc_sees_existing_environments(self):
+        with self.manager._state_transaction():
+            pass
+        with mock.patch.object(self.manager, "reindex", wraps=self.manager.reindex) as reindex:
+            self.manager.gc(dry_run=True)
+        reindex.assert_called_once()
+        self.assertIsNotNone(self.manager.load_state("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
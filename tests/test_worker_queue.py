@@ -0,0 +1,46 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qinglong_venv_manager import QingLongVenvManager
+
+
+class RequeueStaleJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = QingLongVenvManager(data_dir=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _insert(self, conn, project, status, requests=1, force=0):
+        conn.execute("INSERT INTO jobs (project_name, force, status, requests, enqueued_at) "
+                     "VALUES (?, ?, ?, ?, '2026-01-01T00:00:00')", (project, force, status, requests))
+
+    def _jobs(self):
+        with self.manager._state_transaction() as conn:
+            return [tuple(row) for row in conn.execute(
+                "SELECT project_name, status, requests, force FROM jobs ORDER BY project_name, id")]
+
+    def test_requeues_running_job_without_queued_duplicate(self):
+        with self.manager._state_transaction() as conn:
+            self._insert(conn, "a", "running")
+        self.manager._requeue_stale_jobs()
+        self.assertEqual(self._jobs(), [("a", "queued", 1, 0)])
+
+    def test_merges_running_job_into_existing_queued_job(self):
+        # worker 在运行 a 时退出，之后 a 又被入队：不能违反排队任务的唯一索引
+        with self.manager._state_transaction() as conn:
+            self._insert(conn, "a", "running", requests=2, force=1)
+            self._insert(conn, "a", "queued")
+            self._insert(conn, "b", "running")
+        self.manager._requeue_stale_jobs()
+        self.manager._requeue_stale_jobs()
+        self.assertEqual(self._jobs(), [("a", "queued", 3, 1), ("b", "queued", 1, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()